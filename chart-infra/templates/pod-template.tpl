@@ -18,6 +18,10 @@
           mountPath: /var/lib/shutdown-file
         - name: podinfo
           mountPath: /etc/podinfo
+{{- if .Values.sharedMatrix.claimName }}
+        - name: shared-matrix
+          mountPath: /shared-data
+{{- end }}
         ports:
         - containerPort: 4000
         resources:
@@ -37,6 +41,14 @@
             configMapKeyRef:
               name: instance-config
               key: ignoreTimeout
+        - name: 'MAX_CONCURRENT_TASKS'
+          value: {{ .Values.maxConcurrentTasks | quote }}
+        - name: 'MULTI_REPLICA'
+          value: {{ .Values.multiReplica | quote }}
+{{- if .Values.sharedMatrix.claimName }}
+        - name: 'SHARED_MATRIX_DIR'
+          value: '/shared-data'
+{{- end }}
         volumeMounts:
         - name: 'data'
           mountPath: '/data'
@@ -47,6 +59,10 @@
           mountPath: /var/lib/shutdown-file
         - name: podinfo
           mountPath: /etc/podinfo
+{{- if .Values.sharedMatrix.claimName }}
+        - name: shared-matrix
+          mountPath: /shared-data
+{{- end }}
         resources:
           requests:
             memory: "1Gi"
@@ -97,6 +113,11 @@
             - path: "labels"
               fieldRef:
                 fieldPath: metadata.labels
+{{- if .Values.sharedMatrix.claimName }}
+      - name: shared-matrix
+        persistentVolumeClaim:
+          claimName: {{ .Values.sharedMatrix.claimName | quote }}
+{{- end }}
       restartPolicy: Always
       serviceAccountName: 'deployment-runner'
 {{- end -}}
\ No newline at end of file
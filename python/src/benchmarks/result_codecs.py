@@ -0,0 +1,152 @@
+"""Compares the size and compression time of result codecs.
+
+Payloads are encoded like the results of the tasks that produce the largest
+ones, with random values of realistic sizes. Run from `src/` with
+
+    python -m benchmarks.result_codecs [--cells 100000] [--codecs gzip:6 zstd:3]
+
+`--dictionary PATH` also writes a zstd dictionary trained on small results to
+PATH, to be used with `ZSTD_DICTIONARY_PATH`.
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import ujson
+from worker.helpers.result_codecs import ZstdCodec, parse_codec, train_dictionary
+
+DEFAULT_CODECS = ["gzip:1", "gzip:6", "gzip:9", "zstd:1", "zstd:3", "zstd:9"]
+
+
+def _expression(rng, n_cells):
+    # Sparse counts, most cells do not express the gene
+    values = rng.gamma(1.5, 1.2, n_cells) * (rng.random(n_cells) < 0.3)
+    values = np.round(values, 6).tolist()
+
+    # Cells filtered out of the experiment are null
+    for i in rng.choice(n_cells, n_cells // 50, replace=False):
+        values[i] = None
+
+    return values
+
+
+def gene_expression(rng, n_cells, n_genes=10):
+    return {
+        f"GENE{i}": {
+            "rawExpression": {
+                "mean": 1.2,
+                "stdev": 0.6,
+                "expression": _expression(rng, n_cells),
+            },
+            "truncatedExpression": {
+                "min": 0,
+                "max": 4.1,
+                "expression": _expression(rng, n_cells),
+            },
+            "zScore": _expression(rng, n_cells),
+        }
+        for i in range(n_genes)
+    }
+
+
+def embedding(rng, n_cells):
+    return np.round(rng.normal(0, 10, (n_cells, 2)), 6).tolist()
+
+
+def differential_expression(rng, n_genes=2000):
+    return {
+        "rows": [
+            {
+                "gene_names": f"GENE{i}",
+                "gene_id": f"ENSG{i:011d}",
+                "logFC": float(rng.normal()),
+                "p_val_adj": float(rng.random()),
+                "pct_1": float(rng.random()),
+                "pct_2": float(rng.random()),
+                "auc": float(rng.random()),
+            }
+            for i in range(n_genes)
+        ],
+        "total": n_genes,
+    }
+
+
+def payloads(n_cells, seed=0):
+    rng = np.random.default_rng(seed)
+
+    return {
+        "GeneExpression": ujson.dumps(gene_expression(rng, n_cells)).encode("utf-8"),
+        "GetEmbedding": ujson.dumps(embedding(rng, n_cells)).encode("utf-8"),
+        "DifferentialExpression": ujson.dumps(differential_expression(rng)).encode(
+            "utf-8"
+        ),
+    }
+
+
+def compress(codec, data):
+    out = io.BytesIO()
+
+    start = time.perf_counter()
+    with codec.open(out) as f:
+        f.write(data)
+    elapsed = time.perf_counter() - start
+
+    return out.getvalue(), elapsed
+
+
+def dictionary_samples(seed=1, n_samples=200):
+    """Small results, where a dictionary makes the most difference."""
+    rng = np.random.default_rng(seed)
+
+    return [
+        ujson.dumps(gene_expression(rng, 200, n_genes=1)).encode("utf-8")
+        for _ in range(n_samples)
+    ]
+
+
+def run(n_cells, specs, dictionary=None):
+    codecs = [parse_codec(spec) for spec in specs]
+
+    if dictionary is not None:
+        codecs.append(ZstdCodec(3, dictionary=dictionary))
+        specs = specs + ["zstd:3+dict"]
+
+    cases = payloads(n_cells)
+    if dictionary is not None:
+        sample = dictionary_samples(seed=2, n_samples=1)[0]
+        cases["GeneExpression (1 gene, 200 cells)"] = sample
+
+    print(
+        f"{'payload':<36} {'codec':<12} {'size':>12} {'ratio':>7} {'time (s)':>9}"
+    )
+
+    for name, data in cases.items():
+        for spec, codec in zip(specs, codecs):
+            compressed, elapsed = compress(codec, data)
+            assert codec.decompress(compressed) == data
+
+            print(
+                f"{name:<36} {spec:<12} {len(compressed):>12} "
+                f"{len(data) / len(compressed):>7.2f} {elapsed:>9.3f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cells", type=int, default=100000)
+    parser.add_argument("--codecs", nargs="+", default=DEFAULT_CODECS)
+    parser.add_argument("--dictionary", help="write a trained zstd dictionary here")
+    args = parser.parse_args()
+
+    dictionary = None
+    if args.dictionary:
+        dictionary = train_dictionary(dictionary_samples())
+        with open(args.dictionary, "wb") as f:
+            f.write(dictionary.as_bytes())
+
+    run(args.cells, args.codecs, dictionary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import pytest
+from worker.config import config
+from worker.consume_message import receiver, scheduler
+from worker.helpers import metrics
+from worker.helpers.clients import clients
+from worker.helpers.get_heatmap_cell_order import clear_cell_order_cache
+from worker.helpers.in_flight import clear_in_flight
+from worker.helpers.result_codecs import clear_dictionary_cache
+from worker.helpers.result_index import clear_result_index
+from worker.helpers.s3 import clear_cell_sets_cache
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state(tmp_path, monkeypatch):
+    # Embeddings are cached on disk, each test starts with an empty cache
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_DIR", str(tmp_path / "embeddings"))
+
+    # Clients are shared across the worker, so each test gets new ones
+    # created from whatever boto3 or Emitter mocks it sets up
+    clients.reset()
+    metrics.reset()
+    clear_cell_sets_cache()
+    clear_cell_order_cache()
+    clear_dictionary_cache()
+    clear_result_index()
+    clear_in_flight()
+    scheduler.clear()
+    receiver.clear()
+    yield
+    clients.reset()
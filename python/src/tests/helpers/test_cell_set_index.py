@@ -0,0 +1,99 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from worker.helpers.cell_set_index import (
+    CellSetIndex,
+    as_cell_set_index,
+    difference,
+    intersection,
+    union,
+)
+
+
+class TestCellSetIndex:
+    @pytest.fixture(autouse=True)
+    def load_cellsets(self):
+        with open(os.path.join("tests/data", "MockCellSet.json")) as f:
+            cell_sets = json.load(f)
+            self.cellsets = cell_sets["cellSets"]
+
+    def test_stores_sorted_unique_int32_cell_ids(self):
+        index = CellSetIndex(
+            [{"key": "a", "children": [{"key": "a-1", "cellIds": [3, 1, 3, 2]}]}]
+        )
+
+        cell_ids = index.cell_ids("a-1")
+
+        assert cell_ids.dtype == np.int32
+        assert cell_ids.tolist() == [1, 2, 3]
+
+    def test_cell_ids_of_a_class_include_its_children(self):
+        index = CellSetIndex(self.cellsets)
+
+        assert index.cell_ids("condition").tolist() == [1, 2, 3, 4, 5, 6]
+        assert index.all_cell_ids().tolist() == list(range(1, 11))
+
+    def test_links_parents_and_children(self):
+        index = CellSetIndex(self.cellsets)
+
+        assert index.roots == ["louvain", "condition", "patient"]
+        assert index.children("louvain") == ["louvain-1", "louvain-2"]
+        assert index.parent("louvain-1") == "louvain"
+        assert index.parent("louvain") is None
+        assert index.siblings("louvain-1") == ["louvain-2"]
+        assert index.node("patient-a")["name"] == "Patient A"
+
+    def test_unknown_keys(self):
+        index = CellSetIndex(self.cellsets)
+
+        assert "louvain-3" not in index
+
+        with pytest.raises(KeyError):
+            index.cell_ids("louvain-3")
+
+    def test_cell_ids_can_not_be_modified(self):
+        index = CellSetIndex(self.cellsets)
+
+        with pytest.raises(ValueError):
+            index.cell_ids("louvain-1")[0] = 100
+
+    def test_does_not_modify_the_cell_sets(self):
+        original = json.dumps(self.cellsets)
+
+        CellSetIndex(self.cellsets)
+
+        assert json.dumps(self.cellsets) == original
+
+    def test_set_algebra(self):
+        index = CellSetIndex(self.cellsets)
+        control = index.cell_ids("condition-control")
+        patient_a = index.cell_ids("patient-a")
+        patient_b = index.cell_ids("patient-b")
+
+        assert union(control, patient_b).tolist() == [1, 2, 3, 6, 7, 8, 9, 10]
+        assert union().tolist() == []
+        assert intersection(patient_a, index.cell_ids("condition")).tolist() == [
+            1,
+            2,
+            3,
+            4,
+            5,
+        ]
+        assert difference(patient_a, control).tolist() == [4, 5]
+        assert difference(patient_a, control, [4]).tolist() == [5]
+        assert index.union(["louvain-1", "condition-treated"]).tolist() == [
+            1,
+            2,
+            3,
+            4,
+            5,
+            6,
+        ]
+
+    def test_as_cell_set_index_reuses_indexes(self):
+        index = CellSetIndex(self.cellsets)
+
+        assert as_cell_set_index(index) is index
+        assert isinstance(as_cell_set_index(self.cellsets), CellSetIndex)
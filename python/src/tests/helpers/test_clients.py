@@ -0,0 +1,68 @@
+import boto3
+import mock
+from botocore.stub import Stubber
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.clients import clients
+
+
+class TestClientRegistry:
+    def test_clients_are_created_once(self):
+        with mock.patch("boto3.client") as m:
+            first = clients.s3
+            second = clients.s3
+
+        assert first is second
+        assert m.call_count == 1
+        assert metrics.get_counter("clients.created.s3") == 1
+
+    def test_emitter_reuses_the_redis_client(self):
+        with mock.patch("worker.helpers.clients.Emitter") as emitter:
+            first = clients.emitter
+            second = clients.emitter
+
+        assert first is second
+        emitter.assert_called_once_with({"client": clients.redis})
+
+    def test_queue_url_is_cached(self):
+        sqs = boto3.client("sqs", **config.BOTO_RESOURCE_KWARGS)
+        stubber = Stubber(sqs)
+        stubber.add_response(
+            "get_queue_url",
+            {"QueueUrl": "my_very_valid_and_existing_queue_url"},
+            {"QueueName": config.QUEUE_NAME},
+        )
+
+        with mock.patch("boto3.client") as m, stubber:
+            m.return_value = sqs
+            assert clients.queue_url(config.QUEUE_NAME) == "my_very_valid_and_existing_queue_url"
+            assert clients.queue_url(config.QUEUE_NAME) == "my_very_valid_and_existing_queue_url"
+            stubber.assert_no_pending_responses()
+
+    def test_queue_url_is_not_cached_for_missing_queues(self):
+        sqs = boto3.client("sqs", **config.BOTO_RESOURCE_KWARGS)
+        stubber = Stubber(sqs)
+        stubber.add_client_error(
+            "get_queue_url",
+            service_error_code="AWS.SimpleQueueService.NonExistentQueue",
+            http_status_code=400,
+        )
+        stubber.add_response(
+            "get_queue_url",
+            {"QueueUrl": "my_very_valid_and_existing_queue_url"},
+            {"QueueName": config.QUEUE_NAME},
+        )
+
+        with mock.patch("boto3.client") as m, stubber:
+            m.return_value = sqs
+            try:
+                clients.queue_url(config.QUEUE_NAME)
+            except Exception:
+                pass
+
+            assert clients.queue_url(config.QUEUE_NAME) == "my_very_valid_and_existing_queue_url"
+
+    def test_connections_created_counts_pooled_connections(self):
+        clients.s3
+
+        assert clients.connections_created() == {"s3": 0}
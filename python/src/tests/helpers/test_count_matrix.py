@@ -0,0 +1,242 @@
+import datetime
+import os
+import threading
+import time
+from datetime import timezone
+
+import mock
+import pytest
+import requests
+import responses
+from tests.utils import FakeRedis, FakeS3Object
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.count_matrix import CountMatrix
+
+KEY = "experiment-id/r.rds"
+LAST_MODIFIED = datetime.datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+class TestCountMatrixSharedDir:
+    @pytest.fixture(autouse=True)
+    def set_up(self, tmp_path):
+        self.local_dir = tmp_path / "local"
+        self.shared_dir = tmp_path / "shared"
+        self.other_local_dir = tmp_path / "other-local"
+        os.makedirs(self.local_dir / "experiment-id")
+        os.makedirs(self.other_local_dir / "experiment-id")
+
+        self.s3 = mock.MagicMock()
+        FakeS3Object(b"matrix").mock(self.s3)
+
+        with mock.patch.object(
+            config, "LOCAL_DIR", str(self.local_dir)
+        ), mock.patch.object(
+            config, "SHARED_MATRIX_DIR", str(self.shared_dir)
+        ), mock.patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=mock.PropertyMock,
+            return_value=FakeRedis(),
+        ), mock.patch(
+            "worker.helpers.clients.Emitter"
+        ):
+            yield
+
+    def get_count_matrix(self):
+        with mock.patch("worker.helpers.count_matrix.clients") as clients:
+            clients.s3 = self.s3
+            return CountMatrix()
+
+    def test_workers_download_the_shared_matrix_once(self):
+        last_modified = datetime.datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+        # Workers of different pods have their own local directory
+        for local_dir in [self.local_dir, self.other_local_dir]:
+            with mock.patch.object(config, "LOCAL_DIR", str(local_dir)):
+                count_matrix = self.get_count_matrix()
+                assert count_matrix.download_object(KEY, last_modified)
+
+            local_path = local_dir / KEY
+            assert os.readlink(local_path) == str(self.shared_dir / KEY)
+            assert local_path.read_bytes() == b"matrix"
+
+        assert self.s3.get_object.call_count == 1
+
+    def test_newer_matrices_replace_the_shared_copy(self):
+        self.get_count_matrix().download_object(
+            KEY, datetime.datetime(2022, 1, 1, tzinfo=timezone.utc)
+        )
+
+        FakeS3Object(b"new matrix").mock(self.s3)
+        self.get_count_matrix().download_object(
+            KEY, datetime.datetime.now(tz=timezone.utc) + datetime.timedelta(days=1)
+        )
+
+        assert (self.local_dir / KEY).read_bytes() == b"new matrix"
+        assert os.listdir(self.shared_dir / "experiment-id") == ["r.rds"]
+
+
+class TestCountMatrixSync:
+    @pytest.fixture(autouse=True)
+    def set_up(self, tmp_path):
+        self.s3 = mock.MagicMock()
+        self.s3.list_objects_v2.return_value = {
+            "Contents": [
+                {
+                    "Key": KEY,
+                    "LastModified": LAST_MODIFIED,
+                    "Size": 6,
+                }
+            ]
+        }
+        FakeS3Object(b"matrix").mock(self.s3)
+
+        self.pubsub = mock.MagicMock()
+        self.pubsub.get_message.return_value = None
+        redis = mock.MagicMock()
+        redis.pubsub.return_value = self.pubsub
+
+        with mock.patch.object(config, "LOCAL_DIR", str(tmp_path)), mock.patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=mock.PropertyMock,
+            return_value=redis,
+        ), mock.patch("worker.helpers.clients.Emitter"), mock.patch.object(
+            CountMatrix, "wait_for_r_worker"
+        ) as wait_for_r_worker, mock.patch.object(
+            CountMatrix, "_get_r_worker_status", return_value=None
+        ) as get_r_worker_status:
+            self.wait_for_r_worker = wait_for_r_worker
+            self.get_r_worker_status = get_r_worker_status
+
+            os.makedirs(tmp_path / "experiment-id")
+            with mock.patch("worker.helpers.count_matrix.clients") as clients:
+                clients.s3 = self.s3
+                self.count_matrix = CountMatrix()
+
+            yield
+
+            self.count_matrix.stop()
+
+    def test_synced_matrices_are_not_listed_again_before_tasks(self):
+        self.count_matrix.ensure_synced()
+        self.count_matrix.ensure_synced()
+
+        assert self.s3.list_objects_v2.call_count == 1
+
+        self.count_matrix.stale.set()
+        self.count_matrix.ensure_synced()
+
+        assert self.s3.list_objects_v2.call_count == 2
+
+    def test_tasks_wait_for_the_r_worker_to_load_the_first_matrices(self):
+        self.wait_for_r_worker.side_effect = lambda: self.stale_while_waiting.append(
+            self.count_matrix.stale.is_set()
+        )
+        self.stale_while_waiting = []
+
+        self.count_matrix.ensure_synced()
+
+        assert self.stale_while_waiting == [True]
+        assert not self.count_matrix.stale.is_set()
+
+    def test_previous_matrices_answer_tasks_while_updated_ones_load(self):
+        self.get_r_worker_status.return_value = {"lastModified": "0"}
+        self.wait_for_r_worker.side_effect = lambda: self.stale_while_waiting.append(
+            self.count_matrix.stale.is_set()
+        )
+        self.stale_while_waiting = []
+
+        self.count_matrix.sync()
+
+        assert self.stale_while_waiting == [False]
+
+    def test_matrices_stay_stale_until_uploaded(self):
+        self.s3.list_objects_v2.return_value = {}
+
+        self.count_matrix.ensure_synced()
+        self.count_matrix.ensure_synced()
+
+        assert self.s3.list_objects_v2.call_count == 2
+        assert self.count_matrix.stale.is_set()
+
+    def test_watcher_syncs_when_a_change_is_notified(self):
+        self.count_matrix.sync()
+
+        notified = threading.Event()
+
+        def get_message(timeout):
+            if notified.is_set():
+                return None
+
+            notified.set()
+            return {"type": "message", "data": b"r.rds"}
+
+        self.pubsub.get_message.side_effect = get_message
+
+        with mock.patch.object(config, "MATRIX_SYNC_INTERVAL", 60):
+            self.count_matrix.watch()
+
+            deadline = time.monotonic() + 1
+            while self.s3.list_objects_v2.call_count < 2:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+
+        self.pubsub.subscribe.assert_called_once_with(
+            f"worker-matrix-updated:{config.EXPERIMENT_ID}"
+        )
+
+
+class TestCountMatrixWaitForRWorker:
+    @pytest.fixture(autouse=True)
+    def set_up(self, tmp_path):
+        os.makedirs(tmp_path / config.EXPERIMENT_ID)
+        self.path = tmp_path / config.EXPERIMENT_ID / "r.rds"
+        self.path.write_bytes(b"matrix")
+        self.last_modified = os.path.getmtime(self.path)
+
+        with mock.patch.object(config, "LOCAL_DIR", str(tmp_path)), mock.patch.object(
+            config, "R_WORKER_READY_POLL_INTERVAL", 0
+        ), mock.patch("worker.helpers.count_matrix.clients"):
+            self.count_matrix = CountMatrix()
+            yield
+
+    def add_status(self, last_modified, loading=False):
+        responses.add(
+            responses.GET,
+            f"{config.R_WORKER_URL}/ready",
+            json={
+                "lastModified": f"{last_modified:.6f}",
+                "loadSeconds": 12.5,
+                "loading": loading,
+            },
+        )
+
+    @responses.activate
+    def test_waits_until_the_r_worker_serves_the_matrix_on_disk(self):
+        responses.add(
+            responses.GET,
+            f"{config.R_WORKER_URL}/ready",
+            body=requests.exceptions.ConnectionError(),
+        )
+        self.add_status(self.last_modified - 60, loading=True)
+        self.add_status(self.last_modified)
+
+        self.count_matrix.wait_for_r_worker()
+
+        assert len(responses.calls) == 3
+
+        histograms = metrics.snapshot()["histograms"]
+        assert histograms["count_matrix.r_worker_load_seconds"]["sum"] == 12.5
+        assert histograms["count_matrix.r_worker_wait_seconds"]["count"] == 1
+
+    @responses.activate
+    def test_stops_waiting_after_the_timeout(self):
+        self.add_status(self.last_modified - 60, loading=True)
+
+        with mock.patch.object(config, "R_WORKER_READY_TIMEOUT", 0):
+            self.count_matrix.wait_for_r_worker()
+
+        assert len(responses.calls) == 1
+        assert "count_matrix.r_worker_wait_seconds" not in (
+            metrics.snapshot()["histograms"]
+        )
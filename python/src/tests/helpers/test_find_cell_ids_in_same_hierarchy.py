@@ -16,43 +16,30 @@ class TestFindCellIdsInSameHierarchy:
           self.cellsets = cell_sets["cellSets"]
 
     def test_empty_cell_set_returns_no_cells_hierchy(self):
-        assert find_cell_ids_in_same_hierarchy("", []) == []
+        assert find_cell_ids_in_same_hierarchy("", []).tolist() == []
 
     def test_empty_cell_set_returns_no_cells(self):
-        assert find_all_cell_ids_in_cell_sets([]) == []
+        assert find_all_cell_ids_in_cell_sets([]).tolist() == []
 
     def test_empty_cell_set_returns_appropriate_results_hierarchy(self):
-        assert find_cell_ids_in_same_hierarchy("louvain-2", self.cellsets) == [
+        assert find_cell_ids_in_same_hierarchy("louvain-2", self.cellsets).tolist() == [
             1,
             2,
             3,
             4,
             5,
         ]
-        assert find_cell_ids_in_same_hierarchy("condition-control", self.cellsets) == [
+        assert find_cell_ids_in_same_hierarchy(
+            "condition-control", self.cellsets
+        ).tolist() == [
             4,
             5,
             6,
         ]
 
     def test_empty_cell_set_returns_appropriate_results(self):
-        assert find_all_cell_ids_in_cell_sets(self.cellsets) == [
-            1,
-            2,
-            3,
-            4,
-            5,
-            6,
-            7,
-            8,
-            9,
-            10,
-            1,
-            2,
-            3,
-            4,
-            5,
-            6,
+        # Every cell appears once, even if it is in several cell sets
+        assert find_all_cell_ids_in_cell_sets(self.cellsets).tolist() == [
             1,
             2,
             3,
@@ -64,3 +51,12 @@ class TestFindCellIdsInSameHierarchy:
             9,
             10,
         ]
+
+    def test_does_not_modify_the_cell_sets(self):
+        original = json.dumps(self.cellsets)
+
+        first = find_cell_ids_in_same_hierarchy("louvain-2", self.cellsets)
+        second = find_cell_ids_in_same_hierarchy("louvain-2", self.cellsets)
+
+        assert first.tolist() == second.tolist()
+        assert json.dumps(self.cellsets) == original
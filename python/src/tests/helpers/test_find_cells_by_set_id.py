@@ -3,7 +3,7 @@ from worker.helpers.find_cells_by_set_id import find_cells_by_set_id
 
 class TestFindCellsBySetID:
     def test_empty_cell_set_returns_no_cells(self):
-        assert find_cells_by_set_id("", []) == []
+        assert find_cells_by_set_id("", []).tolist() == []
 
     def test_empty_cell_set_returns_appropriate_results(self):
         haystack = [
@@ -11,8 +11,8 @@ class TestFindCellsBySetID:
             {"cellIds": [4, 5, 6], "key": "fgh"},
         ]
 
-        assert find_cells_by_set_id("asd", haystack) == [1, 2, 3]
-        assert find_cells_by_set_id("fgh", haystack) == [4, 5, 6]
+        assert find_cells_by_set_id("asd", haystack).tolist() == [1, 2, 3]
+        assert find_cells_by_set_id("fgh", haystack).tolist() == [4, 5, 6]
 
     def test_empty_cell_set_returns_appropriate_nested_results(self):
         haystack = [
@@ -20,4 +20,11 @@ class TestFindCellsBySetID:
             {"cellIds": [4, 5, 6], "key": "ijk"},
         ]
 
-        assert find_cells_by_set_id("fgh", haystack) == [1, 2, 3]
+        assert find_cells_by_set_id("fgh", haystack).tolist() == [1, 2, 3]
+
+    def test_cell_classes_return_no_cells(self):
+        haystack = [
+            {"key": "asd", "children": [{"key": "fgh", "cellIds": [1, 2, 3]}]},
+        ]
+
+        assert find_cells_by_set_id("asd", haystack).tolist() == []
@@ -39,3 +39,18 @@ class TestGetDiffExprCellSets:
 
         assert exception_info.value.args[0] == INVALID_INPUT
         assert exception_info.value.args[1] == "No cell id fullfills the 2nd cell set."
+
+    def test_cell_class_basis_does_not_filter_the_cells(self):
+        first_cell_set_name = "louvain-1"
+        second_cell_set_name = "louvain-2"
+
+        # A cell class as basis has no cells, so the comparison is between all cells
+        unfiltered = get_diff_expr_cellsets(
+            "all", first_cell_set_name, second_cell_set_name, self.cellsets
+        )
+        by_class = get_diff_expr_cellsets(
+            "condition", first_cell_set_name, second_cell_set_name, self.cellsets
+        )
+
+        assert by_class[0].tolist() == unfiltered[0].tolist()
+        assert by_class[1].tolist() == unfiltered[1].tolist()
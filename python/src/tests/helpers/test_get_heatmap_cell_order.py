@@ -0,0 +1,168 @@
+import mock
+import pytest
+from tests.data.cell_sets_from_s3 import cell_sets_from_s3
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.cell_set_index import CellSetIndex
+from worker.helpers.get_heatmap_cell_order import (
+    get_cached_heatmap_cell_order,
+    get_heatmap_cell_order,
+)
+
+
+def cell_class(key, children):
+    return {
+        "key": key,
+        "children": [
+            {"key": f"{key}-{i}", "cellIds": cell_ids}
+            for i, cell_ids in enumerate(children)
+        ],
+    }
+
+
+class TestGetHeatmapCellOrder:
+    @pytest.fixture(autouse=True)
+    def load_cellsets(self):
+        self.cellsets = [
+            cell_class("louvain", [list(range(0, 6)), list(range(6, 12))]),
+            cell_class("sample", [[0, 1, 6, 7, 8], [2, 3, 9]]),
+            cell_class("overlapping", [[0, 6, 7], [0, 1, 7]]),
+        ]
+
+    def test_groups_by_tracks_in_order(self):
+        order = get_heatmap_cell_order(
+            "louvain", ["louvain", "sample"], "All", [], 1000, self.cellsets
+        )
+
+        buckets = [[0, 1], [2, 3], [4, 5], [6, 7, 8], [9], [10, 11]]
+
+        assert len(order) == 12
+        start = 0
+        for bucket in buckets:
+            assert sorted(order[start:start + len(bucket)]) == bucket
+            start += len(bucket)
+
+    def test_repeats_cells_in_several_cell_sets_of_a_track(self):
+        order = get_heatmap_cell_order(
+            "louvain", ["overlapping"], "All", [], 1000, self.cellsets
+        )
+
+        assert sorted(order[:3]) == [0, 6, 7]
+        assert sorted(order[3:6]) == [0, 1, 7]
+        assert sorted(order[6:]) == [2, 3, 4, 5, 8, 9, 10, 11]
+
+    def test_removes_hidden_cell_sets(self):
+        order = get_heatmap_cell_order(
+            "louvain", ["louvain"], "All", ["sample-0", "sample-1"], 1000, self.cellsets
+        )
+
+        assert sorted(order[:2]) == [4, 5]
+        assert sorted(order[2:]) == [10, 11]
+
+    def test_selected_points_restrict_the_cells(self):
+        order = get_heatmap_cell_order(
+            "louvain", ["louvain"], "sample/sample-1", [], 1000, self.cellsets
+        )
+
+        assert sorted(order[:2]) == [2, 3]
+        assert order[2:] == [9]
+
+    def test_downsamples_each_bucket_proportionally(self):
+        order = get_heatmap_cell_order(
+            "louvain", ["louvain", "sample"], "All", [], 6, self.cellsets
+        )
+
+        # floor(size / 12 * 6) cells of each bucket
+        assert len(order) == 1 + 1 + 1 + 1 + 0 + 1
+        assert order[0] in [0, 1]
+        assert order[3] in [6, 7, 8]
+
+    def test_same_seed_gives_the_same_order(self):
+        cell_sets = cell_sets_from_s3["cellSets"]
+
+        def order(seed):
+            return get_heatmap_cell_order(
+                "louvain", ["louvain", "sample"], "All", [], 100, cell_sets, seed=seed
+            )
+
+        assert order(1) == order(1)
+        assert order(1) != order(2)
+        assert sorted(order(1)) != sorted(order(2))
+
+
+class TestGetCachedHeatmapCellOrder:
+    @pytest.fixture(autouse=True)
+    def load_cellsets(self):
+        self.cellsets = cell_sets_from_s3["cellSets"]
+        self.settings = {
+            "selectedCellSet": "louvain",
+            "groupedTracks": ["louvain", "sample"],
+            "selectedPoints": "All",
+            "hiddenCellSets": ["louvain-0", "louvain-1"],
+        }
+
+    def get_order(self, index, **settings):
+        return get_cached_heatmap_cell_order(
+            "experiment-id", index, {**self.settings, **settings}
+        )
+
+    def test_repeated_settings_are_not_ordered_again(self):
+        index = CellSetIndex(self.cellsets, version="v1")
+
+        first = self.get_order(index)
+
+        with mock.patch(
+            "worker.helpers.get_heatmap_cell_order.get_heatmap_cell_order"
+        ) as ordering:
+            second = self.get_order(index, hiddenCellSets=["louvain-1", "louvain-0"])
+
+        ordering.assert_not_called()
+        assert first == second
+        assert metrics.get_counter("heatmap_cell_order.cache.hit") == 1
+        assert metrics.get_counter("heatmap_cell_order.cache.miss") == 1
+
+    def test_different_max_cells_are_ordered_again(self):
+        index = CellSetIndex(self.cellsets, version="v1")
+
+        assert len(self.get_order(index, maxCells=100)) < len(self.get_order(index))
+        assert metrics.get_counter("heatmap_cell_order.cache.miss") == 2
+
+    def test_new_cell_sets_version_invalidates_the_cache(self):
+        self.get_order(CellSetIndex(self.cellsets, version="v1"))
+
+        changed_cellsets = [
+            {**cell_set, "children": cell_set["children"][:1]}
+            if cell_set["key"] == "louvain"
+            else cell_set
+            for cell_set in self.cellsets
+        ]
+        changed = CellSetIndex(changed_cellsets, version="v2")
+
+        assert self.get_order(changed, hiddenCellSets=[]) == get_heatmap_cell_order(
+            "louvain", ["louvain", "sample"], "All", [], 1000, changed
+        )
+        assert metrics.get_counter("heatmap_cell_order.cache.hit") == 0
+
+    def test_cell_sets_without_version_are_not_cached(self):
+        index = CellSetIndex(self.cellsets)
+
+        self.get_order(index)
+        self.get_order(index)
+
+        assert metrics.get_counter("heatmap_cell_order.cache.hit") == 0
+        assert metrics.get_counter("heatmap_cell_order.cache.miss") == 0
+
+    def test_least_recently_used_orders_are_dropped(self):
+        index = CellSetIndex(self.cellsets, version="v1")
+
+        with mock.patch.object(config, "CELL_ORDER_CACHE_SIZE", 2):
+            self.get_order(index, maxCells=10)
+            self.get_order(index, maxCells=20)
+            self.get_order(index, maxCells=10)
+            self.get_order(index, maxCells=30)
+
+            self.get_order(index, maxCells=10)
+            assert metrics.get_counter("heatmap_cell_order.cache.hit") == 2
+
+            self.get_order(index, maxCells=20)
+            assert metrics.get_counter("heatmap_cell_order.cache.miss") == 4
@@ -0,0 +1,94 @@
+import threading
+
+import mock
+import pytest
+from redis.exceptions import ConnectionError
+from tests.utils import FakeRedis
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.in_flight import finish_request, start_request
+
+
+class TestInFlight:
+    def test_duplicates_of_running_requests_are_coalesced(self):
+        assert start_request("etag")
+        assert not start_request("etag")
+        assert not start_request("etag")
+        assert start_request("other-etag")
+
+        assert metrics.get_counter("in_flight.coalesced") == 2
+
+    def test_requests_can_run_again_once_finished(self):
+        assert start_request("etag")
+        finish_request("etag")
+
+        assert start_request("etag")
+
+    def test_finishing_unknown_requests_does_nothing(self):
+        finish_request("etag")
+        finish_request(None)
+
+        assert start_request("etag")
+
+
+class TestInFlightLocks:
+    @pytest.fixture(autouse=True)
+    def set_up_redis(self):
+        self.redis = FakeRedis()
+
+        with mock.patch.object(config, "IN_FLIGHT_LOCKS_ENABLED", True), mock.patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=mock.PropertyMock,
+            return_value=self.redis,
+        ):
+            yield
+
+    def test_requests_locked_by_other_workers_are_not_run(self):
+        self.redis.set("worker-in-flight:etag", "other-worker")
+
+        assert not start_request("etag")
+        assert metrics.get_counter("in_flight.locked") == 1
+
+    def test_locks_are_released_when_finished(self):
+        assert start_request("etag")
+        assert "worker-in-flight:etag" in self.redis.values
+        assert self.redis.expires["worker-in-flight:etag"] == config.IN_FLIGHT_LOCK_TTL
+
+        finish_request("etag")
+        assert "worker-in-flight:etag" not in self.redis.values
+
+    def test_locks_taken_by_other_workers_after_expiring_are_kept(self):
+        assert start_request("etag")
+        self.redis.values["worker-in-flight:etag"] = b"other-worker"
+
+        finish_request("etag")
+        assert self.redis.values["worker-in-flight:etag"] == b"other-worker"
+
+    def test_other_requests_do_not_wait_for_redis(self):
+        acquiring = threading.Event()
+        release = threading.Event()
+        set_key = self.redis.set
+
+        def slow_set(name, *args, **kwargs):
+            if name == "worker-in-flight:slow-etag":
+                acquiring.set()
+                release.wait(5)
+            return set_key(name, *args, **kwargs)
+
+        self.redis.set = slow_set
+
+        thread = threading.Thread(target=start_request, args=("slow-etag",))
+        thread.start()
+        assert acquiring.wait(5)
+
+        # Redis is called outside of the lock of the in-flight requests
+        assert start_request("etag")
+        assert not start_request("slow-etag")
+
+        release.set()
+        thread.join()
+
+    def test_requests_are_run_when_redis_fails(self):
+        self.redis.set = mock.Mock(side_effect=ConnectionError("Connection refused"))
+
+        assert start_request("etag")
@@ -0,0 +1,81 @@
+import errno
+import os
+
+import mock
+import pytest
+from tests.utils import FakeS3Object
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.matrix_cache import fetch_matrix
+
+
+class TestMatrixCache:
+    @pytest.fixture(autouse=True)
+    def set_up(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.cache_dir = tmp_path / "cache"
+        self.s3 = mock.MagicMock()
+
+        with mock.patch.object(
+            config, "MATRIX_CACHE_DIR", str(self.cache_dir)
+        ), mock.patch.object(config, "MATRIX_CACHE_BYTES", 1000):
+            yield
+
+    def fetch(self, data, experiment_id):
+        FakeS3Object(data).mock(self.s3)
+
+        path = self.tmp_path / experiment_id / "r.rds"
+        os.makedirs(path.parent, exist_ok=True)
+        fetch_matrix(self.s3, "bucket", f"{experiment_id}/r.rds", str(path))
+
+        return path
+
+    def cached_objects(self):
+        return sorted(os.listdir(self.cache_dir / "objects"))
+
+    def test_objects_are_downloaded_once_per_node(self):
+        path = self.fetch(b"matrix", "experiment-id")
+        other_path = self.fetch(b"matrix", "other-experiment-id")
+
+        assert self.s3.get_object.call_count == 1
+        assert path.read_bytes() == other_path.read_bytes() == b"matrix"
+        assert os.stat(path).st_ino == os.stat(other_path).st_ino
+
+        counters = metrics.snapshot()["counters"]
+        assert counters["matrix_cache.miss"] == 1
+        assert counters["matrix_cache.hit"] == 1
+
+    def test_objects_are_copied_if_they_cannot_be_linked(self):
+        with mock.patch("os.link", side_effect=OSError(errno.EXDEV, "cross-device")):
+            path = self.fetch(b"matrix", "experiment-id")
+            other_path = self.fetch(b"matrix", "other-experiment-id")
+
+        assert self.s3.get_object.call_count == 1
+        assert path.read_bytes() == other_path.read_bytes() == b"matrix"
+        assert os.stat(path).st_ino != os.stat(other_path).st_ino
+
+    def test_least_recently_used_objects_are_evicted(self):
+        first = self.fetch(b"a" * 400, "first")
+        self.fetch(b"b" * 400, "second")
+
+        # Used again, so the second one is the least recently used
+        lock_paths = sorted((self.cache_dir / "locks").iterdir())
+        for i, lock_path in enumerate(lock_paths):
+            os.utime(lock_path, (0, i))
+        self.fetch(b"a" * 400, "first-again")
+
+        self.fetch(b"c" * 400, "third")
+
+        assert len(self.cached_objects()) == 2
+        assert FakeS3Object(b"b" * 400).etag.strip('"') not in self.cached_objects()
+        assert metrics.get_counter("matrix_cache.evicted") == 1
+
+        # Links to evicted objects are still readable
+        assert first.read_bytes() == b"a" * 400
+
+    def test_objects_are_downloaded_directly_without_a_cache(self):
+        with mock.patch.object(config, "MATRIX_CACHE_DIR", None):
+            path = self.fetch(b"matrix", "experiment-id")
+
+        assert path.read_bytes() == b"matrix"
+        assert not self.cache_dir.exists()
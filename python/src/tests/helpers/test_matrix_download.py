@@ -0,0 +1,125 @@
+import io
+import os
+
+import mock
+import pytest
+from botocore.exceptions import ReadTimeoutError
+from tests.utils import FakeS3Object
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.matrix_download import download_matrix
+
+DATA = os.urandom(10 * 1024 + 7)
+
+
+class TestMatrixDownload:
+    @pytest.fixture(autouse=True)
+    def set_up(self, tmp_path):
+        self.path = str(tmp_path / "r.rds")
+        self.s3 = mock.MagicMock()
+
+        with mock.patch.object(
+            config, "MATRIX_DOWNLOAD_PART_SIZE", 1024
+        ), mock.patch.object(config, "MATRIX_DOWNLOAD_CONCURRENCY", 4):
+            yield
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_downloads_ranges_concurrently(self):
+        FakeS3Object(DATA).mock(self.s3)
+
+        download_matrix(self.s3, "bucket", "r.rds", self.path)
+
+        assert self.read() == DATA
+        assert self.s3.get_object.call_count == 11
+        assert os.listdir(os.path.dirname(self.path)) == ["r.rds"]
+
+        histograms = metrics.snapshot()["histograms"]
+        assert histograms["matrix_download.bytes"]["sum"] == len(DATA)
+
+    def test_verifies_objects_uploaded_in_parts(self):
+        FakeS3Object(DATA, part_size=3000).mock(self.s3)
+
+        download_matrix(self.s3, "bucket", "r.rds", self.path)
+
+        assert self.read() == DATA
+        # Ranges are aligned to the parts the object was uploaded in
+        ranges = sorted(c.kwargs["Range"] for c in self.s3.get_object.call_args_list)
+        assert ranges == [
+            "bytes=0-2999",
+            "bytes=3000-5999",
+            "bytes=6000-8999",
+            f"bytes=9000-{len(DATA) - 1}",
+        ]
+
+    @pytest.mark.parametrize("part_size", [None, 3000])
+    def test_corrupted_downloads_are_discarded(self, part_size):
+        fake_object = FakeS3Object(DATA, part_size=part_size)
+        fake_object.mock(self.s3)
+        fake_object.data = DATA[:-1] + b"\0"
+
+        with open(self.path, "wb") as f:
+            f.write(b"previous matrix")
+
+        with pytest.raises(ValueError, match="expected"):
+            download_matrix(self.s3, "bucket", "r.rds", self.path)
+
+        assert self.read() == b"previous matrix"
+        assert os.listdir(os.path.dirname(self.path)) == ["r.rds"]
+
+    def test_failed_ranges_are_retried(self):
+        fake_object = FakeS3Object(DATA)
+        fake_object.mock(self.s3)
+
+        failed = []
+
+        def get_object(Bucket, Key, Range):
+            if not failed:
+                failed.append(Range)
+                raise ReadTimeoutError(endpoint_url="s3")
+
+            return fake_object.get_object(Bucket, Key, Range)
+
+        self.s3.get_object.side_effect = get_object
+
+        with mock.patch("time.sleep"):
+            download_matrix(self.s3, "bucket", "r.rds", self.path)
+
+        assert self.read() == DATA
+        assert self.s3.get_object.call_count == 12
+
+    def test_truncated_responses_are_retried(self):
+        fake_object = FakeS3Object(DATA)
+        fake_object.mock(self.s3)
+
+        truncated = []
+
+        def get_object(Bucket, Key, Range):
+            response = fake_object.get_object(Bucket, Key, Range)
+            if not truncated:
+                truncated.append(Range)
+                response["Body"] = io.BytesIO(response["Body"].read()[:10])
+
+            return response
+
+        self.s3.get_object.side_effect = get_object
+
+        with mock.patch("time.sleep"):
+            download_matrix(self.s3, "bucket", "r.rds", self.path)
+
+        assert self.read() == DATA
+
+    def test_objects_encrypted_with_kms_are_not_verified(self):
+        fake_object = FakeS3Object(DATA)
+        fake_object.mock(self.s3)
+        self.s3.head_object.side_effect = lambda Bucket, Key: {
+            "ContentLength": len(DATA),
+            "ETag": '"not-an-md5"',
+            "ServerSideEncryption": "aws:kms",
+        }
+
+        download_matrix(self.s3, "bucket", "r.rds", self.path)
+
+        assert self.read() == DATA
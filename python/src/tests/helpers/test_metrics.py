@@ -0,0 +1,31 @@
+from worker.helpers import metrics
+
+
+class TestMetrics:
+    def test_increment_counts(self):
+        metrics.increment("cache.hit")
+        metrics.increment("cache.hit", 2)
+
+        assert metrics.get_counter("cache.hit") == 3
+        assert metrics.get_counter("cache.miss") == 0
+
+    def test_observe_builds_histogram(self):
+        for value in [0.5, 3, 4, 1000]:
+            metrics.observe("latency", value)
+
+        histogram = metrics.get_histogram("latency")
+
+        assert histogram["count"] == 4
+        assert histogram["sum"] == 1007.5
+        assert histogram["min"] == 0.5
+        assert histogram["max"] == 1000
+        assert histogram["buckets"] == {"<=0.5": 1, "<=4": 2, "<=1024": 1}
+
+    def test_snapshot_contains_everything(self):
+        metrics.increment("a")
+        metrics.observe("b", 1)
+
+        snapshot = metrics.snapshot()
+
+        assert snapshot["counters"] == {"a": 1}
+        assert snapshot["histograms"]["b"]["count"] == 1
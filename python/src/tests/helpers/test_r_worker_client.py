@@ -0,0 +1,218 @@
+import json
+import struct
+
+import mock
+import numpy as np
+import pytest
+import requests
+import responses
+from exceptions import RWorkerException
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.clients import clients
+from worker.helpers.r_worker_client import (BINARY_CONTENT_TYPE,
+                                            DEFAULT_TIMEOUT, ENDPOINT_TIMEOUTS,
+                                            RWorkerClient, encode_request)
+
+
+class TestRWorkerClient:
+    @responses.activate
+    def test_post_returns_data(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/getNUmis",
+            json={"data": [1, 2, 3]},
+            status=200,
+        )
+
+        assert RWorkerClient().post("getNUmis", {}) == [1, 2, 3]
+        assert json.loads(responses.calls[0].request.body) == {}
+
+    @responses.activate
+    def test_post_raises_r_worker_errors(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/getNUmis",
+            json={"error": {"error_code": "R_ERROR", "user_message": "Oops"}},
+            status=200,
+        )
+
+        with pytest.raises(RWorkerException) as exc_info:
+            RWorkerClient().post("getNUmis", {})
+
+        assert exc_info.value.error_code == "R_ERROR"
+
+    @responses.activate
+    def test_post_records_latency_and_sizes(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/listGenes",
+            json={"data": "a" * 100},
+            status=200,
+        )
+
+        RWorkerClient().post("listGenes", {"genes": ["Tpt1"]})
+
+        assert metrics.get_histogram("r_worker.listGenes.seconds")["count"] == 1
+        assert metrics.get_histogram("r_worker.listGenes.request_bytes")["sum"] == len(
+            json.dumps({"genes": ["Tpt1"]})
+        )
+        assert metrics.get_histogram("r_worker.listGenes.response_bytes")["sum"] > 100
+
+    def test_post_uses_endpoint_timeouts(self):
+        client = RWorkerClient()
+
+        with mock.patch.object(client.session, "post") as post:
+            post.return_value.json.return_value = {"data": {}}
+
+            client.post("GetNormalizedExpression", {})
+            assert post.call_args.kwargs["timeout"] == ENDPOINT_TIMEOUTS["GetNormalizedExpression"]
+
+            client.post("ClusterCells", {})
+            assert post.call_args.kwargs["timeout"] == DEFAULT_TIMEOUT
+
+        # Only the connection times out, long tasks are never cut short
+        assert DEFAULT_TIMEOUT[1] is None
+
+    @responses.activate
+    def test_requests_rejected_while_the_r_worker_drains_are_retried(self):
+        url = f"{config.R_WORKER_URL}/v0/getNUmis"
+        responses.add(responses.POST, url, status=409)
+        responses.add(responses.POST, url, status=409)
+        responses.add(responses.POST, url, json={"data": [1]}, status=200)
+
+        with mock.patch("time.sleep"):
+            assert RWorkerClient().post("getNUmis", {}) == [1]
+
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_requests_rejected_after_the_drain_timeout_fail(self):
+        responses.add(
+            responses.POST, f"{config.R_WORKER_URL}/v0/getNUmis", status=409
+        )
+
+        with mock.patch("time.sleep"), mock.patch.object(
+            config, "R_WORKER_DRAIN_TIMEOUT", 0
+        ), pytest.raises(requests.exceptions.HTTPError):
+            RWorkerClient().post("getNUmis", {})
+
+    @responses.activate
+    def test_post_raw_passes_data_through(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/getNUmis",
+            body=b'{"error":null,"data":[1.5,2,null]}',
+            status=200,
+        )
+
+        assert RWorkerClient().post_raw("getNUmis", {}) == b"[1.5,2,null]"
+        assert metrics.get_counter("r_worker.passthrough.hit") == 1
+
+    @responses.activate
+    def test_post_raw_decodes_other_layouts(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/getNUmis",
+            json={"data": [1, 2, 3]},
+            status=200,
+        )
+
+        assert json.loads(RWorkerClient().post_raw("getNUmis", {})) == [1, 2, 3]
+        assert metrics.get_counter("r_worker.passthrough.miss") == 1
+
+    @responses.activate
+    def test_post_raw_raises_r_worker_errors(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/getNUmis",
+            json={"error": {"error_code": "R_ERROR", "user_message": "Oops"}, "data": None},
+            status=200,
+        )
+
+        with pytest.raises(RWorkerException) as exc_info:
+            RWorkerClient().post_raw("getNUmis", {})
+
+        assert exc_info.value.error_code == "R_ERROR"
+
+    @responses.activate
+    def test_post_sends_integer_arrays_as_binary_vectors(self):
+        responses.add(
+            responses.POST,
+            f"{config.R_WORKER_URL}/v0/DifferentialExpression",
+            json={"data": {}},
+            status=200,
+        )
+
+        request = {
+            "baseCells": np.array([1, 2, 3], dtype=np.int32),
+            "backgroundCells": np.array([70000, 5], dtype=np.int64),
+            "genesOnly": False,
+        }
+
+        RWorkerClient().post("DifferentialExpression", request)
+
+        sent = responses.calls[0].request
+        assert sent.headers["content-type"] == BINARY_CONTENT_TYPE
+
+        body = sent.body
+        (header_length,) = struct.unpack("<I", body[:4])
+        header = json.loads(body[4:4 + header_length])
+
+        assert header == {
+            "body": {"genesOnly": False},
+            "names": ["baseCells", "backgroundCells"],
+            "lengths": [3, 2],
+            "types": ["integer", "integer"],
+            "ncols": [0, 0],
+        }
+        assert np.frombuffer(body[4 + header_length:], dtype="<i4").tolist() == [
+            1, 2, 3, 70000, 5
+        ]
+
+    def test_float_matrices_are_sent_as_binary_double_vectors(self):
+        embedding = np.array([[0.1, 2.5], [np.nan, np.nan], [-3.0, 4.25]])
+
+        body, content_type = encode_request({"embedding": embedding, "n": np.int32(3)})
+
+        assert content_type == BINARY_CONTENT_TYPE
+
+        (header_length,) = struct.unpack("<I", body[:4])
+        header = json.loads(body[4:4 + header_length])
+
+        assert header == {
+            "body": {"n": 3},
+            "names": ["embedding"],
+            "lengths": [6],
+            "types": ["double"],
+            "ncols": [2],
+        }
+
+        # Row-major, with the exact coordinates and NaN for missing cells
+        sent = np.frombuffer(body[4 + header_length:], dtype="<f8").reshape(3, 2)
+        np.testing.assert_array_equal(sent, embedding)
+
+    def test_requests_without_arrays_are_json(self):
+        body, content_type = encode_request({"n": np.int32(3)})
+
+        assert content_type == "application/json"
+        assert json.loads(body) == {"n": 3}
+
+    def test_missing_values_of_float_arrays_are_na_in_json(self):
+        embedding = np.array([[0.1, 2.5], [np.nan, np.nan]])
+
+        with mock.patch.object(config, "R_WORKER_BINARY_REQUESTS", False):
+            body, content_type = encode_request({"embedding": embedding})
+
+        assert content_type == "application/json"
+        assert json.loads(body) == {"embedding": [[0.1, 2.5], ["NA", "NA"]]}
+
+    def test_binary_requests_can_be_disabled(self):
+        with mock.patch.object(config, "R_WORKER_BINARY_REQUESTS", False):
+            body, content_type = encode_request({"cell_ids": np.array([1, 2])})
+
+        assert content_type == "application/json"
+        assert json.loads(body) == {"cell_ids": [1, 2]}
+
+    def test_all_tasks_share_the_same_client(self):
+        assert clients.r_worker is clients.r_worker
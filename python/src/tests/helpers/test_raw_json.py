@@ -0,0 +1,34 @@
+import json
+
+from worker.helpers.raw_json import add_field, extract_data
+
+
+class TestRawJson:
+    def test_extract_data_slices_the_data_of_successful_responses(self):
+        body = b'{"error":null,"data":{"truncatedExpression":[1.5,null]}}'
+
+        assert extract_data(body) == b'{"truncatedExpression":[1.5,null]}'
+
+    def test_extract_data_allows_whitespace(self):
+        body = b' { "error" : null ,\n "data" : [1, 2, 3] }\n'
+
+        assert extract_data(body) == b"[1, 2, 3]"
+
+    def test_extract_data_does_not_slice_errors(self):
+        body = b'{"error":{"error_code":"R_ERROR","user_message":"Oops"},"data":null}'
+
+        assert extract_data(body) is None
+
+    def test_extract_data_does_not_slice_other_layouts(self):
+        assert extract_data(b'{"data":[1,2,3],"error":null}') is None
+        assert extract_data(b'{"data":[1,2,3]}') is None
+
+    def test_add_field(self):
+        raw = add_field(b'{"a": 1} ', "cellOrder", [3, 1, 2])
+
+        assert json.loads(raw) == {"a": 1, "cellOrder": [3, 1, 2]}
+
+    def test_add_field_to_empty_object(self):
+        raw = add_field(b"{ }", "cellOrder", [3, 1, 2])
+
+        assert json.loads(raw) == {"cellOrder": [3, 1, 2]}
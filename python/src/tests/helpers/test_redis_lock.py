@@ -0,0 +1,110 @@
+import threading
+
+import mock
+import pytest
+from tests.utils import FakeRedis
+from worker.helpers.redis_lock import EXTEND_SCRIPT, RedisLock
+
+
+class TestRedisLock:
+    @pytest.fixture(autouse=True)
+    def set_up_redis(self):
+        self.redis = FakeRedis()
+
+        with mock.patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=mock.PropertyMock,
+            return_value=self.redis,
+        ):
+            yield
+
+    def test_lock_is_held_in_redis(self):
+        lock = RedisLock("key", 10)
+
+        assert lock.acquire()
+        assert self.redis.get("key") == lock._token.encode("utf-8")
+
+        lock.release()
+        assert not self.redis.exists("key")
+
+    def test_each_acquire_uses_a_new_token(self):
+        lock = RedisLock("key", 10)
+
+        lock.acquire()
+        first = self.redis.get("key")
+        lock.release()
+
+        lock.acquire()
+        assert self.redis.get("key") != first
+        lock.release()
+
+    def test_lock_of_another_pod_with_the_same_hostname_is_kept(self):
+        lock = RedisLock("key", 10)
+        other = RedisLock("key", 10)
+
+        lock.acquire()
+
+        # The lock expired and was taken by a pod with the same hostname
+        self.redis.delete("key")
+        other.acquire()
+
+        lock.release()
+        assert self.redis.get("key") == other._token.encode("utf-8")
+        other.release()
+
+    def test_lock_is_extended_while_held(self):
+        extended = threading.Event()
+        run_script = self.redis.eval
+
+        def eval(script, *args):
+            if script == EXTEND_SCRIPT:
+                extended.set()
+            return run_script(script, *args)
+
+        lock = RedisLock("key", 0.03)
+
+        with mock.patch.object(self.redis, "eval", side_effect=eval):
+            lock.acquire()
+            assert extended.wait(1)
+            lock.release()
+
+        assert not self.redis.exists("key")
+
+    def test_lock_held_by_another_worker_is_not_acquired(self):
+        self.redis.set("key", "other-worker")
+        lock = RedisLock("key", 10, poll_interval=0.01)
+
+        assert not lock.acquire(blocking=False)
+        assert not lock.acquire(timeout=0.05)
+
+        # The lock can still be acquired by this worker once released
+        self.redis.delete("key")
+        assert lock.acquire(blocking=False)
+
+    def test_releasing_a_lock_taken_by_another_worker_keeps_it(self):
+        lock = RedisLock("key", 10)
+        lock.acquire()
+
+        # The lock expired and was taken by another worker
+        self.redis.set("key", "other-worker")
+        lock.release()
+
+        assert self.redis.get("key") == b"other-worker"
+
+    def test_threads_of_the_same_worker_wait_for_each_other(self):
+        lock = RedisLock("key", 10, poll_interval=0.01)
+        lock.acquire()
+
+        acquired = threading.Event()
+
+        def acquire():
+            with lock:
+                acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+
+        assert not acquired.wait(0.05)
+        lock.release()
+        assert acquired.wait(1)
+        thread.join()
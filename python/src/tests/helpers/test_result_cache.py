@@ -0,0 +1,88 @@
+import mock
+import pytest
+from redis.exceptions import ConnectionError
+from tests.utils import FakeRedis
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.result_cache import cache_result, get_cached_result
+
+METADATA = {"content-codec": "gzip"}
+
+
+class TestResultCache:
+    @pytest.fixture(autouse=True)
+    def set_up_redis(self):
+        self.redis = FakeRedis()
+
+        # Each result is stored a second after the previous one
+        self.now = 1000
+
+        def now():
+            self.now += 1
+            return self.now
+
+        with mock.patch.object(config, "RESULT_CACHE_ENABLED", True), mock.patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=mock.PropertyMock,
+            return_value=self.redis,
+        ), mock.patch("worker.helpers.result_cache.time.time", side_effect=now):
+            yield
+
+    def test_stores_small_results_with_their_metadata_and_ttl(self):
+        assert cache_result("etag", b"result", METADATA)
+
+        assert get_cached_result("etag") == (b"result", METADATA)
+        assert self.redis.expires["worker-results:etag"] == config.RESULT_CACHE_TTL
+        assert metrics.get_counter("result_cache.hit") == 1
+
+    def test_large_results_are_not_stored(self):
+        with mock.patch.object(config, "RESULT_CACHE_MAX_RESULT_BYTES", 5):
+            assert not cache_result("etag", b"result", METADATA)
+
+        assert get_cached_result("etag") is None
+        assert metrics.get_counter("result_cache.miss") == 1
+
+    def test_least_recently_stored_results_are_evicted_over_the_size_budget(self):
+        with mock.patch.object(config, "RESULT_CACHE_BYTES", 20):
+            cache_result("etag-1", b"x" * 10, METADATA)
+            cache_result("etag-2", b"x" * 10, METADATA)
+            cache_result("etag-1", b"x" * 10, METADATA)
+            cache_result("etag-3", b"x" * 10, METADATA)
+
+        assert get_cached_result("etag-1") is not None
+        assert get_cached_result("etag-2") is None
+        assert get_cached_result("etag-3") is not None
+        assert self.redis.get("worker-results:stored-bytes") == b"20"
+        assert metrics.get_counter("result_cache.evicted") == 1
+
+    def test_results_stored_again_count_once_with_their_new_size(self):
+        cache_result("etag", b"x" * 10, METADATA)
+        cache_result("etag", b"x" * 5, METADATA)
+
+        assert self.redis.get("worker-results:stored-bytes") == b"5"
+
+    def test_expired_results_do_not_count_towards_the_budget(self):
+        cache_result("etag-1", b"x" * 10, METADATA)
+
+        # Expired by Redis
+        self.redis.delete("worker-results:etag-1")
+        self.now += config.RESULT_CACHE_TTL
+        cache_result("etag-2", b"x" * 10, METADATA)
+
+        assert self.redis.get("worker-results:stored-bytes") == b"10"
+        assert list(self.redis.values["worker-results:stored-at"]) == ["etag-2"]
+        assert metrics.get_counter("result_cache.evicted") == 0
+
+    def test_redis_errors_are_ignored(self):
+        self.redis.eval = mock.Mock(side_effect=ConnectionError("Connection refused"))
+        self.redis.get = mock.Mock(side_effect=ConnectionError("Connection refused"))
+
+        assert not cache_result("etag", b"result", METADATA)
+        assert get_cached_result("etag") is None
+
+    def test_does_nothing_when_disabled(self):
+        with mock.patch.object(config, "RESULT_CACHE_ENABLED", False):
+            assert not cache_result("etag", b"result", METADATA)
+            assert get_cached_result("etag") is None
+
+        assert self.redis.values == {}
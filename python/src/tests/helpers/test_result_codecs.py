@@ -0,0 +1,97 @@
+import gzip
+import io
+
+import mock
+import pytest
+import zstandard
+from worker.config import config
+from worker.helpers.result_codecs import (
+    GzipCodec,
+    ZstdCodec,
+    get_object_codec,
+    get_result_codec,
+    parse_codec,
+    train_dictionary,
+)
+
+DATA = b'{"truncatedExpression":{"expression":[1.5,null,0,0,2.25]}}' * 100
+
+
+def compress(codec, data=DATA):
+    out = io.BytesIO()
+    with codec.open(out) as f:
+        f.write(data)
+
+    return out
+
+
+class TestResultCodecs:
+    def test_parses_codecs_with_and_without_levels(self):
+        assert parse_codec("gzip").level == 9
+        assert parse_codec("gzip:6").level == 6
+        assert parse_codec("zstd").level == 3
+        assert parse_codec(" zstd:12 ").level == 12
+
+        with pytest.raises(ValueError):
+            parse_codec("brotli")
+
+    def test_gzip_results_can_be_decompressed_by_clients(self):
+        out = compress(GzipCodec(1))
+
+        assert not out.closed
+        assert gzip.decompress(out.getvalue()) == DATA
+        assert GzipCodec().metadata == {"content-codec": "gzip"}
+
+    def test_zstd_results_can_be_decompressed_by_clients(self):
+        out = compress(ZstdCodec(3, threads=2))
+
+        assert not out.closed
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        assert decompressor.decompress(out.getvalue()) == DATA
+        assert ZstdCodec().metadata == {"content-codec": "zstd"}
+
+    def test_zstd_with_a_trained_dictionary(self, tmp_path):
+        samples = [
+            f'{{"truncatedExpression":{{"expression":[{i},null,{i * 2}]}}}}'.encode()
+            for i in range(1000)
+        ]
+        dictionary = train_dictionary(samples, size=4096)
+
+        path = tmp_path / "results.dict"
+        path.write_bytes(dictionary.as_bytes())
+
+        with mock.patch.object(config, "ZSTD_DICTIONARY_PATH", str(path)):
+            codec = parse_codec("zstd")
+
+        assert codec.metadata == {
+            "content-codec": "zstd",
+            "content-codec-dictionary": str(dictionary.dict_id()),
+        }
+        assert codec.decompress(compress(codec, samples[0]).getvalue()) == samples[0]
+
+    def test_codecs_are_chosen_per_task(self):
+        with mock.patch.object(
+            config, "RESULT_CODECS", {"GeneExpression": "zstd:1"}
+        ), mock.patch.object(config, "RESULT_CODEC", "gzip:6"):
+            gene_expression = get_result_codec("GeneExpression")
+            embedding = get_result_codec("GetEmbedding")
+
+        assert (gene_expression.name, gene_expression.level) == ("zstd", 1)
+        assert (embedding.name, embedding.level) == ("gzip", 6)
+
+    @pytest.mark.parametrize("codec", [GzipCodec(), ZstdCodec(threads=2)])
+    def test_objects_are_read_with_the_codec_in_their_metadata(self, codec):
+        out = compress(codec)
+        out.seek(0)
+
+        with get_object_codec(codec.metadata).reader(out) as f:
+            assert f.read() == DATA
+
+    def test_objects_without_codec_metadata_are_gzip(self):
+        assert get_object_codec({}).name == "gzip"
+
+    def test_objects_with_a_dictionary_that_is_not_loaded_are_not_read(self):
+        with pytest.raises(ValueError):
+            get_object_codec(
+                {"content-codec": "zstd", "content-codec-dictionary": "1234"}
+            )
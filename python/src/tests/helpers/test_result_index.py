@@ -0,0 +1,63 @@
+import boto3
+import mock
+import pytest
+from botocore.stub import Stubber
+from worker.config import config
+from worker.helpers import metrics
+from worker.helpers.result_index import add_result, result_exists
+
+
+class TestResultIndex:
+    @pytest.fixture(autouse=True)
+    def set_up_s3(self):
+        self.s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
+        self.stubber = Stubber(self.s3)
+
+        with mock.patch("boto3.client", return_value=self.s3), self.stubber:
+            yield
+
+        self.stubber.assert_no_pending_responses()
+
+    def add_head(self, exists):
+        params = {"Bucket": config.RESULTS_BUCKET, "Key": "etag"}
+
+        if exists:
+            self.stubber.add_response("head_object", {"ContentLength": 10}, params)
+        else:
+            self.stubber.add_client_error(
+                "head_object", "404", http_status_code=404, expected_params=params
+            )
+
+    def test_uploaded_results_are_known_without_asking_s3(self):
+        add_result("etag")
+
+        assert result_exists("etag")
+        assert metrics.get_counter("result_index.hit") == 1
+
+    def test_results_found_in_s3_are_not_asked_for_again(self):
+        self.add_head(exists=True)
+
+        assert result_exists("etag")
+        assert result_exists("etag")
+        assert metrics.get_counter("result_index.miss") == 1
+
+    def test_missing_results_are_asked_for_again_after_the_ttl(self):
+        self.add_head(exists=False)
+        self.add_head(exists=True)
+
+        with mock.patch("time.monotonic", return_value=100):
+            assert not result_exists("etag")
+            assert not result_exists("etag")
+
+        with mock.patch(
+            "time.monotonic", return_value=100 + config.RESULT_INDEX_MISSING_TTL
+        ):
+            assert result_exists("etag")
+
+        assert metrics.get_counter("result_index.miss") == 2
+
+    def test_other_s3_errors_are_raised(self):
+        self.stubber.add_client_error("head_object", "403", http_status_code=403)
+
+        with pytest.raises(Exception, match="403"):
+            result_exists("etag")
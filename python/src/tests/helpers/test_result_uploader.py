@@ -0,0 +1,154 @@
+import gzip
+import os
+import threading
+
+import mock
+import pytest
+from worker.helpers.result_uploader import ResultUpload
+
+
+def get_upload(s3, part_size=10, concurrency=2):
+    return ResultUpload(
+        s3,
+        "bucket",
+        "key",
+        {"experimentId": "experiment-id", "requestType": "GeneExpression"},
+        part_size=part_size,
+        concurrency=concurrency,
+    )
+
+
+def get_s3():
+    s3 = mock.MagicMock()
+    s3.create_multipart_upload.return_value = {"UploadId": "upload-id"}
+    s3.upload_part.side_effect = lambda **kwargs: {"ETag": f"etag-{kwargs['PartNumber']}"}
+    return s3
+
+
+class TestResultUpload:
+    def test_small_results_are_put_in_one_request_with_tags(self):
+        s3 = get_s3()
+
+        with get_upload(s3) as upload:
+            upload.write(b"small")
+
+        s3.put_object.assert_called_once_with(
+            Bucket="bucket",
+            Key="key",
+            Body=b"small",
+            Tagging="experimentId=experiment-id&requestType=GeneExpression",
+            Metadata={},
+        )
+        s3.create_multipart_upload.assert_not_called()
+        assert upload.getvalue() == b"small"
+        assert upload.size == 5
+
+    def test_large_results_are_uploaded_in_parts(self):
+        s3 = get_s3()
+
+        with get_upload(s3) as upload:
+            for _ in range(5):
+                upload.write(b"x" * 7)
+
+        s3.create_multipart_upload.assert_called_once_with(
+            Bucket="bucket",
+            Key="key",
+            Tagging="experimentId=experiment-id&requestType=GeneExpression",
+            Metadata={},
+        )
+
+        sizes = sorted(
+            (call.kwargs["PartNumber"], len(call.kwargs["Body"]))
+            for call in s3.upload_part.call_args_list
+        )
+        assert sizes == [(1, 10), (2, 10), (3, 10), (4, 5)]
+
+        s3.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket",
+            Key="key",
+            UploadId="upload-id",
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": f"etag-{i}", "PartNumber": i} for i in range(1, 5)
+                ]
+            },
+        )
+        s3.put_object.assert_not_called()
+        assert upload.getvalue() is None
+        assert upload.size == 35
+
+    def test_compression_is_streamed_into_parts(self):
+        s3 = get_s3()
+        data = os.urandom(5000)
+
+        with get_upload(s3, part_size=1000) as upload:
+            with gzip.GzipFile(fileobj=upload, mode="wb") as zipfile:
+                zipfile.write(data)
+
+        parts = sorted(
+            (call.kwargs["PartNumber"], call.kwargs["Body"])
+            for call in s3.upload_part.call_args_list
+        )
+        assert len(parts) > 1
+        assert gzip.decompress(b"".join(body for _, body in parts)) == data
+
+    def test_metadata_is_set_when_the_object_is_created(self):
+        s3 = get_s3()
+
+        upload = ResultUpload(
+            s3, "bucket", "key", {}, 10, 2, metadata={"content-codec": "zstd"}
+        )
+        with upload:
+            upload.write(b"x" * 15)
+
+        assert s3.create_multipart_upload.call_args.kwargs["Metadata"] == {
+            "content-codec": "zstd"
+        }
+
+    def test_writes_wait_for_busy_parts(self):
+        s3 = get_s3()
+        uploading = threading.Semaphore(0)
+        release = threading.Event()
+        in_flight = []
+        max_in_flight = []
+
+        def upload_part(**kwargs):
+            in_flight.append(kwargs["PartNumber"])
+            max_in_flight.append(len(in_flight))
+            uploading.release()
+            release.wait()
+            in_flight.remove(kwargs["PartNumber"])
+            return {"ETag": "etag"}
+
+        s3.upload_part.side_effect = upload_part
+
+        upload = get_upload(s3, part_size=1, concurrency=2)
+        writer = threading.Thread(target=lambda: upload.write(b"abcd"))
+        writer.start()
+
+        uploading.acquire()
+        uploading.acquire()
+
+        # The third part waits for one of the first two to finish
+        writer.join(timeout=0.2)
+        assert writer.is_alive()
+
+        release.set()
+        writer.join()
+        upload.close()
+
+        assert max(max_in_flight) == 2
+        assert s3.upload_part.call_count == 4
+
+    def test_failed_uploads_are_aborted(self):
+        s3 = get_s3()
+        s3.upload_part.side_effect = Exception("Network error")
+
+        with pytest.raises(Exception, match="Network error"):
+            with get_upload(s3) as upload:
+                upload.write(b"x" * 25)
+
+        s3.abort_multipart_upload.assert_called_once_with(
+            Bucket="bucket", Key="key", UploadId="upload-id"
+        )
+        s3.complete_multipart_upload.assert_not_called()
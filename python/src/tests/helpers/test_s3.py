@@ -1,38 +1,52 @@
 import gzip
 import io
 import json
+import os
 from unittest import TestCase
 
 import boto3
 import mock
+import numpy as np
+import pytest
 from botocore.stub import Stubber
 from tests.data.embedding import mock_embedding
 from worker.config import config
-from worker.helpers.s3 import get_embedding
+from worker.helpers import metrics
+from worker.helpers.result_codecs import ZstdCodec
+from worker.helpers.s3 import (
+    get_cell_set_index,
+    get_cell_sets,
+    get_cell_sets_with_version,
+    get_embedding_array,
+)
 
 mock_embedding_etag = "mockEmbeddingETag"
 
 class TestS3:
-    def get_s3_stub(self):
+    def get_s3_stub(self, etags=(mock_embedding_etag,)):
         s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
-        response = {
-            "ContentLength": 10,
-            "ContentType": "utf-8",
-            "ResponseMetadata": {
-                "Bucket": config.RESULTS_BUCKET,
-            },
-        }
+        stubber = Stubber(s3)
+
+        for etag in etags:
+            self.add_embedding_responses(stubber, etag)
 
+        return (stubber, s3)
+
+    def add_embedding_responses(self, stubber, etag, codec=None):
         expected_params = {
             "Bucket": config.RESULTS_BUCKET,
-            "Key": mock_embedding_etag,
+            "Key": etag,
         }
-        stubber = Stubber(s3)
-        stubber.add_response("head_object", response, expected_params)
 
-        # Get object
         content_string = json.dumps(mock_embedding).encode("utf-8")
-        content_bytes = gzip.compress(content_string)
+        if codec is None:
+            content_bytes = gzip.compress(content_string)
+        else:
+            compressed = io.BytesIO()
+            with codec.open(compressed) as f:
+                f.write(content_string)
+            content_bytes = compressed.getvalue()
+
         data = io.BytesIO()
         data.write(content_bytes)
         data.seek(0)
@@ -45,43 +59,157 @@ class TestS3:
                 "Bucket": config.RESULTS_BUCKET,
             },
         }
+        if codec is not None:
+            response["Metadata"] = codec.metadata
         stubber.add_response("get_object", response, expected_params)
-        return (stubber, s3)
 
-    def test_get_embedding_should_not_replace_nulls_if_not_formatted_for_r(self):
-      stubber, s3 = self.get_s3_stub()
+    def test_get_embedding_array_stores_missing_cells_as_nan(self):
+        stubber, s3 = self.get_s3_stub()
+
+        with mock.patch("boto3.client") as n, stubber:
+            n.return_value = s3
 
-      na_positions = []
-      for idx, val in enumerate(mock_embedding):
-        if val is None:
-          na_positions.append(idx)
+            embedding = get_embedding_array(mock_embedding_etag)
 
-      with mock.patch("boto3.client") as n, stubber:
-          n.return_value = s3
+        assert embedding.dtype == np.float64
+        assert embedding.shape == (len(mock_embedding), 2)
 
-          request = get_embedding(mock_embedding_etag, format_for_r=False)
+        for row, val in zip(embedding, mock_embedding):
+            if val is None:
+                assert np.isnan(row).all()
+            else:
+                assert row.tolist() == pytest.approx(val)
+
+    def test_get_embedding_array_decodes_embeddings_stored_with_zstd(self):
+        s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
+        stubber = Stubber(s3)
+        self.add_embedding_responses(stubber, mock_embedding_etag, ZstdCodec())
 
-          for idx, val in enumerate(request):
-            if idx in na_positions:
-              assert val is None
+        with mock.patch("boto3.client", return_value=s3), stubber:
+            embedding = get_embedding_array(mock_embedding_etag)
+
+        for row, val in zip(embedding, mock_embedding):
+            if val is None:
+                assert np.isnan(row).all()
             else:
-              assert val is not None
+                assert row.tolist() == pytest.approx(val)
 
-    def test_get_embedding_should_replace_nulls_if_formatted_for_r(self):
-      stubber, s3 = self.get_s3_stub()
+    def test_get_embedding_array_reuses_the_cached_embedding(self):
+        stubber, s3 = self.get_s3_stub()
 
-      na_positions = []
-      for idx, val in enumerate(mock_embedding):
-        if val is None:
-          na_positions.append(idx)
+        with mock.patch("boto3.client") as n, stubber:
+            n.return_value = s3
 
-      with mock.patch("boto3.client") as n, stubber:
-          n.return_value = s3
+            first = get_embedding_array(mock_embedding_etag)
+            second = get_embedding_array(mock_embedding_etag)
 
-          request = get_embedding(mock_embedding_etag, format_for_r=True)
+            stubber.assert_no_pending_responses()
 
-          for idx, val in enumerate(request):
-            if idx in na_positions:
-              assert val == ['NA', 'NA']
-            else:
-              assert val is not None
\ No newline at end of file
+        np.testing.assert_array_equal(first, second)
+        assert isinstance(get_embedding_array(mock_embedding_etag), np.memmap)
+        assert metrics.get_counter("embedding.cache.miss") == 1
+        assert metrics.get_counter("embedding.cache.hit") == 2
+
+    def test_least_recently_used_embeddings_are_evicted(self):
+        etags = ["etag-1", "etag-2", "etag-1", "etag-3", "etag-2"]
+        stubber, s3 = self.get_s3_stub(["etag-1", "etag-2", "etag-3", "etag-2"])
+
+        embedding_file = io.BytesIO()
+        np.save(embedding_file, np.zeros((len(mock_embedding), 2), dtype=np.float64))
+        embedding_size = len(embedding_file.getvalue())
+
+        with mock.patch("boto3.client") as n, stubber, mock.patch.object(
+            config, "EMBEDDING_CACHE_BYTES", 2 * embedding_size
+        ):
+            n.return_value = s3
+
+            for i, etag in enumerate(etags):
+                get_embedding_array(etag)
+
+                # Make sure every access has a different mtime
+                path = os.path.join(config.EMBEDDING_CACHE_DIR, f"{etag}.npy")
+                os.utime(path, (i, i))
+
+            stubber.assert_no_pending_responses()
+
+        assert sorted(os.listdir(config.EMBEDDING_CACHE_DIR)) == ["etag-2.npy", "etag-3.npy"]
+        assert metrics.get_counter("embedding.cache.evicted") == 2
+
+    def get_cell_sets_stub(self, versions):
+        s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
+        stubber = Stubber(s3)
+        expected_params = {
+            "Bucket": config.CELL_SETS_BUCKET,
+            "Key": config.EXPERIMENT_ID,
+        }
+
+        # One (head_version, get_version) pair per expected call,
+        # get_version is None when the download should be skipped
+        for head_version, get_version in versions:
+            stubber.add_response("head_object", {"ETag": head_version}, expected_params)
+
+            if get_version is None:
+                continue
+
+            content_bytes = json.dumps(
+                {"cellSets": [{"key": get_version, "children": []}]}
+            ).encode("utf-8")
+
+            stubber.add_response(
+                "get_object",
+                {"ETag": get_version, "Body": io.BytesIO(content_bytes)},
+                expected_params,
+            )
+
+        return (stubber, s3)
+
+    def test_get_cell_sets_reuses_parsed_cell_sets_while_unchanged(self):
+        stubber, s3 = self.get_cell_sets_stub([('"v1"', '"v1"'), ('"v1"', None)])
+
+        with mock.patch("boto3.client") as n, stubber:
+            n.return_value = s3
+
+            first = get_cell_sets(config.EXPERIMENT_ID)
+            second = get_cell_sets(config.EXPERIMENT_ID)
+
+            assert first is second
+            stubber.assert_no_pending_responses()
+
+        assert metrics.get_counter("cell_sets.cache.hit") == 1
+        assert metrics.get_counter("cell_sets.cache.miss") == 1
+
+    def test_get_cell_sets_downloads_again_when_changed(self):
+        stubber, s3 = self.get_cell_sets_stub([('"v1"', '"v1"'), ('"v2"', '"v2"')])
+
+        with mock.patch("boto3.client") as n, stubber:
+            n.return_value = s3
+
+            version, cell_sets = get_cell_sets_with_version(config.EXPERIMENT_ID)
+            assert version == '"v1"'
+            assert cell_sets[0]["key"] == '"v1"'
+
+            version, cell_sets = get_cell_sets_with_version(config.EXPERIMENT_ID)
+            assert version == '"v2"'
+            assert cell_sets[0]["key"] == '"v2"'
+
+            stubber.assert_no_pending_responses()
+
+        assert metrics.get_counter("cell_sets.cache.miss") == 2
+
+    def test_get_cell_set_index_is_built_once_per_version(self):
+        stubber, s3 = self.get_cell_sets_stub(
+            [('"v1"', '"v1"'), ('"v1"', None), ('"v2"', '"v2"')]
+        )
+
+        with mock.patch("boto3.client") as n, stubber:
+            n.return_value = s3
+
+            first = get_cell_set_index(config.EXPERIMENT_ID)
+            second = get_cell_set_index(config.EXPERIMENT_ID)
+            third = get_cell_set_index(config.EXPERIMENT_ID)
+
+            assert first is second
+            assert first.version == '"v1"'
+            assert third.version == '"v2"'
+            assert '"v2"' in third
+            stubber.assert_no_pending_responses()
@@ -93,7 +93,7 @@ class TestBatchDifferentialExpression:
             }
             mock_format_request.side_effect = [PythonWorkerException(INVALID_INPUT, "No data available for this comparison"), valid_request]
 
-            with patch('requests.post') as mock_post:
+            with patch('requests.Session.post') as mock_post:
                 mock_post.return_value = MagicMock(status_code=200, json=lambda: {"data": {"full_count": 10, "gene_results": "Some gene results"}})
 
                 with patch("boto3.client") as n, stubber:
@@ -16,7 +16,7 @@ from tests.data.embedding import mock_embedding
 from worker.tasks.download_annot_seurat_object import DownloadAnnotSeuratObject
 
 import pdb
-from worker.helpers.s3 import get_cell_sets, get_embedding
+from worker.helpers.s3 import get_cell_sets
 from worker.helpers.cell_sets_dict import get_cell_sets_dict_for_r
 
 mock_embedding_etag = "mockEmbeddingETag"
@@ -82,23 +82,6 @@ class TestDownloadAnnotSeuratObject:
 
         stubber.add_response("get_object", cell_sets_get_object["response"], cell_sets_get_object["params"])
 
-        embedding_head_object = {
-          "params": {
-            "Bucket": config.RESULTS_BUCKET,
-            "Key": mock_embedding_etag,
-          },
-          "response": {
-              "ContentLength": 10,
-              "ContentType": "utf-8",
-              "ResponseMetadata": {
-                  "Bucket": config.RESULTS_BUCKET,
-              },
-          }
-        }
-
-        # Stubbing response for embedding head object
-        stubber.add_response("head_object", embedding_head_object["response"], embedding_head_object["params"])
-
         # Stubbing response for embedding get object
         content_string = json.dumps(mock_embedding).encode("utf-8")
         content_bytes = gzip.compress(content_string)
@@ -1,7 +1,6 @@
 import json
 import io
 
-import random
 import numpy as np
 import boto3
 import pytest
@@ -107,8 +106,6 @@ class TestGeneExpression:
     def test_downsamples_correctly(self):
         stubber, s3 = self.get_s3_stub(cell_sets_from_s3)
 
-        random.seed(900)
-
         with mock.patch("boto3.client") as n, stubber:
             n.return_value = s3
 
@@ -134,15 +131,13 @@ class TestGeneExpression:
             r_request = bla._format_request()
             assert isinstance(py_request, dict)
 
-        expected_cell_ids = [324, 622, 166, 916, 38, 344, 31, 374, 630, 386, 149, 22, 68, 202, 620, 777, 701, 254, 134, 679, 384, 113, 277, 554, 213, 422, 751, 903, 247, 564, 356, 495, 655, 582, 882, 352, 331, 127, 673, 135, 89, 141, 814, 262, 506, 792, 502, 404, 599, 879, 594, 287, 864, 896, 21, 291, 547, 0, 351, 176, 13, 742, 285, 170, 121, 669, 132, 787, 319, 548, 760, 320, 315, 553, 230, 557, 371, 180, 556, 691, 409, 219, 289, 736, 726, 387, 909, 821, 768, 175, 771, 310, 207, 443, 158, 498, 697]
+        expected_cell_ids = [166, 592, 477, 8, 820, 418, 429, 740, 40, 100, 537, 399, 177, 900, 67, 364, 665, 74, 588, 23, 343, 188, 137, 578, 838, 402, 792, 110, 35, 681, 235, 50, 299, 144, 430, 802, 662, 521, 298, 758, 828, 349, 444, 481, 495, 859, 70, 817, 305, 316, 431, 291, 670, 28, 121, 637, 285, 621, 122, 338, 864, 95, 433, 327, 907, 657, 256, 514, 675, 460, 787, 97, 414, 132, 5, 191, 887, 43, 12, 729, 479, 712, 105, 629, 857, 732, 598, 719, 322, 703, 633, 850, 391, 248, 697, 720, 534]
 
         assert r_request["cellIds"] == expected_cell_ids
     
     def test_downsamples_by_many_groups_correctly(self):
         stubber, s3 = self.get_s3_stub(cell_sets_from_s3)
 
-        random.seed(900)
-
         with mock.patch("boto3.client") as n, stubber:
             n.return_value = s3
 
@@ -168,15 +163,13 @@ class TestGeneExpression:
             r_request = bla._format_request()
             assert isinstance(py_request, dict)
 
-        expected_cell_ids = [899, 644, 199, 558, 422, 551, 137, 178, 536, 100, 244, 131, 838, 229, 827, 665, 202, 134, 334, 57, 252, 420, 54, 438, 650, 383, 174, 595, 446, 397, 151, 221, 156, 624, 681, 882, 314, 298, 333, 465, 618, 382, 98, 458, 352, 876, 14, 452, 670, 868, 21, 303, 883, 0, 218, 831, 94, 376, 522, 122, 654, 484, 433, 586, 180, 683, 834, 887, 43, 302, 894, 371, 556, 780, 64, 851, 395, 329, 32, 890, 425, 245, 289, 25, 702, 771, 182, 17, 839, 205, 165]
+        expected_cell_ids = [187, 690, 554, 8, 487, 515, 915, 48, 123, 622, 440, 195, 74, 416, 813, 113, 679, 23, 378, 225, 148, 667, 438, 800, 533, 707, 141, 52, 903, 278, 55, 354, 174, 530, 882, 704, 350, 404, 564, 618, 642, 83, 526, 379, 447, 262, 529, 327, 338, 531, 318, 812, 29, 142, 783, 303, 765, 152, 366, 117, 542, 435, 843, 760, 283, 586, 823, 539, 118, 483, 168, 7, 210, 64, 24, 412, 745, 598, 111, 888, 816, 473, 80, 805, 355, 753, 710, 450, 248, 798, 862]
 
         assert r_request["cellIds"] == expected_cell_ids
     
     def test_downsamples_with_filter_correctly(self):
         stubber, s3 = self.get_s3_stub(cell_sets_from_s3)
 
-        random.seed(900)
-
         with mock.patch("boto3.client") as n, stubber:
             n.return_value = s3
 
@@ -213,8 +206,6 @@ class TestGeneExpression:
     def test_downsamples_with_hidden_cell_sets(self):
         stubber, s3 = self.get_s3_stub(cell_sets_from_s3)
 
-        random.seed(900)
-
         with mock.patch("boto3.client") as n, stubber:
             n.return_value = s3
 
@@ -82,23 +82,6 @@ class TestTrajectoryAnalysisStartingNodes:
 
         stubber.add_response("get_object", cell_sets_get_object["response"], cell_sets_get_object["params"])
 
-        embedding_head_object = {
-          "params": {
-            "Bucket": config.RESULTS_BUCKET,
-            "Key": mock_embedding_etag,
-          },
-          "response": {
-              "ContentLength": 10,
-              "ContentType": "utf-8",
-              "ResponseMetadata": {
-                  "Bucket": config.RESULTS_BUCKET,
-              },
-          }
-        }
-
-        # Stubbing response for embedding head object
-        stubber.add_response("head_object", embedding_head_object["response"], embedding_head_object["params"])
-
         # Stubbing response for embedding get object
         content_string = json.dumps(mock_embedding).encode("utf-8")
         content_bytes = gzip.compress(content_string)
@@ -175,7 +158,7 @@ class TestTrajectoryAnalysisStartingNodes:
 
             result = GetTrajectoryAnalysisStartingNodes(self.correct_request).compute()
 
-            TestCase().assertDictEqual(result.data, worker_payload["data"])
+            TestCase().assertDictEqual(json.loads(result.data), worker_payload["data"])
             stubber.assert_no_pending_responses()
 
     @responses.activate
@@ -1,194 +1,122 @@
-import boto3
 import mock
-from botocore.stub import ANY, Stubber
+import pytest
 
-from worker.config import config
-from worker.consume_message import _read_sqs_message, consume
+from worker.consume_message import consume, scheduler
 
 
 class TestConsumeMessage:
-    def test_read_sqs_message_fetches_messages_from_the_correct_queue(self):
-        sqs = boto3.resource("sqs", **config.BOTO_RESOURCE_KWARGS)
-        stubber = Stubber(sqs.meta.client)
-        stubber.add_response(
-            "get_queue_url",
-            {"QueueUrl": "my_very_valid_and_existing_queue_url"},
-            {"QueueName": config.QUEUE_NAME},
-        )
-        stubber.add_response(
-            "receive_message",
-            {},
-            {
-                "QueueUrl": "my_very_valid_and_existing_queue_url",
-                "WaitTimeSeconds": ANY,
-                "AttributeNames": ["AWSTraceHeader"],
-            },
-        )
-
-        with mock.patch("boto3.resource") as m, stubber:
-            m.return_value = sqs
-            _read_sqs_message()
-            stubber.assert_no_pending_responses()
-
-    def test_read_sqs_message_returns_falsy_on_non_existent_queue(self):
-        sqs = boto3.resource("sqs", **config.BOTO_RESOURCE_KWARGS)
-        stubber = Stubber(sqs.meta.client)
-        stubber.add_client_error(
-            "get_queue_url",
-            service_error_code="AWS.SimpleQueueService.NonExistentQueue",
-            http_status_code=400,
-            expected_params={"QueueName": config.QUEUE_NAME},
-        )
-
-        with mock.patch("boto3.resource") as m, stubber:
-            m.return_value = sqs
-            r = consume()
-            assert not r
-            stubber.assert_no_pending_responses()
-
-    def test_read_sqs_message_returns_falsy_on_no_incoming_message(self):
-        sqs = boto3.resource("sqs", **config.BOTO_RESOURCE_KWARGS)
-        stubber = Stubber(sqs.meta.client)
-        stubber.add_response(
-            "get_queue_url",
-            {"QueueUrl": "my_very_valid_and_existing_queue_url"},
-            {"QueueName": config.QUEUE_NAME},
-        )
-        stubber.add_response(
-            "receive_message",
-            {"Messages": []},
-            {
-                "QueueUrl": "my_very_valid_and_existing_queue_url",
-                "WaitTimeSeconds": ANY,
-                "AttributeNames": ["AWSTraceHeader"],
-            },
-        )
-
-        with mock.patch("boto3.resource") as m, stubber:
-            m.return_value = sqs
-            r = _read_sqs_message()
-            assert not r
-            stubber.assert_no_pending_responses()
-
-    def test_read_sqs_message_returns_falsy_on_badly_formatted_message(self):
-        sqs = boto3.resource("sqs", **config.BOTO_RESOURCE_KWARGS)
-        stubber = Stubber(sqs.meta.client)
-        stubber.add_response(
-            "get_queue_url",
-            {"QueueUrl": "my_very_valid_and_existing_queue_url"},
-            {"QueueName": config.QUEUE_NAME},
-        )
-        stubber.add_response(
-            "receive_message",
-            {
-                "Messages": [
-                    {
-                        "MessageId": "asd",
-                        "ReceiptHandle": "ewrwe",
-                        "Body": '{"not_json_asd: "b"}',
-                    }
-                ]
-            },
-            {
-                "QueueUrl": "my_very_valid_and_existing_queue_url",
-                "WaitTimeSeconds": ANY,
-                "AttributeNames": ["AWSTraceHeader"],
-            },
-        )
-        stubber.add_response(
-            "delete_message",
-            {},
-            {
-                "QueueUrl": "my_very_valid_and_existing_queue_url",
-                "ReceiptHandle": "ewrwe",
-            },
-        )
-
-        with mock.patch("boto3.resource") as m, stubber:
-            m.return_value = sqs
-            r = _read_sqs_message()
-            assert not r
-            stubber.assert_no_pending_responses()
-
-    def test_request_with_expired_timeout_is_discarded(self):
+    @pytest.fixture(autouse=True)
+    def mock_receiver(self):
+        with mock.patch("worker.consume_message.receiver") as receiver:
+            self.receiver = receiver
+            yield
+
+    def get_request(
+        self, etag="random-etag", name=None, timeout="2900-01-01 00:00:00"
+    ):
         request = {
             "experimentId": "random-experiment-id",
-            "timeout": "2000-01-01 00:00:00",
+            "timeout": timeout,
             "uuid": "random-uuid",
-            "ETag": "random-etag",
+            "ETag": etag,
         }
 
-        with mock.patch("worker.consume_message._read_sqs_message") as m:
-            m.return_value = request
-            result = consume()
+        if name:
+            request["body"] = {"name": name}
+
+        return request
+
+    def test_returns_falsy_when_no_request_is_received(self):
+        with mock.patch.object(scheduler, "pop", return_value=None) as pop:
+            assert not consume()
 
-            assert result is None
+        self.receiver.start.assert_called_once()
+        pop.assert_called_once_with(timeout=20)
+
+    def test_request_with_expired_timeout_is_discarded(self):
+        request = self.get_request(timeout="2000-01-01 00:00:00")
+        scheduler.add(request)
+
+        assert consume() is None
+        self.receiver.delete.assert_called_once_with(request)
 
     def test_consume_request_non_expired_timeout_results_not_in_s3(self):
-        etag = "random-etag"
-        request = {
-            "experimentId": "random-experiment-id",
-            "timeout": "2900-01-01 00:00:00",
-            "uuid": "random-uuid",
-            "ETag": etag,
-        }
-        s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
-        response = {
-            "Contents": [
-                {
-                    "LastModified": "2022-02-02T15:25:12.000Z",
-                    "ETag": etag,
-                    "StorageClass": "STANDARD",
-                    "Key": "different-from-etag",
-                    "Size": 701621,
-                }
-            ]
-        }
-        expected_params = {"Bucket": config.RESULTS_BUCKET, "Prefix": etag}
-        stubber = Stubber(s3)
-        stubber.add_response("list_objects_v2", response, expected_params)
-
-        with mock.patch("boto3.client") as n, stubber:
-            n.return_value = s3
-            with mock.patch("worker.consume_message._read_sqs_message") as m:
-                m.return_value = request
-                result = consume()
-                assert result == {
-                    "experimentId": "random-experiment-id",
-                    "timeout": "2900-01-01 00:00:00",
-                    "uuid": "random-uuid",
-                    "ETag": "random-etag",
-                }
-            stubber.assert_no_pending_responses()
+        request = self.get_request()
+        scheduler.add(request)
+
+        with mock.patch(
+            "worker.consume_message.result_exists", return_value=False
+        ) as result_exists:
+            assert consume() == request
+
+        result_exists.assert_called_once_with("random-etag")
+        self.receiver.delete.assert_not_called()
 
     def test_consume_request_non_expired_timeout_results_in_s3(self):
-        etag = "random-etag"
-        request = {
-            "experimentId": "random-experiment-id",
-            "timeout": "2900-01-01 00:00:00",
-            "uuid": "random-uuid",
-            "ETag": etag,
-        }
-        s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
-        response = {
-            "Contents": [
-                {
-                    "LastModified": "2022-02-02T15:25:12.000Z",
-                    "ETag": etag,
-                    "StorageClass": "STANDARD",
-                    "Key": etag,
-                    "Size": 701621,
-                }
-            ]
-        }
-        expected_params = {"Bucket": config.RESULTS_BUCKET, "Prefix": etag}
-        stubber = Stubber(s3)
-        stubber.add_response("list_objects_v2", response, expected_params)
-
-        with mock.patch("boto3.client") as n, stubber:
-            n.return_value = s3
-            with mock.patch("worker.consume_message._read_sqs_message") as m:
-                m.return_value = request
-                result = consume()
-                assert result is None
-            stubber.assert_no_pending_responses()
+        request = self.get_request()
+        scheduler.add(request)
+
+        with mock.patch("worker.consume_message.result_exists", return_value=True):
+            assert consume() is None
+
+        self.receiver.delete.assert_called_once_with(request)
+
+    def test_results_of_tasks_that_are_not_cacheable_are_not_looked_up(self):
+        request = self.get_request(name="ClusterCells")
+        scheduler.add(request)
+
+        with mock.patch("worker.consume_message.result_exists") as result_exists:
+            assert consume() == request
+
+        result_exists.assert_not_called()
+
+    def test_duplicates_of_running_requests_are_skipped(self):
+        request = self.get_request()
+        duplicate = self.get_request()
+        scheduler.add(request)
+        scheduler.add(duplicate)
+
+        with mock.patch("worker.consume_message.result_exists", return_value=False):
+            assert consume() == request
+            assert consume() is None
+
+        self.receiver.delete.assert_called_once_with(duplicate)
+
+    def test_received_requests_run_by_priority(self):
+        export = self.get_request("export", "DownloadAnnotSeuratObject")
+        embedding = self.get_request("embedding", "GetEmbedding")
+        scheduler.add(export)
+        scheduler.add(embedding)
+
+        with mock.patch("worker.consume_message.result_exists", return_value=False):
+            assert consume() == embedding
+            assert consume() == export
+
+    def test_requests_with_results_in_redis_are_answered_from_it(self):
+        request = self.get_request(name="GetEmbedding")
+        scheduler.add(request)
+
+        with mock.patch(
+            "worker.consume_message.get_cached_result",
+            return_value=(b"result", {"content-codec": "gzip"}),
+        ), mock.patch(
+            "worker.consume_message.Response.publish_cached"
+        ) as publish_cached, mock.patch(
+            "worker.consume_message.result_exists"
+        ) as result_exists:
+            assert consume() is None
+
+        publish_cached.assert_called_once_with(b"result", {"content-codec": "gzip"})
+        result_exists.assert_not_called()
+        self.receiver.delete.assert_called_once_with(request)
+
+    def test_results_in_redis_of_tasks_that_are_not_cacheable_are_not_sent(self):
+        request = self.get_request(name="ClusterCells")
+        scheduler.add(request)
+
+        with mock.patch(
+            "worker.consume_message.get_cached_result"
+        ) as get_cached_result:
+            assert consume() == request
+
+        get_cached_result.assert_not_called()
@@ -0,0 +1,202 @@
+import threading
+import time
+from unittest.mock import Mock, PropertyMock, patch
+
+import pytest
+from aws_xray_sdk.core import xray_recorder
+from tests.utils import FakeRedis, xray_enabled
+from worker.config import config
+from worker.executor import TaskExecutor
+from worker.helpers.in_flight import start_request
+from worker.result import Result
+from worker.tasks.factory import TaskFactory
+
+
+class TestTaskExecutor:
+    @pytest.fixture(autouse=True)
+    def set_mock_task_factory(self):
+        with patch("worker.tasks.factory.CountMatrix"):
+            self.task_factory = TaskFactory()
+
+        self.publisher = Mock()
+        self.publisher.pending.return_value = 0
+
+        with patch("worker.helpers.clients.Emitter"), patch("worker.executor.Response"):
+            yield
+
+    def get_request(self, name="GetEmbedding", etag="random-etag"):
+        return {
+            "experimentId": "random-experiment-id",
+            "ETag": etag,
+            "body": {"name": name},
+        }
+
+    def test_tasks_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def compute(msg):
+            # Only returns if 3 tasks are running at the same time
+            barrier.wait()
+            return Result({})
+
+        self.task_factory.submit = Mock(side_effect=compute)
+        executor = TaskExecutor(self.task_factory, self.publisher, max_workers=3)
+
+        futures = [executor.submit(self.get_request(etag=f"etag-{i}")) for i in range(3)]
+        executor.shutdown()
+
+        assert all(f.done() for f in futures)
+        assert self.publisher.publish.call_count == 3
+
+    def test_wait_for_capacity_blocks_when_full(self):
+        release = threading.Event()
+
+        def compute(msg):
+            release.wait(5)
+            return Result({})
+
+        self.task_factory.submit = Mock(side_effect=compute)
+        executor = TaskExecutor(self.task_factory, self.publisher, max_workers=1)
+
+        executor.submit(self.get_request())
+        assert executor.busy()
+
+        threading.Timer(0.2, release.set).start()
+        start = time.time()
+        executor.wait_for_capacity()
+
+        assert time.time() - start >= 0.1
+        executor.shutdown()
+        assert not executor.busy()
+
+    def test_free_capacity_counts_running_tasks(self):
+        release = threading.Event()
+
+        def compute(msg):
+            release.wait(5)
+            return Result({})
+
+        self.task_factory.submit = Mock(side_effect=compute)
+        executor = TaskExecutor(self.task_factory, self.publisher, max_workers=3)
+
+        executor.submit(self.get_request())
+        assert executor.free_capacity() == 2
+
+        release.set()
+        executor.shutdown()
+        assert executor.free_capacity() == 3
+
+    def test_exclusive_tasks_do_not_overlap(self):
+        running = []
+        overlaps = []
+        lock = threading.Lock()
+
+        def compute(msg):
+            with lock:
+                running.append(msg["ETag"])
+                if len(running) > 1:
+                    overlaps.append(list(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(msg["ETag"])
+            return Result({})
+
+        self.task_factory.submit = Mock(side_effect=compute)
+        executor = TaskExecutor(self.task_factory, self.publisher, max_workers=3)
+
+        for i in range(3):
+            executor.submit(
+                self.get_request(name="GetNormalizedExpression", etag=f"etag-{i}")
+            )
+        executor.shutdown()
+
+        assert overlaps == []
+        assert self.task_factory.submit.call_count == 3
+
+    def test_mutating_tasks_hold_the_experiment_lock_in_multi_replica_mode(self):
+        redis = FakeRedis()
+        key = f"worker-mutating:{config.EXPERIMENT_ID}"
+        held = []
+
+        def compute(msg):
+            held.append(redis.exists(key))
+            return Result({})
+
+        self.task_factory.submit = Mock(side_effect=compute)
+
+        with patch.object(config, "MULTI_REPLICA", True), patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=PropertyMock,
+            return_value=redis,
+        ):
+            executor = TaskExecutor(self.task_factory, self.publisher, max_workers=2)
+            executor.submit(self.get_request(name="ClusterCells", etag="etag-1"))
+            executor.submit(
+                self.get_request(name="GetNormalizedExpression", etag="etag-2")
+            )
+            executor.shutdown()
+
+        assert sorted(held) == [False, True]
+        assert not redis.exists(key)
+
+    def test_mutating_tasks_do_not_use_redis_with_a_single_replica(self):
+        self.task_factory.submit = Mock(return_value=Result({}))
+
+        with patch(
+            "worker.helpers.clients.ClientRegistry.redis",
+            new_callable=PropertyMock,
+        ) as redis:
+            executor = TaskExecutor(self.task_factory, self.publisher, max_workers=1)
+            executor.submit(self.get_request(name="ClusterCells"))
+            executor.shutdown()
+
+        redis.return_value.set.assert_not_called()
+
+    def test_is_busy_while_responses_are_pending_publish(self):
+        self.publisher.pending.return_value = 1
+        executor = TaskExecutor(self.task_factory, self.publisher, max_workers=1)
+
+        assert executor.busy()
+
+    def test_failed_requests_can_run_again(self):
+        self.task_factory.submit = Mock(side_effect=KeyError("Task not found"))
+        receiver = Mock()
+        executor = TaskExecutor(
+            self.task_factory, self.publisher, max_workers=1, receiver=receiver
+        )
+        request = self.get_request()
+
+        assert start_request("random-etag")
+        executor.submit(request)
+        executor.shutdown()
+
+        self.publisher.publish.assert_not_called()
+        receiver.release.assert_called_once_with(request)
+        assert start_request("random-etag")
+
+    def test_segment_is_handed_to_the_publisher(self):
+        self.task_factory.submit = Mock(return_value=Result({}))
+
+        with xray_enabled() as emitter:
+            segment = xray_recorder.begin_segment("request", sampling=1)
+
+            executor = TaskExecutor(self.task_factory, self.publisher, max_workers=1)
+            executor.submit(self.get_request())
+            executor.shutdown()
+
+            # The publisher ends the segment once the response is published
+            self.publisher.publish.assert_called_once()
+            assert self.publisher.publish.call_args[0][1] is segment
+            emitter.send_entity.assert_not_called()
+
+    def test_segment_is_ended_when_the_request_fails(self):
+        self.task_factory.submit = Mock(side_effect=KeyError("Task not found"))
+
+        with xray_enabled() as emitter:
+            segment = xray_recorder.begin_segment("request", sampling=1)
+
+            executor = TaskExecutor(self.task_factory, self.publisher, max_workers=1)
+            executor.submit(self.get_request())
+            executor.shutdown()
+
+            emitter.send_entity.assert_called_once_with(segment)
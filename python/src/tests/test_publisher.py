@@ -0,0 +1,125 @@
+import threading
+from unittest.mock import Mock
+
+from aws_xray_sdk.core import xray_recorder
+from tests.utils import xray_enabled
+from worker.helpers.in_flight import start_request
+from worker.publisher import Publisher
+
+
+class TestPublisher:
+    def get_response(self, etag="random-etag"):
+        response = Mock()
+        response.request = {"ETag": etag}
+        return response
+
+    def test_publishes_responses_in_the_background(self):
+        release = threading.Event()
+        response = self.get_response()
+        response.publish.side_effect = lambda: release.wait(5)
+
+        publisher = Publisher(max_pending=2)
+        publisher.publish(response)
+
+        # publish returns before the upload finishes
+        assert publisher.pending() == 1
+        response.stage.assert_called_once()
+
+        release.set()
+        publisher.shutdown()
+
+        response.publish.assert_called_once()
+        assert publisher.pending() == 0
+
+    def test_blocks_when_queue_is_full(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_publish():
+            started.set()
+            release.wait(5)
+
+        first = self.get_response("etag-1")
+        first.publish.side_effect = slow_publish
+
+        publisher = Publisher(max_pending=1)
+        publisher.publish(first)
+        started.wait(5)
+
+        # One response uploading, one waiting: the third one has to wait
+        publisher.publish(self.get_response("etag-2"))
+
+        third_queued = threading.Event()
+
+        def publish_third():
+            publisher.publish(self.get_response("etag-3"))
+            third_queued.set()
+
+        threading.Thread(target=publish_third).start()
+        assert not third_queued.wait(0.2)
+
+        release.set()
+        assert third_queued.wait(5)
+        publisher.shutdown()
+
+    def test_failed_publish_does_not_stop_the_publisher(self):
+        failing = self.get_response("etag-1")
+        failing.publish.side_effect = Exception("S3 is down")
+        succeeding = self.get_response("etag-2")
+
+        publisher = Publisher(max_pending=2)
+        publisher.publish(failing)
+        publisher.publish(succeeding)
+        publisher.shutdown()
+
+        succeeding.publish.assert_called_once()
+
+    def test_requests_can_run_again_once_published(self):
+        failing = self.get_response("etag-1")
+        failing.publish.side_effect = Exception("Upload failed")
+
+        assert start_request("etag-1")
+        assert start_request("etag-2")
+
+        publisher = Publisher()
+        publisher.publish(failing)
+        publisher.publish(self.get_response("etag-2"))
+        publisher.shutdown()
+
+        assert start_request("etag-1")
+        assert start_request("etag-2")
+
+    def test_messages_are_deleted_only_after_publishing(self):
+        receiver = Mock()
+        failing = self.get_response("etag-1")
+        failing.publish.side_effect = Exception("Upload failed")
+        published = self.get_response("etag-2")
+
+        publisher = Publisher(receiver=receiver)
+        publisher.publish(failing)
+        publisher.publish(published)
+        publisher.shutdown()
+
+        receiver.delete.assert_called_once_with(published.request)
+        receiver.release.assert_called_once_with(failing.request)
+
+    def test_segment_is_ended_once_the_response_is_published(self):
+        response = self.get_response()
+
+        with xray_enabled() as emitter:
+            segment = xray_recorder.begin_segment("request", sampling=1)
+            xray_recorder.clear_trace_entities()
+
+            def publish():
+                # The upload is traced in the segment of the request
+                assert xray_recorder.current_segment() is segment
+                emitter.send_entity.assert_not_called()
+
+            response.publish.side_effect = publish
+
+            publisher = Publisher()
+            publisher.publish(response, segment)
+            publisher.shutdown()
+
+            response.publish.assert_called_once()
+            emitter.send_entity.assert_called_once_with(segment)
@@ -0,0 +1,356 @@
+import itertools
+import json
+
+import boto3
+import mock
+import pytest
+from botocore.stub import ANY, Stubber
+
+from worker.config import config
+from worker.receiver import Receiver
+from worker.scheduler import Scheduler
+from worker.tasks.factory import TaskFactory
+
+QUEUE_URL = "my_very_valid_and_existing_queue_url"
+BODY = '{"ETag": "random-etag", "timeout": "2900-01-01 00:00:00"}'
+
+
+class FakeFifoQueue:
+    """SQS FIFO queue, which returns no message of a group while one of the
+    messages of the group is in flight.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self._handles = itertools.count()
+
+    def get_queue_url(self, QueueName):
+        return {"QueueUrl": QUEUE_URL}
+
+    def send_message(
+        self, QueueUrl, MessageBody, MessageGroupId, MessageDeduplicationId
+    ):
+        self.messages.append(
+            {"Body": MessageBody, "Group": MessageGroupId, "ReceiptHandle": None}
+        )
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, **kwargs):
+        blocked_groups = {m["Group"] for m in self.messages if m["ReceiptHandle"]}
+
+        received = []
+        for message in self.messages:
+            if len(received) == MaxNumberOfMessages:
+                break
+
+            if message["Group"] in blocked_groups:
+                continue
+
+            message["ReceiptHandle"] = f"handle-{next(self._handles)}"
+            received.append(
+                {
+                    "MessageId": message["ReceiptHandle"],
+                    "ReceiptHandle": message["ReceiptHandle"],
+                    "Body": message["Body"],
+                    "Attributes": {"MessageGroupId": message["Group"]},
+                }
+            )
+
+        return {"Messages": received}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.messages = [
+            m for m in self.messages if m["ReceiptHandle"] != ReceiptHandle
+        ]
+
+
+class TestReceiverWithFifoGroups:
+    @pytest.fixture(autouse=True)
+    def set_up_sqs(self):
+        self.sqs = FakeFifoQueue()
+        self.scheduler = Scheduler(TaskFactory.tasks)
+        self.receiver = Receiver(self.scheduler)
+
+        with mock.patch("boto3.client", return_value=self.sqs):
+            yield
+
+    def send(self, etag, group="experiment"):
+        body = {"ETag": etag, "timeout": "2900-01-01 00:00:00"}
+        self.sqs.send_message(QUEUE_URL, json.dumps(body), group, etag)
+
+    def test_requests_of_a_group_are_received_while_another_one_runs(self):
+        self.send("export")
+        self.send("embedding")
+
+        assert self.receiver.receive(20, 1) == 1
+        request, _ = self.scheduler.pop()
+        assert request["ETag"] == "export"
+
+        assert self.receiver.receive(20, 1) == 1
+        request, _ = self.scheduler.pop()
+        assert request["ETag"] == "embedding"
+
+    def test_held_messages_hold_back_their_group(self):
+        self.send("export")
+        self.send("embedding")
+
+        with mock.patch.object(config, "UNIQUE_MESSAGE_GROUPS", True):
+            assert self.receiver.receive(20, 1) == 1
+            assert self.receiver.receive(20, 1) == 0
+
+    def test_held_messages_of_unique_groups_are_received_while_another_one_runs(
+        self,
+    ):
+        self.send("export", group="export")
+        self.send("embedding", group="embedding")
+
+        with mock.patch.object(config, "UNIQUE_MESSAGE_GROUPS", True):
+            assert self.receiver.receive(20, 1) == 1
+            assert self.receiver.receive(20, 1) == 1
+
+        # Both messages stay in the queue until their requests are done
+        assert len(self.sqs.messages) == 2
+
+        request, _ = self.scheduler.pop()
+        self.receiver.delete(request)
+        assert len(self.sqs.messages) == 1
+
+    def test_requests_not_run_are_sent_again_when_stopped(self):
+        self.send("export")
+        assert self.receiver.receive(20, 10) == 1
+        assert self.sqs.messages == []
+
+        with mock.patch.object(config, "PREFETCH_MESSAGES", 0):
+            self.receiver.start()
+            self.receiver.stop()
+
+        [message] = self.sqs.messages
+        assert message["Group"] == "experiment"
+        assert json.loads(message["Body"])["ETag"] == "export"
+
+
+class TestReceiver:
+    @pytest.fixture(autouse=True)
+    def set_up_sqs(self):
+        self.sqs = boto3.client("sqs", **config.BOTO_RESOURCE_KWARGS)
+        self.stubber = Stubber(self.sqs)
+        self.scheduler = Scheduler(TaskFactory.tasks)
+        self.receiver = Receiver(self.scheduler)
+
+        # Messages are held until their requests are done
+        with mock.patch("boto3.client", return_value=self.sqs), mock.patch.object(
+            config, "UNIQUE_MESSAGE_GROUPS", True
+        ), self.stubber:
+            yield
+
+        self.stubber.assert_no_pending_responses()
+
+    def add_queue_url(self):
+        self.stubber.add_response(
+            "get_queue_url", {"QueueUrl": QUEUE_URL}, {"QueueName": config.QUEUE_NAME}
+        )
+
+    def add_receive(self, messages, max_messages=10):
+        self.stubber.add_response(
+            "receive_message",
+            {"Messages": messages},
+            {
+                "QueueUrl": QUEUE_URL,
+                "WaitTimeSeconds": ANY,
+                "MaxNumberOfMessages": max_messages,
+                "VisibilityTimeout": config.VISIBILITY_TIMEOUT,
+                "AttributeNames": ["AWSTraceHeader", "MessageGroupId"],
+            },
+        )
+
+    def add_delete(self, receipt_handle):
+        self.stubber.add_response(
+            "delete_message",
+            {},
+            {"QueueUrl": QUEUE_URL, "ReceiptHandle": receipt_handle},
+        )
+
+    def receive_request(self):
+        self.add_queue_url()
+        self.add_receive(
+            [{"MessageId": "1", "ReceiptHandle": "handle", "Body": BODY}]
+        )
+
+        assert self.receiver.receive(20, 10) == 1
+        request, _ = self.scheduler.pop()
+
+        return request
+
+    def test_received_requests_are_scheduled_without_deleting_them(self):
+        self.add_queue_url()
+        self.add_receive(
+            [
+                {
+                    "MessageId": "1",
+                    "ReceiptHandle": "handle",
+                    "Body": BODY,
+                    "Attributes": {"AWSTraceHeader": "Root=1-5759e988"},
+                }
+            ],
+            max_messages=3,
+        )
+
+        assert self.receiver.receive(20, 3) == 1
+        assert self.scheduler.pop() == (
+            {"ETag": "random-etag", "timeout": "2900-01-01 00:00:00"},
+            "Root=1-5759e988",
+        )
+
+    def test_receives_nothing_on_non_existent_queue(self):
+        self.stubber.add_client_error(
+            "get_queue_url",
+            service_error_code="AWS.SimpleQueueService.NonExistentQueue",
+            http_status_code=400,
+            expected_params={"QueueName": config.QUEUE_NAME},
+        )
+
+        assert self.receiver.receive(0, 10) == 0
+
+    def test_receives_nothing_on_no_incoming_message(self):
+        self.add_queue_url()
+        self.add_receive([])
+
+        assert self.receiver.receive(20, 10) == 0
+        assert len(self.scheduler) == 0
+
+    def test_badly_formatted_messages_are_deleted(self):
+        self.add_queue_url()
+        self.add_receive(
+            [{"MessageId": "asd", "ReceiptHandle": "ewrwe", "Body": '{"not_json'}]
+        )
+        self.add_delete("ewrwe")
+
+        assert self.receiver.receive(20, 10) == 0
+        assert len(self.scheduler) == 0
+
+    @pytest.mark.parametrize(
+        "body",
+        ['"not a request"', "[1, 2]", '{"ETag": "etag"}', '{"timeout": "never"}'],
+    )
+    def test_messages_that_are_not_requests_are_deleted(self, body):
+        self.add_queue_url()
+        self.add_receive(
+            [
+                {"MessageId": "1", "ReceiptHandle": "invalid", "Body": body},
+                {"MessageId": "2", "ReceiptHandle": "handle", "Body": BODY},
+            ]
+        )
+        self.add_delete("invalid")
+
+        assert self.receiver.receive(20, 10) == 1
+        assert len(self.scheduler) == 1
+
+        # Only the message of the valid request is held and extended
+        self.stubber.add_response(
+            "change_message_visibility_batch",
+            {"Successful": [{"Id": "0"}], "Failed": []},
+            {
+                "QueueUrl": QUEUE_URL,
+                "Entries": [
+                    {
+                        "Id": "0",
+                        "ReceiptHandle": "handle",
+                        "VisibilityTimeout": config.VISIBILITY_TIMEOUT,
+                    }
+                ],
+            },
+        )
+        self.receiver.extend_visibility()
+
+    def test_messages_are_deleted_once_done(self):
+        request = self.receive_request()
+        self.add_delete("handle")
+
+        self.receiver.delete(request)
+
+        # Only once
+        self.receiver.delete(request)
+
+    def test_visibility_of_held_messages_is_extended(self):
+        request = self.receive_request()
+        self.stubber.add_response(
+            "change_message_visibility_batch",
+            {"Successful": [{"Id": "0"}], "Failed": []},
+            {
+                "QueueUrl": QUEUE_URL,
+                "Entries": [
+                    {
+                        "Id": "0",
+                        "ReceiptHandle": "handle",
+                        "VisibilityTimeout": config.VISIBILITY_TIMEOUT,
+                    }
+                ],
+            },
+        )
+
+        self.receiver.extend_visibility()
+
+        # Released messages are not extended anymore
+        self.receiver.release(request)
+        self.receiver.extend_visibility()
+
+    def test_messages_of_expired_requests_are_deleted_instead_of_extended(self):
+        self.scheduler.on_expired = self.receiver.delete
+
+        self.add_queue_url()
+        self.add_receive(
+            [
+                {
+                    "MessageId": "1",
+                    "ReceiptHandle": "handle",
+                    "Body": '{"ETag": "expired", "timeout": "2000-01-01 00:00:00"}',
+                }
+            ]
+        )
+        assert self.receiver.receive(20, 10) == 1
+
+        self.add_delete("handle")
+        self.receiver.extend_visibility()
+
+        assert len(self.scheduler) == 0
+
+    def test_messages_not_run_are_made_visible_when_stopped(self):
+        self.receive_request()
+        self.stubber.add_response(
+            "change_message_visibility_batch",
+            {"Successful": [{"Id": "0"}], "Failed": []},
+            {
+                "QueueUrl": QUEUE_URL,
+                "Entries": [
+                    {"Id": "0", "ReceiptHandle": "handle", "VisibilityTimeout": 0}
+                ],
+            },
+        )
+
+        with mock.patch.object(config, "PREFETCH_MESSAGES", 0):
+            self.receiver.start()
+            self.receiver.stop()
+
+    def test_messages_are_deleted_when_received_by_default(self):
+        self.add_queue_url()
+        self.add_receive(
+            [{"MessageId": "1", "ReceiptHandle": "handle", "Body": BODY}]
+        )
+        self.add_delete("handle")
+
+        with mock.patch.object(config, "UNIQUE_MESSAGE_GROUPS", False):
+            assert self.receiver.receive(20, 10) == 1
+
+        request, _ = self.scheduler.pop()
+
+        # Nothing left to delete or extend
+        self.receiver.delete(request)
+        self.receiver.extend_visibility()
+
+    def test_prefetch_is_capped_at_free_capacity_with_multiple_replicas(self):
+        self.receiver.capacity = lambda: 2
+        self.scheduler.add({"ETag": "waiting", "timeout": "2900-01-01 00:00:00"})
+
+        assert self.receiver._room() == config.PREFETCH_MESSAGES - 1
+
+        with mock.patch.object(config, "MULTI_REPLICA", True):
+            assert self.receiver._room() == 1
@@ -1,7 +1,11 @@
 import base64
+import gzip
+import os
+
 import mock
 import pytest
 
+from worker.config import S3_MIN_PART_SIZE, _result_upload_part_size, config
 from worker.response import Response
 from worker.result import Result
 
@@ -34,11 +38,11 @@ class TestResponse:
     def test_upload_returns_etag_as_key_when_uploading(self, mocked_client):
         r = Result({})
         resp = Response(self.request, r)
-        type = "obj"
-        with mock.patch("worker.response.Emitter") as redis_emitter:
-            key = resp._upload(r, type)
+        type = "data"
+        with mock.patch("worker.helpers.clients.Emitter") as redis_emitter:
+            upload = resp._upload(r.data, type)
             assert redis_emitter.call_count >= 1
-            assert key == self.request["ETag"]
+            assert upload.key == self.request["ETag"]
 
     def test_construct_response_msg_works_with_signed_url(self):
         resp = Response(self.request, Result({"result1key": "result1val"}))
@@ -69,7 +73,7 @@ class TestResponse:
         resp = Response(self.request, result)
         spy = mocker.spy(resp, "_upload")
 
-        with mock.patch("worker.response.Emitter") as redis_emitter:
+        with mock.patch("worker.helpers.clients.Emitter") as redis_emitter:
             resp.publish()
             assert redis_emitter.call_count >= 1
         assert spy.call_count >= 1
@@ -87,7 +91,7 @@ class TestResponse:
         resp = Response(self.request, result)
         spy = mocker.spy(resp, "_upload")
 
-        with mock.patch("worker.response.Emitter") as redis_emitter:
+        with mock.patch("worker.helpers.clients.Emitter") as redis_emitter:
             resp.publish()
             assert redis_emitter.call_count >= 1
         assert spy.call_count >= 1
@@ -106,7 +110,214 @@ class TestResponse:
         resp = Response(self.request, result)
         spy = mocker.spy(resp, "_upload")
 
-        with mock.patch("worker.response.Emitter") as redis_emitter:
+        with mock.patch("worker.helpers.clients.Emitter") as redis_emitter:
             resp.publish()
             assert redis_emitter.call_count >= 1
         assert spy.call_count >= 1
+
+    @mock.patch("boto3.client")
+    def test_encoded_json_results_are_compressed_as_they_are(self, mocked_client):
+        data = b'{"truncatedExpression":[1.5,null]}'
+        resp = Response(self.request, Result(data))
+
+        with mock.patch("worker.helpers.clients.Emitter"):
+            upload = resp._upload(data, "data")
+
+        body = mocked_client.return_value.put_object.call_args.kwargs["Body"]
+        assert gzip.decompress(body) == data
+        assert gzip.decompress(resp._get_socket_data(upload)) == data
+
+    @mock.patch("boto3.client")
+    def test_upload_sets_tags_in_the_same_request(self, mocked_client):
+        resp = Response(self.request, Result({"a": 1}))
+
+        with mock.patch("worker.helpers.clients.Emitter"):
+            resp._upload({"a": 1}, "data")
+
+        s3 = mocked_client.return_value
+        assert s3.put_object.call_args.kwargs["Tagging"] == (
+            "experimentId=random-experiment-id&requestType=DifferentialExpression"
+        )
+        s3.put_object_tagging.assert_not_called()
+
+    @mock.patch("boto3.client")
+    def test_codec_of_the_task_is_recorded_in_the_metadata(self, mocked_client):
+        data = b'{"a":1}'
+
+        with mock.patch.object(
+            config, "RESULT_CODECS", {"DifferentialExpression": "zstd"}
+        ):
+            resp = Response(self.request, Result(data))
+
+        with mock.patch("worker.helpers.clients.Emitter"):
+            upload = resp._upload(data, "data")
+
+        put_object = mocked_client.return_value.put_object.call_args.kwargs
+        assert put_object["Metadata"] == {"content-codec": "zstd"}
+        assert resp.codec.decompress(put_object["Body"]) == data
+
+        # Clients only decode gzip results sent over the socket
+        assert resp._get_socket_data(upload) is None
+
+    def get_emitted(self, data, inline_bytes):
+        resp = Response(self.request, Result(data))
+        inline_bytes_by_task = {"DifferentialExpression": inline_bytes}
+
+        with mock.patch("boto3.client"), mock.patch(
+            "worker.helpers.clients.Emitter"
+        ) as emitter, mock.patch.object(
+            config, "SOCKET_INLINE_BYTES_BY_TASK", inline_bytes_by_task
+        ), mock.patch.object(
+            config, "SOCKET_CHUNK_SIZE", 400
+        ):
+            resp.publish()
+
+        emitted = {
+            "WorkResponse-random-etag": [],
+            "WorkResponseChunk-random-etag": [],
+        }
+        for call in emitter.return_value.Emit.call_args_list:
+            channel, message = call.args
+            if channel in emitted:
+                emitted[channel].append(message)
+
+        return emitted
+
+    def test_socket_data_is_the_compressed_result(self):
+        data = os.urandom(1000)
+
+        emitted = self.get_emitted(data, inline_bytes=2000)
+
+        [message] = emitted["WorkResponse-random-etag"]
+        assert gzip.decompress(base64.b64decode(message)) == data
+        assert emitted["WorkResponseChunk-random-etag"] == []
+
+    def test_results_over_the_inline_limit_are_only_in_s3_by_default(self):
+        data = os.urandom(1000)
+
+        emitted = self.get_emitted(data, inline_bytes=500)
+
+        [message] = emitted["WorkResponse-random-etag"]
+        assert "chunks" not in message["response"]
+        assert emitted["WorkResponseChunk-random-etag"] == []
+
+    def test_results_over_the_inline_limit_of_the_task_are_sent_in_chunks(self):
+        data = os.urandom(1000)
+
+        with mock.patch.object(config, "SOCKET_CHUNKED_BYTES", 2000):
+            emitted = self.get_emitted(data, inline_bytes=500)
+
+        chunks = emitted["WorkResponseChunk-random-etag"]
+        assert [(c["index"], c["count"]) for c in chunks] == [(0, 3), (1, 3), (2, 3)]
+
+        compressed = b"".join(base64.b64decode(c["data"]) for c in chunks)
+        assert gzip.decompress(compressed) == data
+
+        [message] = emitted["WorkResponse-random-etag"]
+        assert message["response"]["chunks"] == 3
+        assert message["response"]["signedUrl"] == "mockSignedUrl"
+
+    def test_results_over_the_chunked_limit_are_only_in_s3(self):
+        data = os.urandom(1000)
+
+        with mock.patch.object(config, "SOCKET_CHUNKED_BYTES", 500):
+            emitted = self.get_emitted(data, inline_bytes=500)
+
+        [message] = emitted["WorkResponse-random-etag"]
+        assert "chunks" not in message["response"]
+        assert emitted["WorkResponseChunk-random-etag"] == []
+
+    def get_emitted_cached(self, data, metadata):
+        resp = Response(self.request, Result(data))
+
+        with mock.patch("boto3.client") as mocked_client, mock.patch(
+            "worker.helpers.clients.Emitter"
+        ) as emitter:
+            resp.publish_cached(data, metadata)
+
+        mocked_client.return_value.put_object.assert_not_called()
+
+        return [
+            call.args[1]
+            for call in emitter.return_value.Emit.call_args_list
+            if call.args[0] == "WorkResponse-random-etag"
+        ]
+
+    def test_cached_results_are_sent_without_uploading_them(self):
+        data = gzip.compress(b'{"a":1}')
+
+        [message] = self.get_emitted_cached(data, {"content-codec": "gzip"})
+
+        assert base64.b64decode(message) == data
+
+    def test_cached_results_of_other_codecs_are_only_in_s3(self):
+        data = b"encoded"
+
+        [message] = self.get_emitted_cached(data, {"content-codec": "zstd-dict"})
+
+        assert message["response"]["signedUrl"] == "mockSignedUrl"
+
+    @mock.patch("boto3.client")
+    def test_small_results_are_cached_in_redis(self, mocked_client):
+        data = b'{"a":1}'
+        resp = Response(self.request, Result(data))
+
+        with mock.patch("worker.helpers.clients.Emitter"), mock.patch(
+            "worker.response.cache_result"
+        ) as cache_result:
+            resp.publish()
+
+        body = mocked_client.return_value.put_object.call_args.kwargs["Body"]
+        cache_result.assert_called_once_with(
+            "random-etag", body, {"content-codec": "gzip"}
+        )
+
+    @mock.patch("boto3.client")
+    def test_file_results_are_streamed_in_parts(self, mocked_client, tmp_path):
+        path = tmp_path / "rResult.gz"
+        path.write_bytes(b"x" * 25)
+
+        resp = Response(self.request, Result(str(path)))
+
+        with mock.patch("worker.helpers.clients.Emitter"), mock.patch.object(
+            config, "RESULT_UPLOAD_PART_SIZE", 10
+        ):
+            resp._upload(str(path), "path")
+
+        s3 = mocked_client.return_value
+        bodies = sorted(
+            (call.kwargs["PartNumber"], call.kwargs["Body"])
+            for call in s3.upload_part.call_args_list
+        )
+        assert bodies == [(1, b"x" * 10), (2, b"x" * 10), (3, b"x" * 5)]
+        s3.complete_multipart_upload.assert_called_once()
+
+    def test_upload_part_size_must_be_accepted_by_s3(self):
+        with mock.patch.dict(
+            os.environ, {"RESULT_UPLOAD_PART_SIZE": str(S3_MIN_PART_SIZE - 1)}
+        ), pytest.raises(ValueError):
+            _result_upload_part_size()
+
+        with mock.patch.dict(
+            os.environ, {"RESULT_UPLOAD_PART_SIZE": str(S3_MIN_PART_SIZE)}
+        ):
+            assert _result_upload_part_size() == S3_MIN_PART_SIZE
+
+    def test_stage_moves_file_results_to_a_path_unique_to_the_request(self, tmp_path):
+        tmp_result_path = str(tmp_path / "rResult.gz")
+        with open(tmp_result_path, "wb") as f:
+            f.write(b"result")
+
+        with mock.patch.object(config, "TMP_RESULTS_PATH_GZ", tmp_result_path):
+            resp = Response(self.request, Result(tmp_result_path))
+            resp.stage()
+
+        assert not os.path.exists(tmp_result_path)
+        assert resp.file_path == f"{tmp_result_path}.{self.request['ETag']}"
+        assert os.path.exists(resp.file_path)
+
+    def test_stage_does_nothing_for_data_results(self):
+        resp = Response(self.request, Result({"result1key": "result1val"}))
+        resp.stage()
+
+        assert resp.file_path is None
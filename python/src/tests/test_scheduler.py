@@ -0,0 +1,104 @@
+import threading
+
+from worker.helpers import metrics
+from worker.scheduler import Scheduler
+from worker.tasks.factory import TaskFactory
+
+
+def get_request(etag, name="GetEmbedding", timeout="2900-01-01 00:00:00"):
+    return {"ETag": etag, "timeout": timeout, "body": {"name": name}}
+
+
+class TestScheduler:
+    def pop_all(self, scheduler):
+        etags = []
+        while True:
+            scheduled = scheduler.pop()
+            if scheduled is None:
+                return etags
+
+            request, _ = scheduled
+            etags.append(request["ETag"])
+
+    def test_interactive_tasks_run_before_bulk_ones(self):
+        scheduler = Scheduler(TaskFactory.tasks)
+
+        scheduler.add(get_request("export", "DownloadAnnotSeuratObject"))
+        scheduler.add(get_request("embedding", "GetEmbedding"))
+        scheduler.add(get_request("umis", "GetNUmis"))
+
+        assert self.pop_all(scheduler) == ["embedding", "umis", "export"]
+
+    def test_earliest_deadlines_run_first(self):
+        scheduler = Scheduler(TaskFactory.tasks)
+
+        scheduler.add(get_request("late", timeout="2900-01-01 00:10:00"))
+        scheduler.add(get_request("early", timeout="2900-01-01 00:00:00"))
+        scheduler.add(get_request("same", timeout="2900-01-01 00:10:00"))
+
+        assert self.pop_all(scheduler) == ["early", "late", "same"]
+
+    def test_expired_requests_are_dropped(self):
+        scheduler = Scheduler(TaskFactory.tasks)
+
+        scheduler.add(get_request("expired", timeout="2000-01-01 00:00:00"))
+        scheduler.add(get_request("valid"))
+
+        assert self.pop_all(scheduler) == ["valid"]
+        assert metrics.get_counter("scheduler.expired") == 1
+
+    def test_trace_headers_are_kept(self):
+        scheduler = Scheduler(TaskFactory.tasks)
+        request = get_request("etag")
+
+        scheduler.add(request, "Root=1-5759e988-bd862e3fe1be46a994272793")
+
+        assert scheduler.pop() == (request, "Root=1-5759e988-bd862e3fe1be46a994272793")
+        assert len(scheduler) == 0
+
+    def test_pop_waits_for_requests_to_be_added(self):
+        scheduler = Scheduler(TaskFactory.tasks)
+        request = get_request("etag")
+
+        timer = threading.Timer(0.05, scheduler.add, [request])
+        timer.start()
+
+        assert scheduler.pop(timeout=5) == (request, None)
+        assert scheduler.pop(timeout=0.01) is None
+
+    def test_expired_requests_are_passed_to_on_expired(self):
+        expired = []
+        scheduler = Scheduler(TaskFactory.tasks, on_expired=expired.append)
+        request = get_request("expired", timeout="2000-01-01 00:00:00")
+
+        scheduler.add(request)
+
+        assert scheduler.pop() is None
+        assert expired == [request]
+
+    def test_expired_requests_behind_the_next_one_are_dropped(self):
+        expired = []
+        scheduler = Scheduler(TaskFactory.tasks, on_expired=expired.append)
+        bulk = get_request(
+            "export", "DownloadAnnotSeuratObject", timeout="2000-01-01 00:00:00"
+        )
+        request = get_request("embedding")
+
+        scheduler.add(bulk)
+        scheduler.add(request)
+
+        assert scheduler.pop() == (request, None)
+        assert expired == [bulk]
+        assert len(scheduler) == 0
+
+    def test_drop_expired_keeps_requests_still_waiting(self):
+        expired = []
+        scheduler = Scheduler(TaskFactory.tasks, on_expired=expired.append)
+        request = get_request("expired", timeout="2000-01-01 00:00:00")
+
+        scheduler.add(get_request("valid"))
+        scheduler.add(request)
+        scheduler.drop_expired()
+
+        assert expired == [request]
+        assert self.pop_all(scheduler) == ["valid"]
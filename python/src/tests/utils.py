@@ -1,4 +1,218 @@
+import hashlib
+import io
+from contextlib import contextmanager
+from unittest import mock
+
+from aws_xray_sdk import global_sdk_config
+from aws_xray_sdk.core import xray_recorder
+from lupa.lua51 import LuaRuntime, lua_type
+
+
 def get_cell_ids(cell_class_key, cell_set_key, cell_sets):
     cell_class = next(cell_class for cell_class in cell_sets["cellSets"] if cell_class["key"] == cell_class_key)
     cell_ids = next(cell_set for cell_set in cell_class["children"] if cell_set["key"] == cell_set_key)["cellIds"]
-    return cell_ids
\ No newline at end of file
+    return cell_ids
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode("utf-8")
+
+
+class FakeRedis:
+    """In-memory stand-in for the few Redis commands the worker uses.
+
+    Scripts are run by Lua 5.1, as in Redis, with `redis.call` running the
+    commands of this class.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and name in self.values:
+            return None
+
+        self.values[name] = value.encode("utf-8") if isinstance(value, str) else value
+        self.expires[name] = ex
+        return True
+
+    def get(self, name):
+        value = self.values.get(name)
+        return str(value).encode("utf-8") if isinstance(value, int) else value
+
+    def exists(self, name):
+        return int(name in self.values)
+
+    def delete(self, name):
+        self.expires.pop(name, None)
+        return int(self.values.pop(name, None) is not None)
+
+    def expire(self, name, time):
+        if name not in self.values:
+            return 0
+
+        self.expires[name] = int(time)
+        return 1
+
+    def incrby(self, name, amount):
+        self.values[name] = self.values.get(name, 0) + int(amount)
+        return self.values[name]
+
+    def decrby(self, name, amount):
+        return self.incrby(name, -int(amount))
+
+    def hset(self, name, key, value):
+        values = self.values.setdefault(name, {})
+        is_new = key not in values
+
+        values[key] = _to_bytes(value)
+        return int(is_new)
+
+    def hget(self, name, key):
+        return self.values.get(name, {}).get(key)
+
+    def hdel(self, name, key):
+        return int(self.values.get(name, {}).pop(key, None) is not None)
+
+    def zadd(self, name, score, member):
+        scores = self.values.setdefault(name, {})
+        is_new = member not in scores
+
+        scores[member] = float(score)
+        return int(is_new)
+
+    def zrem(self, name, member):
+        return int(self.values.get(name, {}).pop(member, None) is not None)
+
+    def _zmembers(self, name):
+        scores = self.values.get(name, {})
+        return sorted(scores, key=lambda member: (scores[member], member))
+
+    def zrange(self, name, start, end):
+        members = self._zmembers(name)
+        end = len(members) if int(end) == -1 else int(end) + 1
+        return [member.encode("utf-8") for member in members[int(start):end]]
+
+    def zrangebyscore(self, name, min, max):
+        scores = self.values.get(name, {})
+        return [
+            member.encode("utf-8")
+            for member in self._zmembers(name)
+            if float(min) <= scores[member] <= float(max)
+        ]
+
+    def _call(self, keys, command, *args):
+        # Keys, fields and members are strings, values stay as bytes
+        command = command.decode("utf-8").lower()
+        args = [
+            arg.decode("utf-8") if isinstance(arg, bytes) and i == 0 else arg
+            for i, arg in enumerate(args)
+        ]
+
+        # As in Redis Cluster, scripts can only touch the keys they are given
+        if args[0] not in keys:
+            raise ValueError(f"Script touches {args[0]}, which is not in KEYS")
+
+        if command == "set":
+            name, value, _, ex = args
+            return self.set(name, value, ex=int(ex))
+
+        if command in ("hget", "hset", "hdel", "zrem"):
+            args[1] = args[1].decode("utf-8")
+        if command == "zadd":
+            args[2] = args[2].decode("utf-8")
+        if command == "zrangebyscore":
+            args[1:] = [
+                arg.decode("utf-8") if isinstance(arg, bytes) else arg
+                for arg in args[1:]
+            ]
+
+        return getattr(self, {"del": "delete"}.get(command, command))(*args)
+
+    def eval(self, script, numkeys, *keys_and_args):
+        lua = LuaRuntime(encoding=None)
+
+        def to_lua(value):
+            # Missing values are false in Lua, lists are tables
+            if value is None:
+                return False
+            if value is True:
+                return lua.table_from({b"ok": b"OK"})
+            if isinstance(value, list):
+                return lua.table_from(value)
+            return value
+
+        keys = [str(key) for key in keys_and_args[:numkeys]]
+
+        def call(command, *args):
+            return to_lua(self._call(keys, command, *args))
+
+        lua.globals().redis = lua.table_from({b"call": call})
+
+        keys_and_args = [_to_bytes(value) for value in keys_and_args]
+        lua.globals().KEYS = lua.table_from(keys_and_args[:numkeys])
+        lua.globals().ARGV = lua.table_from(keys_and_args[numkeys:])
+
+        result = lua.execute(script)
+
+        if lua_type(result) == "table":
+            return list(result.values())
+        if isinstance(result, float):
+            return int(result)
+        return None if result is False else result
+
+
+class FakeS3Object:
+    """Serves `data` to the HEAD and ranged GET requests of a mocked S3 client.
+
+    If `part_size` is set, the object looks like it was uploaded in parts of
+    that size, with a multipart ETag.
+    """
+
+    def __init__(self, data, part_size=None):
+        self.data = data
+        self.part_size = part_size
+
+        if part_size:
+            parts = [data[i:i + part_size] for i in range(0, len(data), part_size)]
+            digests = b"".join(hashlib.md5(part).digest() for part in parts)
+            self.etag = f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'
+        else:
+            self.etag = f'"{hashlib.md5(data).hexdigest()}"'
+
+    def head_object(self, Bucket, Key, PartNumber=None):
+        if PartNumber is None:
+            return {"ContentLength": len(self.data), "ETag": self.etag}
+
+        start = (PartNumber - 1) * self.part_size
+        part = self.data[start:start + self.part_size]
+        parts_count = -(-len(self.data) // self.part_size)
+
+        return {
+            "ContentLength": len(part),
+            "ETag": self.etag,
+            "PartsCount": parts_count,
+        }
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = Range[len("bytes="):].split("-")
+        return {"Body": io.BytesIO(self.data[int(start):int(end) + 1])}
+
+    def mock(self, s3):
+        s3.head_object.side_effect = self.head_object
+        s3.get_object.side_effect = self.get_object
+
+
+@contextmanager
+def xray_enabled():
+    """Enables X-Ray, yielding a mock of the emitter that sends segments."""
+    emitter = xray_recorder.emitter
+    xray_recorder.emitter = mock.Mock()
+    global_sdk_config.set_sdk_enabled(True)
+    try:
+        yield xray_recorder.emitter
+    finally:
+        xray_recorder.clear_trace_entities()
+        global_sdk_config.set_sdk_enabled(False)
+        xray_recorder.emitter = emitter
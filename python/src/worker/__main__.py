@@ -2,19 +2,14 @@ import datetime
 import time
 from logging import INFO, basicConfig, info
 
-import aws_xray_sdk as xray
-from aws_xray_sdk.core import xray_recorder
-
 from .config import config
-from .consume_message import consume
-from .response import Response
+from .consume_message import consume, receiver
+from .executor import TaskExecutor
+from .helpers import metrics
+from .helpers.clients import clients
+from .helpers.tracing import background_segment
+from .publisher import Publisher
 from .tasks.factory import TaskFactory
-from worker.helpers.send_status_updates import send_status_update
-
-from socket_io_emitter import Emitter
-
-
-from worker_status_codes import STARTED_TASK
 
 # configure logging
 basicConfig(format="%(asctime)s %(message)s", level=INFO)
@@ -30,37 +25,44 @@ def main():
         info("Experiment not yet assigned, waiting...")
         time.sleep(5)
 
-    # Disable X-Ray for initial setup so we don't end up
-    # with segment warnings before any message is sent
-    xray.global_sdk_config.set_sdk_enabled(False)
-
     last_activity = datetime.datetime.utcnow()
-    task_factory = TaskFactory()
+
+    # The setup runs before any request, it is not traced
+    with background_segment("worker-setup"):
+        task_factory = TaskFactory()
+
+    publisher = Publisher(receiver=receiver)
+    executor = TaskExecutor(task_factory, publisher, receiver=receiver)
+    receiver.capacity = executor.free_capacity
     info(
-        f"Now listening for experiment {config.EXPERIMENT_ID}, waiting for work to do..."
+        f"Now listening for experiment {config.EXPERIMENT_ID}, "
+        f"running up to {executor.max_workers} task(s) at a time..."
     )
 
     while (
         datetime.datetime.utcnow() - last_activity
     ).total_seconds() <= config.TIMEOUT or config.IGNORE_TIMEOUT:
-        # Disable X-Ray before message is identified and processed
-        xray.global_sdk_config.set_sdk_enabled(False)
+        # Only take the next request once it can run. Up to PREFETCH_MESSAGES
+        # more are received in the background and hidden from other workers
+        # while they wait
+        executor.wait_for_capacity()
 
         request = consume()
         if request:
-            io = Emitter({"client": config.REDIS_CLIENT})
-            send_status_update(io, request["experimentId"], STARTED_TASK, request)
-
-            result = task_factory.submit(request)
-
-            response = Response(request, result)
-            response.publish()
+            executor.submit(request)
 
+        # Tasks still running count as activity
+        if request or executor.busy():
             last_activity = datetime.datetime.utcnow()
 
-        xray_recorder.end_segment()
-
     info("Timeout exceeded, shutting down...")
+    executor.shutdown()
+    publisher.shutdown()
+    task_factory.count_matrix.stop()
+    receiver.stop()
+
+    info(f"Connections opened by AWS clients: {clients.connections_created()}")
+    info(f"Worker metrics: {metrics.snapshot()}")
 
 
 main()
@@ -14,6 +14,84 @@ cluster_env = os.getenv("CLUSTER_ENV")
 timeout = get_domain_specific().get(kube_env, {}).get('timeout', 10 * 60)
 
 ignore_timeout = os.getenv("IGNORE_TIMEOUT") == "true"
+max_concurrent_tasks = int(os.getenv("MAX_CONCURRENT_TASKS", 1))
+publish_queue_size = int(os.getenv("PUBLISH_QUEUE_SIZE", 4))
+prefetch_messages = int(os.getenv("PREFETCH_MESSAGES", 10))
+visibility_timeout = int(os.getenv("VISIBILITY_TIMEOUT", 120))
+# The API sends each request with its own MessageGroupId, so messages can stay in
+# the FIFO queue until their response is published without holding back others
+unique_message_groups = os.getenv("UNIQUE_MESSAGE_GROUPS", "false") == "true"
+cell_order_cache_size = int(os.getenv("CELL_ORDER_CACHE_SIZE", 64))
+r_worker_binary_requests = os.getenv("R_WORKER_BINARY_REQUESTS", "true") == "true"
+r_worker_ready_poll_interval = float(os.getenv("R_WORKER_READY_POLL_INTERVAL", 0.25))
+r_worker_ready_timeout = float(os.getenv("R_WORKER_READY_TIMEOUT", 30 * 60))
+# Same as in the R worker, which rejects requests with 409 while it drains
+r_worker_drain_timeout = float(os.getenv("R_WORKER_DRAIN_TIMEOUT", 40 * 60))
+# Smallest size of the parts of a multipart upload, except the last one
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _result_upload_part_size():
+    part_size = int(os.getenv("RESULT_UPLOAD_PART_SIZE", 16 * 1024 * 1024))
+
+    # S3 would only reject the parts when the upload is completed
+    if part_size < S3_MIN_PART_SIZE:
+        raise ValueError(
+            f"env.RESULT_UPLOAD_PART_SIZE is {part_size}, "
+            f"it must be at least {S3_MIN_PART_SIZE} bytes"
+        )
+
+    return part_size
+
+
+result_upload_part_size = _result_upload_part_size()
+result_upload_concurrency = int(os.getenv("RESULT_UPLOAD_CONCURRENCY", 4))
+
+
+def _task_settings(name, cast=str):
+    # e.g. "GeneExpression=zstd:3,GetEmbedding=gzip"
+    return dict(
+        (task_name.strip(), cast(value.strip()))
+        for task_name, _, value in (
+            entry.partition("=") for entry in os.getenv(name, "").split(",")
+        )
+        if task_name.strip()
+    )
+
+
+result_codec = os.getenv("RESULT_CODEC", "gzip")
+result_codecs = _task_settings("RESULT_CODECS")
+socket_inline_bytes = int(os.getenv("SOCKET_INLINE_BYTES", 250 * 1000))
+socket_inline_bytes_by_task = _task_settings("SOCKET_INLINE_BYTES_BY_TASK", int)
+socket_chunked_bytes = int(os.getenv("SOCKET_CHUNKED_BYTES", 0))
+socket_chunk_size = int(os.getenv("SOCKET_CHUNK_SIZE", 250 * 1000))
+result_cache_enabled = os.getenv("RESULT_CACHE_ENABLED", "false") == "true"
+result_cache_ttl = int(os.getenv("RESULT_CACHE_TTL", 60 * 60))
+result_cache_max_result_bytes = int(
+    os.getenv("RESULT_CACHE_MAX_RESULT_BYTES", 1000 * 1000)
+)
+result_cache_bytes = int(os.getenv("RESULT_CACHE_BYTES", 256 * 1000 * 1000))
+result_index_missing_ttl = float(os.getenv("RESULT_INDEX_MISSING_TTL", 5))
+# Several workers share the queue of the experiment
+multi_replica = os.getenv("MULTI_REPLICA", "false") == "true"
+mutating_lock_ttl = int(os.getenv("MUTATING_LOCK_TTL", 30 * 60))
+shared_matrix_dir = os.getenv("SHARED_MATRIX_DIR")
+in_flight_locks_enabled = (
+    os.getenv("IN_FLIGHT_LOCKS_ENABLED", "true" if multi_replica else "false")
+    == "true"
+)
+in_flight_lock_ttl = int(os.getenv("IN_FLIGHT_LOCK_TTL", 15 * 60))
+matrix_download_part_size = int(
+    os.getenv("MATRIX_DOWNLOAD_PART_SIZE", 64 * 1024 * 1024)
+)
+matrix_download_concurrency = int(os.getenv("MATRIX_DOWNLOAD_CONCURRENCY", 8))
+matrix_cache_dir = os.getenv("MATRIX_CACHE_DIR")
+matrix_cache_bytes = int(os.getenv("MATRIX_CACHE_BYTES", 64 * 1024 * 1024 * 1024))
+matrix_sync_interval = float(os.getenv("MATRIX_SYNC_INTERVAL", 60))
+matrix_sync_notifications = os.getenv("MATRIX_SYNC_NOTIFICATIONS", "true") == "true"
+zstd_threads = int(os.getenv("ZSTD_THREADS", -1))
+zstd_dictionary_path = os.getenv("ZSTD_DICTIONARY_PATH")
+embedding_cache_bytes = int(os.getenv("EMBEDDING_CACHE_BYTES", 512 * 1024 * 1024))
 aws_account_id = os.getenv("AWS_ACCOUNT_ID")
 aws_region = os.getenv("AWS_DEFAULT_REGION")
 
@@ -109,6 +187,39 @@ config = Config(
     CLUSTER_ENV=cluster_env,
     TIMEOUT=timeout,
     IGNORE_TIMEOUT=ignore_timeout,
+    MAX_CONCURRENT_TASKS=max_concurrent_tasks,
+    PUBLISH_QUEUE_SIZE=publish_queue_size,
+    PREFETCH_MESSAGES=prefetch_messages,
+    VISIBILITY_TIMEOUT=visibility_timeout,
+    UNIQUE_MESSAGE_GROUPS=unique_message_groups,
+    CELL_ORDER_CACHE_SIZE=cell_order_cache_size,
+    EMBEDDING_CACHE_BYTES=embedding_cache_bytes,
+    RESULT_UPLOAD_PART_SIZE=result_upload_part_size,
+    RESULT_UPLOAD_CONCURRENCY=result_upload_concurrency,
+    RESULT_CODEC=result_codec,
+    RESULT_CODECS=result_codecs,
+    SOCKET_INLINE_BYTES=socket_inline_bytes,
+    SOCKET_INLINE_BYTES_BY_TASK=socket_inline_bytes_by_task,
+    SOCKET_CHUNKED_BYTES=socket_chunked_bytes,
+    SOCKET_CHUNK_SIZE=socket_chunk_size,
+    RESULT_CACHE_ENABLED=result_cache_enabled,
+    RESULT_CACHE_TTL=result_cache_ttl,
+    RESULT_CACHE_MAX_RESULT_BYTES=result_cache_max_result_bytes,
+    RESULT_CACHE_BYTES=result_cache_bytes,
+    RESULT_INDEX_MISSING_TTL=result_index_missing_ttl,
+    MULTI_REPLICA=multi_replica,
+    MUTATING_LOCK_TTL=mutating_lock_ttl,
+    SHARED_MATRIX_DIR=shared_matrix_dir,
+    IN_FLIGHT_LOCKS_ENABLED=in_flight_locks_enabled,
+    IN_FLIGHT_LOCK_TTL=in_flight_lock_ttl,
+    MATRIX_DOWNLOAD_PART_SIZE=matrix_download_part_size,
+    MATRIX_DOWNLOAD_CONCURRENCY=matrix_download_concurrency,
+    MATRIX_CACHE_DIR=matrix_cache_dir,
+    MATRIX_CACHE_BYTES=matrix_cache_bytes,
+    MATRIX_SYNC_INTERVAL=matrix_sync_interval,
+    MATRIX_SYNC_NOTIFICATIONS=matrix_sync_notifications,
+    ZSTD_THREADS=zstd_threads,
+    ZSTD_DICTIONARY_PATH=zstd_dictionary_path,
     AWS_ACCOUNT_ID=aws_account_id,
     AWS_DEFAULT_REGION=aws_region,
     BOTO_RESOURCE_KWARGS={"region_name": aws_region},
@@ -116,10 +227,15 @@ config = Config(
     SOURCE_BUCKET=f"processed-matrix-{cluster_env}-{aws_account_id}",
     RESULTS_BUCKET=f"worker-results-{cluster_env}-{aws_account_id}",
     R_WORKER_URL="http://localhost:4000",
+    R_WORKER_BINARY_REQUESTS=r_worker_binary_requests,
+    R_WORKER_READY_POLL_INTERVAL=r_worker_ready_poll_interval,
+    R_WORKER_READY_TIMEOUT=r_worker_ready_timeout,
+    R_WORKER_DRAIN_TIMEOUT=r_worker_drain_timeout,
     # this works because in CI, `data/` is deployed under `worker/`
     # whereas in a container, it is mounted to `/data`. Either way, this ensures
     # that the appropriate path is selected, as both are two directories up
     LOCAL_DIR=os.path.join(os.pardir, os.pardir, "data"),
+    EMBEDDING_CACHE_DIR=os.path.join(os.pardir, os.pardir, "data", "embeddings"),
     RDS_PATH = "/data/processed.rds",
     TMP_RESULTS_PATH_GZ = "/data/rResult.gz"
 )
@@ -1,112 +1,93 @@
-import datetime
 import json
-import traceback
 from logging import info
 
-import aws_xray_sdk as xray
-import boto3
-import dateutil
-import pytz
 from aws_xray_sdk.core import xray_recorder
 from aws_xray_sdk.core.models.trace_header import TraceHeader
-from botocore.exceptions import ClientError
 
 from .config import config
+from .helpers.in_flight import start_request
+from .helpers.result_cache import get_cached_result
+from .helpers.result_index import result_exists
+from .helpers.tracing import background_segment, begin_request_segment
+from .receiver import Receiver
+from .response import Response
+from .result import Result
+from .scheduler import Scheduler
+from .tasks.factory import TaskFactory
 
 
-def _read_sqs_message():
-    sqs = boto3.resource("sqs", **config.BOTO_RESOURCE_KWARGS)
+def _on_expired(mssg_body):
+    # Expired requests are not run, their messages are not needed anymore
+    with background_segment("worker-expired-request"):
+        receiver.delete(mssg_body)
 
-    """
-    It is possible that the queue was not created by the time
-    the worker launches, because the work queue creation (if needed)
-    and the Job spawn are on separate promises and work asyncrhonously.
-    This is a performance improvement but it causes the race condition above.
 
-    If this is the case, we just return an empty response
-    as if we didn't receive a message in this time frame.
-    """
-    try:
-        queue = sqs.get_queue_by_name(QueueName=config.QUEUE_NAME)
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "AWS.SimpleQueueService.NonExistentQueue":
-            return None
-        else:
-            raise e
-
-    message = queue.receive_messages(
-        WaitTimeSeconds=20, AttributeNames=["AWSTraceHeader"]
-    )
-
-    if not message:
-        return None
+scheduler = Scheduler(TaskFactory.tasks, on_expired=_on_expired)
+receiver = Receiver(scheduler)
 
-    # Try to parse it as JSON
-    try:
-        message = message[0]
 
-        trace_header = message.attributes and message.attributes.get(
-            "AWSTraceHeader", None
-        )
+def _begin_segment(trace_header):
+    header = TraceHeader.from_header_str(trace_header) if trace_header else None
 
-        if trace_header:
-            xray.global_sdk_config.set_sdk_enabled(True)
+    begin_request_segment(f"worker-{config.CLUSTER_ENV}-{config.SANDBOX_ID}", header)
 
-            header = TraceHeader.from_header_str(trace_header)
-            trace_id = header.root
-            sampled = header.sampled
 
-            xray_recorder.begin_segment(
-                f"worker-{config.CLUSTER_ENV}-{config.SANDBOX_ID}",
-                traceid=trace_id,
-                sampling=sampled,
-                parent_id=header.parent,
-            )
+def _is_cacheable(mssg_body):
+    task_class = TaskFactory.tasks.get(mssg_body.get("body", {}).get("name"))
 
-        body = json.loads(message.body)
-        info("Consumed a message from SQS.")
-    except Exception as e:
-        xray_recorder.current_segment().add_exception(e, traceback.format_exc())
+    return task_class is None or task_class.cacheable
 
-        info("Exception when loading message", message.body)
-        info("Exception:", e)
-        return None
-    finally:
-        message.delete()
 
-    return body
+@xray_recorder.capture("consume_message._send_cached_response")
+def _send_cached_response(mssg_body):
+    """Sends the result of the request if it is in Redis, returns whether it was."""
+    if not _is_cacheable(mssg_body):
+        return False
+
+    cached = get_cached_result(mssg_body["ETag"])
+    if cached is None:
+        return False
+
+    data, metadata = cached
+    Response(mssg_body, Result(data)).publish_cached(data, metadata)
+
+    return True
 
 
 @xray_recorder.capture("consume_message._response_exists")
 def _response_exists(mssg_body):
-    client = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
-    ETag = mssg_body["ETag"]
-
-    response = client.list_objects_v2(
-        Bucket=config.RESULTS_BUCKET,
-        Prefix=ETag,
-    )
+    if not _is_cacheable(mssg_body):
+        return False
 
-    for obj in response.get("Contents", []):
-        if obj["Key"] == ETag:
-            return obj["Size"]
+    return result_exists(mssg_body["ETag"])
 
 
 def consume():
-    mssg_body = _read_sqs_message()
+    """Returns the next request to run, or None if there is none right now.
 
-    if not mssg_body:
+    Messages are received in the background into the scheduler, which decides
+    the order they run in. Waits up to 20 seconds for one if there are none.
+    Messages of requests that are skipped are deleted from the queue.
+
+    The X-Ray segment of the returned request is left open on this thread, the
+    segments of skipped requests are ended.
+    """
+    receiver.start()
+
+    scheduled = scheduler.pop(timeout=20)
+    if not scheduled:
         return None
 
-    timeout = mssg_body["timeout"]
-    timeout = dateutil.parser.parse(timeout).astimezone(pytz.utc).replace(tzinfo=None)
+    mssg_body, trace_header = scheduled
+    _begin_segment(trace_header)
 
-    if timeout <= datetime.datetime.utcnow():
+    if _send_cached_response(mssg_body):
         info(
             f"Skipping processing task with ETag {mssg_body['ETag']} "
-            f"as its timeout of {timeout} has expired..."
+            f"as its response was sent from Redis."
         )
-
+        receiver.delete(mssg_body)
+        xray_recorder.end_segment()
         return None
 
     if _response_exists(mssg_body):
@@ -114,6 +95,18 @@ def consume():
             f"Skipping processing task with ETag {mssg_body['ETag']} "
             f"as a response with this hash is already in S3."
         )
+        receiver.delete(mssg_body)
+        xray_recorder.end_segment()
+        return None
+
+    # Duplicates of a request that is running get its result
+    if _is_cacheable(mssg_body) and not start_request(mssg_body["ETag"]):
+        info(
+            f"Skipping processing task with ETag {mssg_body['ETag']} "
+            f"as a request with this hash is already running."
+        )
+        receiver.delete(mssg_body)
+        xray_recorder.end_segment()
         return None
 
     info(json.dumps(mssg_body, indent=2, sort_keys=True))
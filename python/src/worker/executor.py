@@ -0,0 +1,124 @@
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from logging import error, info
+
+from worker_status_codes import STARTED_TASK
+
+from .config import config
+from .helpers.clients import clients
+from .helpers.in_flight import finish_request
+from .helpers.redis_lock import RedisLock
+from .helpers.send_status_updates import send_status_update
+from .helpers.tracing import end_segment, in_segment, take_segment
+from .response import Response
+
+
+class TaskExecutor:
+    """Runs consumed requests on a bounded pool of threads.
+
+    Up to `max_workers` tasks are kept in flight at the same time, so a burst of
+    independent requests (e.g. all the plots of a page) is served in roughly the
+    time of the slowest one. Tasks marked as `exclusive` never overlap with each
+    other, and `mutating` ones don't overlap with those of other pods either
+    when several workers share the queue (`config.MULTI_REPLICA`). Results are
+    handed over to the publisher, which uploads them in the background. Requests
+    that fail before that are `release`d to `receiver`, to be received again.
+    """
+
+    def __init__(self, task_factory, publisher, max_workers=None, receiver=None):
+        self.task_factory = task_factory
+        self.publisher = publisher
+        self.receiver = receiver
+        self.max_workers = max_workers or config.MAX_CONCURRENT_TASKS
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="task"
+        )
+        self._in_flight = set()
+        self._exclusive_lock = threading.Lock()
+        self._experiment_lock = RedisLock(
+            f"worker-mutating:{config.EXPERIMENT_ID}", config.MUTATING_LOCK_TTL
+        )
+
+    def busy(self):
+        self._in_flight = {f for f in self._in_flight if not f.done()}
+        return len(self._in_flight) > 0 or self.publisher.pending() > 0
+
+    def free_capacity(self):
+        """Returns how many more tasks can start right now."""
+        return self.max_workers - sum(not f.done() for f in list(self._in_flight))
+
+    def wait_for_capacity(self):
+        self._in_flight = {f for f in self._in_flight if not f.done()}
+
+        if len(self._in_flight) >= self.max_workers:
+            wait(self._in_flight, return_when=FIRST_COMPLETED)
+
+    def submit(self, request):
+        # The X-Ray segment was started by this thread when the message was
+        # consumed, hand it over to the thread that will run the task.
+        segment = take_segment()
+
+        future = self._pool.submit(self._run, request, segment)
+        self._in_flight.add(future)
+
+        return future
+
+    def shutdown(self):
+        info("Waiting for tasks in flight to finish...")
+        self._pool.shutdown(wait=True)
+
+    def _task_class(self, request):
+        task_name = request.get("body", {}).get("name")
+        return self.task_factory.tasks.get(task_name)
+
+    def _is_exclusive(self, request):
+        task_class = self._task_class(request)
+
+        return task_class is not None and task_class.exclusive
+
+    def _mutating_lock(self, request):
+        """Lock that keeps workers of other pods from modifying the experiment
+        at the same time, when several workers share its queue.
+        """
+        task_class = self._task_class(request)
+
+        if not config.MULTI_REPLICA or task_class is None or not task_class.mutating:
+            return nullcontext()
+
+        return self._experiment_lock
+
+    def _run(self, request, segment):
+        with in_segment(segment):
+            try:
+                if self._is_exclusive(request):
+                    with self._exclusive_lock, self._mutating_lock(request):
+                        self._process(request, segment)
+                else:
+                    self._process(request, segment)
+            except Exception:
+                error(
+                    f"Exception while processing request {request.get('ETag')}:\n"
+                    f"{traceback.format_exc()}"
+                )
+
+                # No result will be published, duplicates have to run again
+                finish_request(request.get("ETag"))
+
+                if self.receiver:
+                    self.receiver.release(request)
+
+                end_segment(segment)
+
+    def _process(self, request, segment):
+        io = clients.emitter
+        send_status_update(io, request["experimentId"], STARTED_TASK, request)
+
+        result = self.task_factory.submit(request)
+
+        response = Response(request, result)
+
+        # The segment is ended by the publisher, once the response is published
+        self.publisher.publish(response, segment)
@@ -0,0 +1,149 @@
+from functools import reduce
+
+import numpy as np
+
+CELL_ID_DTYPE = np.int32
+
+
+def _sorted_unique(cell_ids):
+    # Sort based, np.unique can be several times slower for large arrays
+    cell_ids = np.sort(cell_ids)
+
+    if len(cell_ids) == 0:
+        return cell_ids
+
+    is_new = np.empty(len(cell_ids), dtype=bool)
+    is_new[0] = True
+    np.not_equal(cell_ids[1:], cell_ids[:-1], out=is_new[1:])
+
+    return cell_ids[is_new]
+
+
+def _as_cell_ids(cell_ids):
+    return _sorted_unique(np.asarray(cell_ids, dtype=CELL_ID_DTYPE))
+
+
+def empty():
+    return np.empty(0, dtype=CELL_ID_DTYPE)
+
+
+# Set algebra over sorted arrays of unique cell ids, every result is
+# again a sorted array of unique cell ids
+
+
+def union(*cell_ids):
+    if not cell_ids:
+        return empty()
+
+    return _sorted_unique(np.concatenate(cell_ids).astype(CELL_ID_DTYPE, copy=False))
+
+
+def intersection(first, *others):
+    return reduce(
+        lambda acum, current: np.intersect1d(acum, current, assume_unique=True),
+        others,
+        first,
+    )
+
+
+def difference(first, *others):
+    if not others:
+        return first
+
+    return np.setdiff1d(first, union(*others), assume_unique=True)
+
+
+class CellSetIndex:
+    """Cell sets of an experiment, indexed by key.
+
+    Each cell set is stored as a sorted array of unique int32 cell ids, the
+    cell ids of a set with children include the ones of all its descendants.
+    The index is built once per version of the cell sets, so helpers can
+    combine sets with vectorized set algebra instead of building Python
+    sets from the cell sets JSON on every request.
+    """
+
+    def __init__(self, cell_sets, version=None):
+        self.version = version
+        self.roots = []
+
+        self._nodes = {}
+        self._parents = {}
+        self._children = {}
+        self._cell_ids = {}
+
+        for cell_set in cell_sets:
+            self._add(cell_set, parent=None)
+            self.roots.append(cell_set["key"])
+
+    def _add(self, cell_set, parent):
+        key = cell_set["key"]
+        children = cell_set.get("children") or []
+
+        # Lookups by key return the first set with that key, like the
+        # depth-first searches over the cell sets JSON used to
+        if key not in self._nodes:
+            self._nodes[key] = cell_set
+            self._parents[key] = parent
+            self._children[key] = [child["key"] for child in children]
+
+        cell_ids = [_as_cell_ids(cell_set.get("cellIds", []))]
+        for child in children:
+            cell_ids.append(self._add(child, parent=key))
+
+        cell_ids = union(*cell_ids)
+        cell_ids.flags.writeable = False
+        self._cell_ids.setdefault(key, cell_ids)
+
+        return cell_ids
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    def node(self, key):
+        """Returns the cell set JSON object, which must not be modified."""
+        return self._nodes[key]
+
+    def parent(self, key):
+        return self._parents[key]
+
+    def children(self, key):
+        return self._children[key]
+
+    def siblings(self, key):
+        parent = self._parents[key]
+        keys = self.roots if parent is None else self._children[parent]
+
+        return [sibling for sibling in keys if sibling != key]
+
+    def cell_ids(self, key):
+        """Returns the cell ids in the set and in all its descendants.
+
+        The array is shared between callers, so it must not be modified.
+        """
+        return self._cell_ids[key]
+
+    def own_cell_ids(self, key):
+        """Returns the cell ids listed in the set itself, without its descendants.
+
+        Sets without children return the same array as `cell_ids`. Cell classes
+        (e.g. `louvain`) list no cell ids of their own.
+        """
+        if not self._children[key]:
+            return self._cell_ids[key]
+
+        return _as_cell_ids(self._nodes[key].get("cellIds", []))
+
+    def union(self, keys):
+        return union(*[self._cell_ids[key] for key in keys])
+
+    def all_cell_ids(self):
+        return self.union(self.roots)
+
+
+def as_cell_set_index(cell_sets):
+    """Returns `cell_sets` if it is already indexed, otherwise indexes it."""
+    if isinstance(cell_sets, CellSetIndex):
+        return cell_sets
+
+    return CellSetIndex(cell_sets)
@@ -0,0 +1,114 @@
+import threading
+from logging import info
+
+import boto3
+from botocore.config import Config as BotoConfig
+from socket_io_emitter import Emitter
+
+from ..config import config
+from . import metrics
+from .r_worker_client import RWorkerClient
+
+
+def _connections_created(pool_manager):
+    # urllib3 pools count every connection they open, keep-alive
+    # connections that get reused are not counted again
+    return sum(
+        pool_manager.pools[key].num_connections for key in pool_manager.pools.keys()
+    )
+
+
+class ClientRegistry:
+    """Long-lived AWS and Redis clients shared by the whole worker.
+
+    Clients are created the first time they are used and then reused by every
+    task, so the cost of creating them and of setting up their connections is
+    paid once per worker instead of several times per task.
+    """
+
+    def __init__(self):
+        # Reentrant, the emitter is created while holding it to get redis
+        self._lock = threading.RLock()
+        self._clients = {}
+        self._queue_urls = {}
+
+    def _get(self, name, create):
+        with self._lock:
+            if name not in self._clients:
+                info(f"Creating {name} client...")
+                self._clients[name] = create()
+                metrics.increment(f"clients.created.{name}")
+
+            return self._clients[name]
+
+    def _boto_config(self):
+        # Enough connections for every task thread and the publisher
+        # to use the same client at the same time
+        return BotoConfig(
+            max_pool_connections=max(10, 2 * config.MAX_CONCURRENT_TASKS)
+        )
+
+    @property
+    def s3(self):
+        return self._get(
+            "s3",
+            lambda: boto3.client(
+                "s3", config=self._boto_config(), **config.BOTO_RESOURCE_KWARGS
+            ),
+        )
+
+    @property
+    def sqs(self):
+        return self._get(
+            "sqs",
+            lambda: boto3.client(
+                "sqs", config=self._boto_config(), **config.BOTO_RESOURCE_KWARGS
+            ),
+        )
+
+    @property
+    def redis(self):
+        return self._get("redis", lambda: config.REDIS_CLIENT)
+
+    @property
+    def emitter(self):
+        return self._get("emitter", lambda: Emitter({"client": self.redis}))
+
+    @property
+    def r_worker(self):
+        return self._get("r_worker", RWorkerClient)
+
+    def queue_url(self, queue_name):
+        """Returns the URL of the queue, only asking SQS the first time.
+
+        Raises the ClientError from SQS if the queue does not exist yet, in which
+        case nothing is cached and the next call asks again.
+        """
+        if queue_name not in self._queue_urls:
+            response = self.sqs.get_queue_url(QueueName=queue_name)
+            self._queue_urls[queue_name] = response["QueueUrl"]
+
+        return self._queue_urls[queue_name]
+
+    def connections_created(self):
+        connections = {}
+
+        for name in ("s3", "sqs"):
+            client = self._clients.get(name)
+
+            try:
+                http_session = client._endpoint.http_session
+                connections[name] = _connections_created(http_session._manager)
+            except AttributeError:
+                # Client not created yet, or stubbed
+                continue
+
+        return connections
+
+    def reset(self):
+        with self._lock:
+            self._clients = {}
+            self._queue_urls = {}
+
+
+clients = ClientRegistry()
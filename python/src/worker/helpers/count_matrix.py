@@ -1,29 +1,54 @@
 import datetime
-import backoff
 import requests
 import os
+import threading
+import time
+import traceback
 from datetime import timezone
-from logging import error, info
+from logging import error, info, warning
 
-import aws_xray_sdk as xray
-import boto3
 from aws_xray_sdk.core import xray_recorder
-from socket_io_emitter import Emitter
+from redis.exceptions import RedisError
 
 from worker.helpers.send_status_updates import send_status_update
 from worker_status_codes import DOWNLOAD_EXPERIMENT, LOAD_EXPERIMENT
 
 from ..config import config
+from . import metrics
+from .clients import clients
+from .matrix_cache import fetch_matrix
+from .redis_lock import RedisLock
+from .tracing import background_segment
 
 
 class CountMatrix:
+    """Keeps the count matrices of the experiment in `config.LOCAL_DIR` up to date.
+
+    Matrices are synced with S3 in the background (see `watch`), so tasks only
+    check whether they are `stale` before running. Syncs that update them end
+    once the R worker serves the updated ones. Tasks only wait for that if the
+    R worker serves no matrices yet, otherwise the previous ones answer them
+    while the updated ones are loaded.
+    """
+
     def __init__(self):
         self.config = config
         self.local_path = os.path.join(self.config.LOCAL_DIR, self.config.EXPERIMENT_ID)
-        self.s3 = boto3.client("s3", **self.config.BOTO_RESOURCE_KWARGS)
+        self.s3 = clients.s3
 
         self.last_fetch = None
 
+        self._sync_lock = threading.Lock()
+
+        # Set until the matrices are synced, while updated ones are downloaded
+        # (and loaded by the R worker, if it serves none yet), and whenever a
+        # change is notified
+        self.stale = threading.Event()
+        self.stale.set()
+
+        self._watcher = None
+        self._stopped = threading.Event()
+
     def get_objects(self):
         objects = self.s3.list_objects_v2(
             Bucket=self.config.SOURCE_BUCKET, Prefix=self.config.EXPERIMENT_ID
@@ -71,44 +96,109 @@ class CountMatrix:
                 f" is more recent than {self.last_fetch or 'Never'}"
             )
 
-        # Disabled X-Ray to fix a botocore bug where the context
-        # does not propagate to S3 requests. see:
-        # https://github.com/open-telemetry/opentelemetry-python-contrib/issues/298
-        was_enabled = xray.global_sdk_config.sdk_enabled()
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(False)
+        # Tasks wait for the R worker to load it
+        self.stale.set()
 
-        io = Emitter({"client": config.REDIS_CLIENT})
-        with open(path, "wb+") as f:
-            send_status_update(io, self.config.EXPERIMENT_ID, DOWNLOAD_EXPERIMENT)
-            info(f"Downloading {key} from S3...")
-            self.s3.download_fileobj(
-                Bucket=self.config.SOURCE_BUCKET,
-                Key=key,
-                Fileobj=f,
-            )
+        io = clients.emitter
+        send_status_update(io, self.config.EXPERIMENT_ID, DOWNLOAD_EXPERIMENT)
 
-            send_status_update(io, self.config.EXPERIMENT_ID, LOAD_EXPERIMENT)
+        if self.config.SHARED_MATRIX_DIR:
+            self.download_shared_object(key, last_modified, path)
+        else:
+            info(f"Downloading {key} from S3...")
+            fetch_matrix(self.s3, self.config.SOURCE_BUCKET, key, path)
 
-            self.last_fetch = last_modified
-            f.seek(0)
+        send_status_update(io, self.config.EXPERIMENT_ID, LOAD_EXPERIMENT)
 
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(True)
+        self.last_fetch = last_modified
 
         return True
 
-    @backoff.on_exception(
-        backoff.constant, requests.exceptions.RequestException, interval=5
-    )
-    def check_if_received(self):
-        info("Count matrices updated, checking if R worker is alive...")
-        r = requests.get(
-            f"{config.R_WORKER_URL}/health",
+    def download_shared_object(self, key, last_modified, path):
+        """Links `path` to the copy of `key` in the directory shared by the workers
+        of the experiment, downloading it first if it is older than `last_modified`.
+
+        Only one worker downloads it at a time, the others wait for it and reuse
+        the downloaded copy.
+        """
+        shared_path = os.path.join(self.config.SHARED_MATRIX_DIR, key)
+        os.makedirs(os.path.dirname(shared_path), exist_ok=True)
+
+        with RedisLock(f"worker-matrix:{key}", self.config.MUTATING_LOCK_TTL):
+            try:
+                shared_last_modified = datetime.datetime.fromtimestamp(
+                    os.path.getmtime(shared_path), tz=timezone.utc
+                )
+            except FileNotFoundError:
+                shared_last_modified = None
+
+            if shared_last_modified and last_modified < shared_last_modified:
+                info(f"Reusing {key} downloaded by another worker")
+            else:
+                info(f"Downloading {key} from S3 to {shared_path}...")
+                fetch_matrix(self.s3, self.config.SOURCE_BUCKET, key, shared_path)
+
+        if os.path.islink(path) and os.readlink(path) == shared_path:
+            return
+
+        link_path = f"{path}.link"
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+
+        os.symlink(shared_path, link_path)
+        os.replace(link_path, path)
+
+    def _get_r_worker_status(self):
+        try:
+            response = requests.get(f"{config.R_WORKER_URL}/ready", timeout=5)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            # Not started yet, or switching over to a new object
+            return None
+
+    def wait_for_r_worker(self):
+        """Waits until the R worker serves the `r.rds` matrix that is on disk.
+
+        Polls `/ready` every `config.R_WORKER_READY_POLL_INTERVAL` seconds, for
+        up to `config.R_WORKER_READY_TIMEOUT` seconds, until it reports that the
+        object it loaded has the modification time of the file.
+        """
+        try:
+            last_modified = os.path.getmtime(os.path.join(self.local_path, "r.rds"))
+        except FileNotFoundError:
+            return
+
+        info("Count matrices updated, waiting for the R worker to load them...")
+        start = time.time()
+
+        while True:
+            status = self._get_r_worker_status()
+
+            # Allow for the precision the R worker reports the time with
+            if status and float(status["lastModified"]) >= last_modified - 0.001:
+                break
+
+            if time.time() - start >= self.config.R_WORKER_READY_TIMEOUT:
+                warning("The R worker did not load the updated matrices in time")
+                return
+
+            time.sleep(self.config.R_WORKER_READY_POLL_INTERVAL)
+
+        waited = time.time() - start
+        metrics.observe("count_matrix.r_worker_wait_seconds", waited)
+        metrics.observe("count_matrix.r_worker_load_seconds", status["loadSeconds"])
+        info(
+            f"R worker loaded the matrices in {status['loadSeconds']:.1f}s, "
+            f"ready {waited:.1f}s after they were downloaded"
         )
 
     @xray_recorder.capture("CountMatrix.sync")
     def sync(self):
+        with self._sync_lock:
+            self._sync()
+
+    def _sync(self):
         # check if path existed before running this
         self.path_exists = os.path.exists(self.local_path)
 
@@ -124,5 +214,112 @@ class CountMatrix:
             for key, last_modified in objects.items()
         }
 
-        if True in synced.values():
-            self.check_if_received()
+        updated = True in synced.values()
+
+        # The R worker keeps serving the previous matrices while it loads the
+        # updated ones, tasks only wait for it if there are none
+        serving = updated and self._get_r_worker_status() is not None
+        if updated and not serving:
+            self.wait_for_r_worker()
+
+        # Still stale if the pipeline did not upload them yet
+        if objects:
+            self.stale.clear()
+
+        # Later syncs wait for the updated matrices to be loaded
+        if serving:
+            self.wait_for_r_worker()
+
+    def ensure_synced(self):
+        """Syncs before a task only if the matrices are stale.
+
+        Otherwise returns right away, S3 is not listed in the path of requests.
+        """
+        if not self.stale.is_set():
+            return
+
+        with self._sync_lock:
+            # Synced by the watcher while waiting for it
+            if self.stale.is_set():
+                self._sync()
+
+    def watch(self):
+        """Syncs in the background until `stop` is called.
+
+        Syncs every `config.MATRIX_SYNC_INTERVAL` seconds and, with
+        `config.MATRIX_SYNC_NOTIFICATIONS`, as soon as a message is published to
+        the `worker-matrix-updated:<experiment id>` Redis channel, e.g. by the
+        pipeline once it uploads new matrices. Tasks that start before a
+        notified change is synced wait for it.
+        """
+        with self._sync_lock:
+            if self._watcher is not None:
+                return
+
+            self._stopped.clear()
+            self._watcher = threading.Thread(
+                target=self._watch, name="matrix-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def stop(self):
+        watcher, self._watcher = self._watcher, None
+        if watcher is None:
+            return
+
+        self._stopped.set()
+        watcher.join()
+
+    def _subscribe(self):
+        if not self.config.MATRIX_SYNC_NOTIFICATIONS:
+            return None
+
+        try:
+            pubsub = clients.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(f"worker-matrix-updated:{self.config.EXPERIMENT_ID}")
+            return pubsub
+        except RedisError as e:
+            warning(f"Could not subscribe to matrix updates, polling S3 only: {e}")
+            return None
+
+    def _wait_for_change(self, pubsub, timeout):
+        """Returns whether a change was notified within `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+
+        while not self._stopped.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if pubsub is None:
+                self._stopped.wait(remaining)
+            elif pubsub.get_message(timeout=min(remaining, 1)):
+                return True
+
+        return False
+
+    def _watch(self):
+        # Syncs outside of requests are not traced
+        with background_segment("worker-matrix-watcher"):
+            self._watch_updates()
+
+    def _watch_updates(self):
+        pubsub = None
+
+        while not self._stopped.is_set():
+            try:
+                if pubsub is None:
+                    pubsub = self._subscribe()
+
+                if self._wait_for_change(pubsub, self.config.MATRIX_SYNC_INTERVAL):
+                    info("Count matrices were updated, syncing...")
+                    self.stale.set()
+
+                if not self._stopped.is_set():
+                    self.sync()
+            except RedisError as e:
+                warning(f"Lost the subscription to matrix updates: {e}")
+                pubsub = None
+            except Exception:
+                error(f"Exception while syncing matrices:\n{traceback.format_exc()}")
+                self._stopped.wait(5)
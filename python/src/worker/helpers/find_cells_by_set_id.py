@@ -1,12 +1,15 @@
+from .cell_set_index import as_cell_set_index, empty
+
+
 def find_cells_by_set_id(needle, haystack):
-    for cell_set in haystack:
-        if cell_set["key"] == needle:
-            return cell_set["cellIds"]
+    """Returns the cell ids listed in the set with the key `needle`.
 
-        if cell_set.get("children", None):
-            result = find_cells_by_set_id(needle, cell_set["children"])
+    The cells of its children are not included, so cell classes (e.g. `louvain`)
+    have no cells, and sets that are not found have none either.
+    """
+    cell_set_index = as_cell_set_index(haystack)
 
-            if result:
-                return result
+    if needle not in cell_set_index:
+        return empty()
 
-    return []
+    return cell_set_index.own_cell_ids(needle)
@@ -1,114 +1,283 @@
-from functools import reduce
-import math
-import random
+import threading
+from collections import OrderedDict
 
-from .cell_sets_dict import get_cell_sets_dict
+import numpy as np
 
-def get_cell_class_ids(key, cell_sets):
-  children = next(cell_class for cell_class in cell_sets if cell_class["key"] == key)["children"]
-  cell_ids = map(lambda cell_set: cell_set["cellIds"], children)
+from ..config import config
+from . import metrics
+from .cell_set_index import as_cell_set_index, difference, intersection
 
-  cell_ids_set = set()
-  for i in cell_ids:
-    cell_ids_set.update(i)
+# Seed of the generator used to downsample, so the same
+# settings and cell sets always give the same cell order
+DEFAULT_SEED = 0
 
-  return cell_ids_set
+# There is no max_cells being sent right now, but this allows
+# us to control this number in the future if we want to
+DEFAULT_MAX_CELLS = 1000
 
-def get_heatmap_cell_order(selected_cell_set, grouped_tracks, selected_points, hidden_cell_set_keys, max_cells, cell_sets):
-  cell_sets_by_key = get_cell_sets_dict(cell_sets)
+# Cell orders by experiment, cell sets version and downsample settings,
+# the least recently used ones are dropped first
+_cell_order_cache = OrderedDict()
+_cell_order_cache_lock = threading.Lock()
 
-  filtered_cell_ids = get_cell_class_ids('louvain', cell_sets)
 
-  def get_cells(key, is_root_node=False):
-    unfiltered_cell_ids = None
+# Combines the labels of the previous tracks with the labels of a new track.
+# Sorting by the result sorts by the label of the first track, then by the second
+# one, etc.
+def combine_labels(labels, new_labels, amount_of_labels):
+    # Renumber the labels of the previous tracks if many tracks would overflow them
+    max_label = np.iinfo(np.int64).max // amount_of_labels - 1
+    if len(labels) > 0 and labels.max() > max_label:
+        labels = np.unique(labels, return_inverse=True)[1].reshape(-1)
 
-    if (is_root_node): 
-      unfiltered_cell_ids = get_cell_class_ids(key, cell_sets)
-    else: 
-      unfiltered_cell_ids = cell_sets_by_key[key]["cellIds"]
+    return labels * amount_of_labels + new_labels
 
-    return filtered_cell_ids.intersection(set(unfiltered_cell_ids))
 
-  def get_all_enabled_cell_ids():
-    cell_ids = get_cells(selected_cell_set, is_root_node=True)
+# Stable argsort of non negative integers, numpy radix sorts them if they fit in
+# 16 bits
+def stable_argsort(values):
+    if len(values) > 0 and values.max() < 2 ** 16:
+        values = values.astype(np.uint16)
 
-    if (selected_points != "All"):
-      cell_set_key = selected_points.split('/')[1]
-      cell_ids = cell_ids.intersection(get_cells(cell_set_key))
-      
-    for hidden_cell_set in hidden_cell_set_keys:
-      cell_ids = cell_ids.difference(get_cells(hidden_cell_set))
+    return np.argsort(values, kind='stable')
 
-    return cell_ids
 
-  # Returns a list of sets, one for each cell set in the cell_class 
-  # each of them is an intersection of each cell set with cell_ids
-  def get_intersections(cell_ids, cell_class):
-    children = next(curr_class for curr_class in cell_sets if curr_class["key"] == cell_class)["children"]
-    cell_ids_by_set = map(lambda cell_set: cell_set["cellIds"], children)
+# Labels cells when every cell is in at most one cell set of the class (e.g. louvain
+# or samples), returns None if some cell is in several cell sets.
+# Labels are looked up in an array over the cell id space
+def label_by_partition(cell_ids, children_cell_ids, leftover_label):
+    cell_id_space = int(cell_ids[-1]) + 1
 
-    intersections = []
-    for current_set_ids in cell_ids_by_set:
+    label_by_cell_id = np.full(cell_id_space, leftover_label, dtype=np.int64)
+    times_labelled = np.zeros(cell_id_space, dtype=np.int32)
 
-      current_intersection = set(current_set_ids).intersection(cell_ids)
-      
-      if (len(current_intersection) > 0):
-        intersections.append(current_intersection)
+    for label, child_cell_ids in enumerate(children_cell_ids):
+        in_space = np.searchsorted(child_cell_ids, cell_id_space)
+        child_cell_ids = child_cell_ids[:in_space]
 
-    return intersections
+        label_by_cell_id[child_cell_ids] = label
+        times_labelled[child_cell_ids] += 1
 
-  def cartesian_product_intersection(buckets, cell_class):
-    new_buckets = []
+    if np.any(times_labelled[cell_ids] > 1):
+        return None
 
-    for bucket in buckets:
-      intersections = get_intersections(bucket, cell_class)
+    return label_by_cell_id[cell_ids]
 
-      # The cells that werent part of any intersection are also added at the end
-      leftover_cells = reduce(lambda acum, current: acum.difference(current), intersections, bucket)
-      intersections.append(leftover_cells)
-      
-      for intersection in intersections:
-        new_buckets.append(intersection)
 
-    return new_buckets
+# Assigns every cell the label of each cell set of cell_class that contains it.
+# Labels are the position of the cell set in the class, cells that are in no cell
+# set get the label after the last one. Cells in several cell sets of the class are
+# repeated, once per cell set. cell_ids must be sorted. Returns the (possibly
+# repeated) cells and their labels
+def label_by_cell_class(cell_set_index, cell_ids, labels, cell_class):
+    children = cell_set_index.children(cell_class)
+    leftover_label = len(children)
 
-  def split_by_cartesian_intersections(enabled_cell_ids):
-    buckets = None
-    size = None
+    children_cell_ids = [cell_set_index.cell_ids(key) for key in children]
 
-    buckets = [enabled_cell_ids]
+    new_labels = label_by_partition(cell_ids, children_cell_ids, leftover_label)
+    if new_labels is not None:
+        return cell_ids, combine_labels(labels, new_labels, leftover_label + 1)
 
-    for cell_class_key in grouped_tracks:
-      buckets = cartesian_product_intersection(buckets, cell_class_key)
+    track_cell_ids = np.concatenate(
+        [np.empty(0, dtype=cell_ids.dtype)] + children_cell_ids
+    )
+    track_labels = np.repeat(
+        np.arange(len(children)),
+        [len(child_cell_ids) for child_cell_ids in children_cell_ids],
+    )
 
-    # We need to calculate size at the end because we may have repeated cells
-    # (due to group bys having the same cell in different groups)
-    size = reduce(lambda acum, bucket: acum + len(bucket), buckets, 0)
+    # Sort by cell id, so the labels of each cell are contiguous. The sort is stable
+    # and each cell set is already sorted, so the labels stay in cell set order
+    order = np.argsort(track_cell_ids, kind='stable')
+    track_cell_ids = track_cell_ids[order]
+    track_labels = track_labels[order]
 
-    return buckets, size
-  
-  def downsample(buckets, amount_of_cells):
-    downsampled_cell_ids = []
+    start = np.searchsorted(track_cell_ids, cell_ids, side='left')
+    end = np.searchsorted(track_cell_ids, cell_ids, side='right')
+    counts = end - start
+    repeats = np.maximum(counts, 1)
 
-    # If we collected less than max_cells, then no need to downsample
-    final_sample_size = min(amount_of_cells, max_cells)
+    # Position of each repeated cell among the repeats of the same cell
+    repeats_starts = np.cumsum(repeats) - repeats
+    offsets = np.arange(repeats.sum()) - np.repeat(repeats_starts, repeats)
+    positions = np.repeat(start, repeats) + offsets
 
-    for bucket in buckets:
-      sample_size = math.floor((len(bucket) / amount_of_cells) * final_sample_size)
+    new_labels = np.full(len(positions), leftover_label)
+    in_cell_set = np.repeat(counts, repeats) > 0
+    new_labels[in_cell_set] = track_labels[positions[in_cell_set]]
 
-      # Pick sample_size elements randomly
-      sample = random.sample(list(bucket), sample_size)
+    # Repeated cells stay next to each other, so cell_ids[rows] is still sorted
+    rows = np.repeat(np.arange(len(cell_ids)), repeats)
 
-      downsampled_cell_ids.extend(sample)
+    labels = combine_labels(labels[rows], new_labels, leftover_label + 1)
 
-    return downsampled_cell_ids
-  
-  
-  enabled_cell_ids = get_all_enabled_cell_ids()
-  
-  if (len(grouped_tracks) == 0 or len(enabled_cell_ids) == 0): 
-    return []
+    return cell_ids[rows], labels
 
-  buckets, size = split_by_cartesian_intersections(enabled_cell_ids)
 
-  return downsample(buckets, size)
+def get_heatmap_cell_order(
+    selected_cell_set,
+    grouped_tracks,
+    selected_points,
+    hidden_cell_set_keys,
+    max_cells,
+    cell_sets,
+    seed=DEFAULT_SEED,
+):
+    cell_set_index = as_cell_set_index(cell_sets)
+
+    filtered_cell_ids = cell_set_index.cell_ids('louvain')
+
+    def get_cells(key):
+        return intersection(filtered_cell_ids, cell_set_index.cell_ids(key))
+
+    def get_all_enabled_cell_ids():
+        cell_ids = get_cells(selected_cell_set)
+
+        if (selected_points != "All"):
+            cell_set_key = selected_points.split('/')[1]
+            cell_ids = intersection(cell_ids, get_cells(cell_set_key))
+
+        # cell_ids are already filtered, so hidden sets don't need to be
+        hidden_cell_ids = [
+            cell_set_index.cell_ids(hidden_cell_set)
+            for hidden_cell_set in hidden_cell_set_keys
+        ]
+
+        return difference(cell_ids, *hidden_cell_ids)
+
+    # Splits the cells into buckets, one for each combination of cell sets of the
+    # grouped tracks. Returns the cells sorted by bucket and the bucket of each cell.
+    # Buckets follow the order of the tracks and of the cell sets in each track
+    def split_by_grouped_tracks(enabled_cell_ids):
+        cell_ids = enabled_cell_ids
+        labels = np.zeros(len(cell_ids), dtype=np.int64)
+
+        for cell_class_key in grouped_tracks:
+            cell_ids, labels = label_by_cell_class(
+                cell_set_index, cell_ids, labels, cell_class_key
+            )
+
+        order = stable_argsort(labels)
+        cell_ids = cell_ids[order]
+        labels = labels[order]
+
+        is_new_bucket = np.ones(len(labels), dtype=bool)
+        is_new_bucket[1:] = labels[1:] != labels[:-1]
+
+        buckets = np.cumsum(is_new_bucket) - 1
+
+        return cell_ids, buckets
+
+    # Samples each bucket proportionally to its size, the cells of each bucket are
+    # shuffled
+    def downsample(cell_ids, buckets):
+        # Size is calculated after splitting because we may have repeated cells
+        # (due to group bys having the same cell in different groups)
+        amount_of_cells = len(cell_ids)
+
+        # If we collected less than max_cells, then no need to downsample
+        final_sample_size = min(amount_of_cells, max_cells)
+
+        bucket_sizes = np.bincount(buckets)
+        sample_sizes = np.floor(
+            (bucket_sizes / amount_of_cells) * final_sample_size
+        ).astype(int)
+
+        # Shuffle within each bucket and keep the first sample_size cells of each one
+        shuffled = np.random.default_rng(seed).permutation(amount_of_cells)
+        order = shuffled[stable_argsort(buckets[shuffled])]
+
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+        rank_in_bucket = np.arange(amount_of_cells) - bucket_starts[buckets[order]]
+
+        sample = order[rank_in_bucket < sample_sizes[buckets[order]]]
+
+        return cell_ids[sample].tolist()
+
+    enabled_cell_ids = get_all_enabled_cell_ids()
+
+    if (len(grouped_tracks) == 0 or len(enabled_cell_ids) == 0):
+        return []
+
+    cell_ids, buckets = split_by_grouped_tracks(enabled_cell_ids)
+
+    return downsample(cell_ids, buckets)
+
+
+# Hidden cell sets are a set in the UI, so their order doesn't change the cell order
+def _cell_order_key(experiment_id, version, downsample_settings):
+    return (
+        experiment_id,
+        version,
+        downsample_settings["selectedCellSet"],
+        tuple(downsample_settings["groupedTracks"]),
+        downsample_settings["selectedPoints"],
+        tuple(sorted(downsample_settings["hiddenCellSets"])),
+        downsample_settings.get("maxCells", DEFAULT_MAX_CELLS),
+    )
+
+
+def _cache_cell_order(key, cell_order):
+    experiment_id, version = key[:2]
+
+    with _cell_order_cache_lock:
+        # The cell sets changed, orders of the previous versions are never used again
+        stale_keys = [
+            cached_key for cached_key in _cell_order_cache
+            if cached_key[0] == experiment_id and cached_key[1] != version
+        ]
+        for stale_key in stale_keys:
+            del _cell_order_cache[stale_key]
+
+        _cell_order_cache[key] = cell_order
+        _cell_order_cache.move_to_end(key)
+
+        while len(_cell_order_cache) > config.CELL_ORDER_CACHE_SIZE:
+            _cell_order_cache.popitem(last=False)
+
+
+def get_cached_heatmap_cell_order(experiment_id, cell_set_index, downsample_settings):
+    """Returns the heatmap cell order for the downsample settings of a request.
+
+    Orders are cached per worker along with the version of the cell sets they were
+    computed from, so repeated requests with the same settings (e.g. genes added to
+    an open heatmap) skip the ordering as long as the cell sets don't change.
+    """
+    # Cell sets without a version can't be told apart when they change
+    if not cell_set_index.version:
+        return _get_heatmap_cell_order(cell_set_index, downsample_settings)
+
+    key = _cell_order_key(experiment_id, cell_set_index.version, downsample_settings)
+
+    with _cell_order_cache_lock:
+        cell_order = _cell_order_cache.get(key)
+        if cell_order is not None:
+            _cell_order_cache.move_to_end(key)
+
+    if cell_order is not None:
+        metrics.increment("heatmap_cell_order.cache.hit")
+        return list(cell_order)
+
+    metrics.increment("heatmap_cell_order.cache.miss")
+
+    cell_order = _get_heatmap_cell_order(cell_set_index, downsample_settings)
+    _cache_cell_order(key, tuple(cell_order))
+
+    return cell_order
+
+
+def _get_heatmap_cell_order(cell_set_index, downsample_settings):
+    return get_heatmap_cell_order(
+        downsample_settings["selectedCellSet"],
+        downsample_settings["groupedTracks"],
+        downsample_settings["selectedPoints"],
+        downsample_settings["hiddenCellSets"],
+        downsample_settings.get("maxCells", DEFAULT_MAX_CELLS),
+        cell_set_index,
+    )
+
+
+def clear_cell_order_cache():
+    with _cell_order_cache_lock:
+        _cell_order_cache.clear()
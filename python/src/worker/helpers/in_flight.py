@@ -0,0 +1,90 @@
+import threading
+from logging import info, warning
+
+from redis.exceptions import RedisError
+
+from ..config import config
+from . import metrics
+from .redis_lock import RedisLock
+
+# ETags of the requests being run or published by this worker, with the number
+# of duplicates of them that arrived in the meantime and their Redis lock
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def _acquire_lock(etag):
+    """Returns the Redis lock of the ETag, False if another worker holds it."""
+    if not config.IN_FLIGHT_LOCKS_ENABLED:
+        return None
+
+    lock = RedisLock(f"worker-in-flight:{etag}", config.IN_FLIGHT_LOCK_TTL)
+
+    try:
+        return lock if lock.acquire(blocking=False) else False
+    except RedisError as e:
+        warning(f"Could not lock request {etag} in Redis, running it anyway: {e}")
+        return None
+
+
+def _release_lock(etag, lock):
+    if lock is None:
+        return
+
+    try:
+        lock.release()
+    except RedisError as e:
+        warning(f"Could not unlock request {etag} in Redis: {e}")
+
+
+def start_request(etag):
+    """Registers a request as in flight.
+
+    Returns False if a request with the same ETag is already being run, by this
+    worker or, if `config.IN_FLIGHT_LOCKS_ENABLED`, by another one holding the
+    Redis lock of the ETag. The duplicate then does not need to run: clients
+    that sent it wait on `WorkResponse-<ETag>` too, so they get the notification
+    of the request that is running.
+    """
+    with _lock:
+        if etag in _in_flight:
+            _in_flight[etag][0] += 1
+            metrics.increment("in_flight.coalesced")
+            return False
+
+        # Duplicates arriving while the Redis lock is acquired are coalesced
+        _in_flight[etag] = [0, None]
+
+    # Redis is not called while holding the lock, other requests don't wait on it
+    lock = _acquire_lock(etag)
+
+    with _lock:
+        if lock is False:
+            _in_flight.pop(etag, None)
+        elif etag in _in_flight:
+            _in_flight[etag][1] = lock
+
+    if lock is False:
+        metrics.increment("in_flight.locked")
+        return False
+
+    return True
+
+
+def finish_request(etag):
+    """Unregisters a request once its result was published."""
+    with _lock:
+        if etag not in _in_flight:
+            return
+
+        duplicates, lock = _in_flight.pop(etag)
+
+    _release_lock(etag, lock)
+
+    if duplicates:
+        info(f"Result of {etag} was also sent for {duplicates} duplicate requests")
+
+
+def clear_in_flight():
+    with _lock:
+        _in_flight.clear()
@@ -0,0 +1,176 @@
+import errno
+import fcntl
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from logging import info, warning
+
+from ..config import config
+from . import metrics
+from .matrix_download import TEMP_SUFFIX, download_matrix
+
+
+@contextmanager
+def _flock(path, blocking=True):
+    """Holds an exclusive lock on `path`, shared by the pods of the node.
+
+    Yields whether the lock was acquired, always True if `blocking`.
+    """
+    operation = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, operation)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _paths(etag):
+    objects_dir = os.path.join(config.MATRIX_CACHE_DIR, "objects")
+    locks_dir = os.path.join(config.MATRIX_CACHE_DIR, "locks")
+
+    os.makedirs(objects_dir, exist_ok=True)
+    os.makedirs(locks_dir, exist_ok=True)
+
+    return os.path.join(objects_dir, etag), os.path.join(locks_dir, f"{etag}.lock")
+
+
+def _copy(source, path):
+    """Copies `source` to `path`, sharing its blocks if the filesystem can."""
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), suffix=TEMP_SUFFIX, delete=False
+    ) as f:
+        try:
+            with open(source, "rb") as src:
+                try:
+                    # Clones the file on filesystems with reflinks (e.g. XFS, btrfs)
+                    size = os.fstat(src.fileno()).st_size
+                    while size > 0:
+                        copied = os.copy_file_range(src.fileno(), f.fileno(), size)
+                        if copied == 0:
+                            break
+                        size -= copied
+                except (AttributeError, OSError):
+                    src.seek(0)
+                    f.seek(0)
+                    f.truncate()
+                    shutil.copyfileobj(src, f)
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+def _link(source, path):
+    """Replaces `path` with a hard link to `source`.
+
+    `source` is copied instead if it can't be linked, e.g. if it is in a
+    different mount.
+    """
+    link_path = f"{path}.link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+
+    try:
+        os.link(source, link_path)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+
+        _copy(source, path)
+        return
+
+    os.replace(link_path, path)
+
+
+def _evict(keep):
+    """Deletes the least recently used objects until the cache fits in its budget.
+
+    Objects being downloaded or linked by other workers are kept, as well as
+    `keep`. Workers that linked an object keep their link once it is deleted.
+    """
+    objects_dir = os.path.join(config.MATRIX_CACHE_DIR, "objects")
+
+    with _flock(os.path.join(config.MATRIX_CACHE_DIR, "eviction.lock")):
+        entries = []
+        for name in os.listdir(objects_dir):
+            if name.endswith(TEMP_SUFFIX) or name == keep:
+                continue
+
+            object_path, lock_path = _paths(name)
+            try:
+                size = os.path.getsize(object_path)
+            except FileNotFoundError:
+                continue
+
+            try:
+                last_used = os.path.getmtime(lock_path)
+            except FileNotFoundError:
+                last_used = 0
+
+            entries.append((last_used, size, name))
+
+        total = sum(size for _, size, _ in entries)
+        total += os.path.getsize(os.path.join(objects_dir, keep))
+
+        for _, size, name in sorted(entries):
+            if total <= config.MATRIX_CACHE_BYTES:
+                break
+
+            object_path, lock_path = _paths(name)
+            with _flock(lock_path, blocking=False) as acquired:
+                if not acquired:
+                    continue
+
+                os.remove(object_path)
+
+            total -= size
+            metrics.increment("matrix_cache.evicted")
+            info(f"Evicted {name} from the matrix cache")
+
+
+def fetch_matrix(s3, bucket, key, path):
+    """Downloads an object to `path`, through the node cache if it is enabled.
+
+    With `config.MATRIX_CACHE_DIR`, objects are kept in that directory by their
+    ETag, so pods of the node that need the same object again (e.g. after
+    scaling from zero) link it instead of downloading it. The least recently
+    used objects are deleted once the cache takes more than
+    `config.MATRIX_CACHE_BYTES`. Pods of the same node take file locks on the
+    objects, so each is downloaded once.
+    """
+    if not config.MATRIX_CACHE_DIR:
+        download_matrix(s3, bucket, key, path)
+        return
+
+    head = s3.head_object(Bucket=bucket, Key=key)
+    etag = head["ETag"].strip('"')
+    object_path, lock_path = _paths(etag)
+
+    with _flock(lock_path):
+        if os.path.exists(object_path):
+            info(f"Found {key} in the matrix cache")
+            metrics.increment("matrix_cache.hit")
+        else:
+            metrics.increment("matrix_cache.miss")
+            download_matrix(s3, bucket, key, object_path, head=head)
+
+            try:
+                _evict(keep=etag)
+            except OSError as e:
+                warning(f"Could not evict objects from the matrix cache: {e}")
+
+        # Marks the object as recently used. The object itself is not touched, its
+        # modification time is the one of the matrix that the R worker watches.
+        os.utime(lock_path)
+
+        _link(object_path, path)
@@ -0,0 +1,182 @@
+import hashlib
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import info, warning
+
+import backoff
+from botocore.exceptions import BotoCoreError, IncompleteReadError
+from urllib3.exceptions import HTTPError
+
+from ..config import config
+from . import metrics
+from .tracing import in_current_entity
+
+# Size of the reads from the body of each ranged request
+CHUNK_SIZE = 1024 * 1024
+
+# Suffix of the files being downloaded
+TEMP_SUFFIX = ".download"
+
+
+def _uploaded_part_size(s3, bucket, key, head):
+    """Returns the size of the parts the object was uploaded in.
+
+    Returns None if it was uploaded in a single request, or if its parts don't
+    all have the same size, so its ETag can't be computed from fixed ranges.
+    """
+    etag = head["ETag"].strip('"')
+    if "-" not in etag:
+        return None
+
+    first_part = s3.head_object(Bucket=bucket, Key=key, PartNumber=1)
+    part_size = first_part["ContentLength"]
+    parts_count = first_part.get("PartsCount", int(etag.split("-")[1]))
+
+    if math.ceil(head["ContentLength"] / part_size) != parts_count:
+        return None
+
+    return part_size
+
+
+def _is_verifiable(head):
+    # ETags of objects encrypted with KMS or customer keys are not MD5 digests
+    return (
+        head.get("ServerSideEncryption") != "aws:kms"
+        and "SSECustomerAlgorithm" not in head
+    )
+
+
+@backoff.on_exception(backoff.expo, (BotoCoreError, HTTPError), max_tries=3)
+def _download_range(s3, bucket, key, fd, start, end, hash_size):
+    """Writes bytes [start, end) of the object at the same offset of `fd`.
+
+    Returns the MD5 digests of each `hash_size` bytes of the range if set.
+    """
+    response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+    body = response["Body"]
+
+    digests = []
+    offset = start
+
+    while offset < end:
+        digest = hashlib.md5() if hash_size else None
+        digest_end = min(end, offset + hash_size) if hash_size else end
+
+        while offset < digest_end:
+            chunk = body.read(min(CHUNK_SIZE, digest_end - offset))
+            if not chunk:
+                raise IncompleteReadError(
+                    actual_bytes=offset - start, expected_bytes=end - start
+                )
+
+            os.pwrite(fd, chunk, offset)
+            if digest:
+                digest.update(chunk)
+
+            offset += len(chunk)
+
+        if digest:
+            digests.append(digest.digest())
+
+    return digests
+
+
+def _file_md5(f):
+    digest = hashlib.md5()
+
+    f.seek(0)
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def download_matrix(s3, bucket, key, path, head=None):
+    """Downloads an object to `path` with concurrent ranged requests.
+
+    Ranges of `config.MATRIX_DOWNLOAD_PART_SIZE` are downloaded by up to
+    `config.MATRIX_DOWNLOAD_CONCURRENCY` threads into a temporary file, which
+    replaces `path` once its MD5 matches the ETag of the object. Objects uploaded
+    in parts are hashed while they are downloaded, in ranges aligned to their
+    parts, the others once downloaded. `head` is the response to a HEAD request
+    of the object, if it was already made.
+    """
+    start_time = time.time()
+
+    if head is None:
+        head = s3.head_object(Bucket=bucket, Key=key)
+
+    size = head["ContentLength"]
+    etag = head["ETag"].strip('"')
+
+    verify = _is_verifiable(head)
+    uploaded_part_size = None
+    if verify:
+        uploaded_part_size = _uploaded_part_size(s3, bucket, key, head)
+
+    if verify and "-" in etag and uploaded_part_size is None:
+        warning(f"Parts of {key} have different sizes, it can't be verified")
+        verify = False
+
+    range_size = config.MATRIX_DOWNLOAD_PART_SIZE
+    if uploaded_part_size:
+        range_size = uploaded_part_size * max(1, range_size // uploaded_part_size)
+
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), suffix=TEMP_SUFFIX, delete=False
+    ) as f:
+        try:
+            f.truncate(size)
+
+            with ThreadPoolExecutor(
+                max_workers=config.MATRIX_DOWNLOAD_CONCURRENCY,
+                thread_name_prefix="matrix-download",
+            ) as pool:
+                futures = [
+                    pool.submit(
+                        in_current_entity(_download_range),
+                        s3,
+                        bucket,
+                        key,
+                        f.fileno(),
+                        start,
+                        min(start + range_size, size),
+                        uploaded_part_size,
+                    )
+                    for start in range(0, size, range_size)
+                ]
+
+                try:
+                    digests = [d for future in futures for d in future.result()]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            if not verify:
+                downloaded_etag = etag
+            elif uploaded_part_size:
+                downloaded_etag = hashlib.md5(b"".join(digests)).hexdigest()
+                downloaded_etag += f"-{len(digests)}"
+            else:
+                downloaded_etag = _file_md5(f)
+
+            if downloaded_etag != etag:
+                raise ValueError(
+                    f"Downloaded {key} has ETag {downloaded_etag}, expected {etag}"
+                )
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    # Readable by the R worker, as files written with open()
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+    elapsed = time.time() - start_time
+    metrics.observe("matrix_download.seconds", elapsed)
+    metrics.observe("matrix_download.bytes", size)
+    info(f"Downloaded {size} bytes of {key} in {elapsed:.1f}s")
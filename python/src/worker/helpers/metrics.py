@@ -0,0 +1,84 @@
+import math
+import threading
+from collections import defaultdict
+
+# In-process counters and histograms, logged by the worker when it shuts down.
+# All functions are safe to call from the task and publisher threads.
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_histograms = {}
+
+
+class Histogram:
+    """Keeps count, sum, min, max and power-of-two buckets of observed values."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.buckets = defaultdict(int)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        # Bucket k counts values in (2^(k-1), 2^k]
+        exponent = math.ceil(math.log2(value)) if value > 0 else None
+        self.buckets[exponent] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {
+                ("<=0" if k is None else f"<={2 ** k}"): v
+                for k, v in sorted(
+                    self.buckets.items(),
+                    key=lambda i: -math.inf if i[0] is None else i[0],
+                )
+            },
+        }
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, value):
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram()
+
+        _histograms[name].observe(value)
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def get_histogram(name):
+    with _lock:
+        histogram = _histograms.get(name)
+        return histogram.to_dict() if histogram else None
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {name: h.to_dict() for name, h in _histograms.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
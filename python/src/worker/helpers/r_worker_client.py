@@ -0,0 +1,192 @@
+import json
+import struct
+import time
+
+import backoff
+import numpy as np
+import requests
+import ujson
+from requests.adapters import HTTPAdapter
+
+from exceptions import raise_if_error
+
+from ..config import config
+from . import metrics
+from .raw_json import extract_data
+
+# (connect, read) timeouts in seconds for calls to the R worker. Tasks without
+# their own read timeout (e.g. ClusterCells, trajectories) can run for as long
+# as large experiments need
+DEFAULT_TIMEOUT = (5, None)
+
+ENDPOINT_TIMEOUTS = {
+    "getNUmis": (5, 2 * 60),
+    "getNGenes": (5, 2 * 60),
+    "getDoubletScore": (5, 2 * 60),
+    "getMitochondrialContent": (5, 2 * 60),
+    "listGenes": (5, 2 * 60),
+    # Whole-matrix exports can take as long as the longest worker timeout
+    "GetNormalizedExpression": (5, 40 * 60),
+    "DownloadAnnotSeuratObject": (5, 40 * 60),
+}
+
+
+# Requests with numeric arrays are sent as a JSON header followed by the arrays
+# as raw little-endian int32 or float64 vectors, see `decodeBinaryRequest` in the
+# R worker
+BINARY_CONTENT_TYPE = "application/vnd.cellenics.binary-vectors"
+
+# Binary types of the arrays by numpy dtype kind, with the type R reads them as
+BINARY_TYPES = {
+    "i": ("<i4", "integer"),
+    "u": ("<i4", "integer"),
+    "f": ("<f8", "double"),
+}
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "f":
+            # NaN is not valid JSON, R reads "NA" as a missing value
+            values = value.astype(object)
+            values[np.isnan(value)] = "NA"
+            return values.tolist()
+
+        return value.tolist()
+
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_request(request):
+    """Returns the body and content type of a request to the R worker.
+
+    Integer and float numpy arrays in the top level of the request (e.g. cell
+    ids, embeddings) are sent as binary int32 and float64 vectors instead of JSON
+    lists, unless binary requests are disabled with `R_WORKER_BINARY_REQUESTS`.
+    Two-dimensional arrays are sent in row-major order with their number of
+    columns, R reads them as matrices.
+    """
+    vectors = {
+        key: value
+        for key, value in request.items()
+        if isinstance(value, np.ndarray) and value.dtype.kind in BINARY_TYPES
+    }
+
+    if not vectors or not config.R_WORKER_BINARY_REQUESTS:
+        body = json.dumps(request, default=_to_json).encode("utf-8")
+        return body, "application/json"
+
+    header = json.dumps(
+        {
+            "body": {
+                key: value for key, value in request.items() if key not in vectors
+            },
+            "names": list(vectors.keys()),
+            "lengths": [vector.size for vector in vectors.values()],
+            "types": [BINARY_TYPES[v.dtype.kind][1] for v in vectors.values()],
+            "ncols": [
+                vector.shape[1] if vector.ndim == 2 else 0
+                for vector in vectors.values()
+            ],
+        },
+        default=_to_json,
+    ).encode("utf-8")
+
+    parts = [struct.pack("<I", len(header)), header]
+    for vector in vectors.values():
+        dtype = BINARY_TYPES[vector.dtype.kind][0]
+        parts.append(np.ascontiguousarray(vector, dtype=dtype).tobytes())
+
+    return b"".join(parts), BINARY_CONTENT_TYPE
+
+
+def _is_draining(e):
+    return e.response is not None and e.response.status_code == 409
+
+
+class RWorkerClient:
+    """Sends task requests to the R worker.
+
+    All tasks share one keep-alive session, so connections to the R worker are
+    reused between requests. Failed requests are retried with exponential
+    backoff, R errors are raised as RWorkerException, and the latency and
+    payload sizes of every call are recorded per endpoint.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url or config.R_WORKER_URL
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(10, config.MAX_CONCURRENT_TASKS)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, endpoint, request):
+        """Sends the request to the endpoint and returns the `data` it returns."""
+        response = self._post(endpoint, request)
+
+        result = response.json()
+        raise_if_error(result)
+
+        return result.get("data")
+
+    def post_raw(self, endpoint, request):
+        """Sends the request and returns the JSON bytes of the `data` it returns.
+
+        The data of successful responses is passed through without decoding it,
+        so it can be uploaded as it is. Only responses that are errors or are not
+        in the expected layout are decoded.
+        """
+        response = self._post(endpoint, request)
+
+        data = extract_data(response.content)
+        if data is not None:
+            metrics.increment("r_worker.passthrough.hit")
+            return data
+
+        metrics.increment("r_worker.passthrough.miss")
+
+        result = response.json()
+        raise_if_error(result)
+
+        return ujson.dumps(result.get("data")).encode("utf-8")
+
+    # Requests rejected by an R app that is draining to switch to reloaded
+    # matrices are retried until the drain times out, other failures for 30s
+    @backoff.on_exception(
+        backoff.constant,
+        requests.exceptions.HTTPError,
+        giveup=lambda e: not _is_draining(e),
+        max_time=lambda: config.R_WORKER_DRAIN_TIMEOUT,
+        interval=1,
+    )
+    @backoff.on_exception(
+        backoff.expo,
+        requests.exceptions.RequestException,
+        giveup=_is_draining,
+        max_time=30,
+    )
+    def _post(self, endpoint, request):
+        body, content_type = encode_request(request)
+
+        start = time.time()
+        response = self.session.post(
+            f"{self.base_url}/v0/{endpoint}",
+            headers={"content-type": content_type},
+            data=body,
+            timeout=ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT),
+        )
+
+        # raise an exception if an HTTPError occurred, otherwise json() will fail
+        response.raise_for_status()
+
+        metrics.observe(f"r_worker.{endpoint}.seconds", time.time() - start)
+        metrics.observe(f"r_worker.{endpoint}.request_bytes", len(body))
+        metrics.observe(f"r_worker.{endpoint}.response_bytes", len(response.content))
+
+        return response
@@ -0,0 +1,53 @@
+import re
+
+import ujson
+
+# Start of the body of a successful R worker response, the error comes
+# before the data (see formatResponse in the R worker)
+_SUCCESS_ENVELOPE = re.compile(rb'\s*\{\s*"error"\s*:\s*null\s*,\s*"data"\s*:')
+
+_WHITESPACE = b" \t\r\n"
+
+
+def _end_without_whitespace(raw, end=None):
+    end = len(raw) if end is None else end
+
+    while end > 0 and raw[end - 1] in _WHITESPACE:
+        end -= 1
+
+    return end
+
+
+def extract_data(body):
+    """Returns the JSON of the `data` of a successful R worker response body.
+
+    The data is sliced out of the envelope without decoding it. Returns None if
+    the body is not a successful response in the expected layout, so the caller
+    can fall back to decoding it.
+    """
+    match = _SUCCESS_ENVELOPE.match(body)
+    if not match:
+        return None
+
+    end = _end_without_whitespace(body)
+    if end == 0 or body[end - 1:end] != b"}":
+        return None
+
+    start = match.end()
+    while start < end - 1 and body[start] in _WHITESPACE:
+        start += 1
+
+    return body[start:_end_without_whitespace(body, end - 1)]
+
+
+def add_field(raw, key, value):
+    """Adds a field to the JSON object `raw` without decoding it."""
+    end = raw.rindex(b"}")
+    start = raw.index(b"{")
+
+    field = ujson.dumps({key: value}).encode("utf-8")[1:-1]
+
+    is_empty = raw[start + 1:end].strip() == b""
+    separator = b"" if is_empty else b","
+
+    return b"".join([raw[:end], separator, field, raw[end:]])
@@ -0,0 +1,119 @@
+import threading
+import time
+import uuid
+from logging import warning
+
+from redis.exceptions import RedisError
+
+from .clients import clients
+
+# Deletes the lock only if it is still held with the token of the caller
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Resets the expiry of the lock, in seconds, only if it is still held with the
+# token of the caller
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """Lock shared by the workers of different pods, held in Redis.
+
+    The lock is a key set only if it does not exist, to a random token of each
+    acquire. It expires after `ttl` seconds, so the locks of workers that stop
+    are not held forever, and is extended every third of it while it is held.
+    Releasing and extending compare the token and change the key atomically, so
+    a lock that expired and was taken by another worker is left to it.
+    """
+
+    def __init__(self, key, ttl, poll_interval=0.5):
+        self.key = key
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+        # Held by a thread of this worker
+        self._local = threading.Lock()
+
+        self._token = None
+        self._released = None
+
+    def acquire(self, blocking=True, timeout=None):
+        """Returns whether the lock was acquired.
+
+        If `blocking`, waits for it up to `timeout` seconds, or forever if None.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        if blocking:
+            acquired = self._local.acquire(timeout=-1 if timeout is None else timeout)
+        else:
+            acquired = self._local.acquire(blocking=False)
+
+        if not acquired:
+            return False
+
+        token = uuid.uuid4().hex
+
+        try:
+            while not clients.redis.set(self.key, token, ex=self.ttl, nx=True):
+                if not blocking or (
+                    deadline is not None and time.monotonic() >= deadline
+                ):
+                    self._local.release()
+                    return False
+
+                time.sleep(self.poll_interval)
+        except BaseException:
+            self._local.release()
+            raise
+
+        self._token = token
+        self._released = threading.Event()
+
+        threading.Thread(
+            target=self._heartbeat,
+            args=(token, self._released),
+            name=f"lock-heartbeat:{self.key}",
+            daemon=True,
+        ).start()
+
+        return True
+
+    def _heartbeat(self, token, released):
+        while not released.wait(self.ttl / 3):
+            try:
+                extended = clients.redis.eval(
+                    EXTEND_SCRIPT, 1, self.key, token, self.ttl
+                )
+            except RedisError as e:
+                warning(f"Could not extend lock {self.key}: {e}")
+                continue
+
+            if not extended:
+                warning(f"Lock {self.key} expired while it was held")
+                return
+
+    def release(self):
+        token, self._token = self._token, None
+        self._released.set()
+
+        try:
+            clients.redis.eval(RELEASE_SCRIPT, 1, self.key, token)
+        finally:
+            self._local.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
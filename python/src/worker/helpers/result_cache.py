@@ -0,0 +1,144 @@
+import time
+from logging import info, warning
+
+import ujson
+from redis.exceptions import RedisError
+
+from ..config import config
+from . import metrics
+from .clients import clients
+
+# Compressed results are stored under `<prefix>:<ETag>`, the ETags of the
+# stored results are kept by the time they were stored in `<prefix>:stored-at`,
+# their sizes in `<prefix>:stored-sizes` and the sum of them in
+# `<prefix>:stored-bytes`
+_PREFIX = "worker-results"
+_ORDER_KEY = f"{_PREFIX}:stored-at"
+_SIZES_KEY = f"{_PREFIX}:stored-sizes"
+_BYTES_KEY = f"{_PREFIX}:stored-bytes"
+
+
+def _result_key(etag):
+    return f"{_PREFIX}:{etag}"
+
+
+def _encode(data, metadata):
+    # The metadata (e.g. the codec) goes before the compressed result
+    return ujson.dumps(metadata).encode("utf-8") + b"\n" + data
+
+
+def _decode(value):
+    metadata, _, data = value.partition(b"\n")
+    return data, ujson.loads(metadata)
+
+
+# Stores a result and drops the least recently stored ones while the stored
+# results take more than the budget, atomically so concurrent workers keep the
+# order, sizes and byte count consistent. Results that expired are dropped from
+# them on the way. Every key it touches is in KEYS, the results dropped to fit
+# the budget are returned for the caller to delete.
+STORE_SCRIPT = """
+local order_key, sizes_key, bytes_key, result_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local etag, value, ttl, size = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local budget, now = ARGV[5], ARGV[6]
+
+local function drop(dropped)
+    redis.call("zrem", order_key, dropped)
+    redis.call("decrby", bytes_key, redis.call("hget", sizes_key, dropped) or 0)
+    redis.call("hdel", sizes_key, dropped)
+end
+
+redis.call("set", result_key, value, "EX", ttl)
+
+-- Results stored again count once, with their new size and time
+drop(etag)
+redis.call("zadd", order_key, now, etag)
+redis.call("hset", sizes_key, etag, size)
+redis.call("incrby", bytes_key, size)
+
+local expired = redis.call(
+    "zrangebyscore", order_key, "-inf", tonumber(now) - tonumber(ttl)
+)
+for _, expired_etag in ipairs(expired) do
+    drop(expired_etag)
+end
+
+local evicted = {}
+while tonumber(redis.call("get", bytes_key)) > tonumber(budget) do
+    local oldest = redis.call("zrange", order_key, 0, 0)[1]
+    if oldest == etag then
+        break
+    end
+
+    drop(oldest)
+    table.insert(evicted, oldest)
+end
+
+return evicted
+"""
+
+
+def cache_result(etag, data, metadata):
+    """Stores a compressed result in Redis for `config.RESULT_CACHE_TTL` seconds.
+
+    Only results up to `config.RESULT_CACHE_MAX_RESULT_BYTES` are stored. The
+    least recently stored results are dropped once all of them take more than
+    `config.RESULT_CACHE_BYTES`. Workers of different experiments share the
+    budget, results are stored and evicted with a Lua script so their updates
+    to it don't interleave. Redis errors are logged and ignored, results are in
+    S3 anyway.
+    Returns whether the result was stored.
+    """
+    if not config.RESULT_CACHE_ENABLED:
+        return False
+
+    if len(data) > config.RESULT_CACHE_MAX_RESULT_BYTES:
+        return False
+
+    try:
+        evicted = clients.redis.eval(
+            STORE_SCRIPT,
+            4,
+            _ORDER_KEY,
+            _SIZES_KEY,
+            _BYTES_KEY,
+            _result_key(etag),
+            etag,
+            _encode(data, metadata),
+            config.RESULT_CACHE_TTL,
+            len(data),
+            config.RESULT_CACHE_BYTES,
+            time.time(),
+        )
+
+        for evicted_etag in evicted:
+            clients.redis.delete(_result_key(evicted_etag.decode("utf-8")))
+    except RedisError as e:
+        warning(f"Could not store result {etag} in Redis: {e}")
+        return False
+
+    metrics.increment("result_cache.stored")
+    if evicted:
+        metrics.increment("result_cache.evicted", len(evicted))
+    info(f"Stored result {etag} of {len(data)} bytes in Redis")
+
+    return True
+
+
+def get_cached_result(etag):
+    """Returns the compressed result and its metadata, or None if not in Redis."""
+    if not config.RESULT_CACHE_ENABLED:
+        return None
+
+    try:
+        value = clients.redis.get(_result_key(etag))
+    except RedisError as e:
+        warning(f"Could not get result {etag} from Redis: {e}")
+        return None
+
+    if value is None:
+        metrics.increment("result_cache.miss")
+        return None
+
+    metrics.increment("result_cache.hit")
+    return _decode(value)
@@ -0,0 +1,155 @@
+import gzip
+import threading
+
+import zstandard
+
+from ..config import config
+
+# Metadata of the result objects that tells clients how to decode them
+CODEC_METADATA_KEY = "content-codec"
+DICTIONARY_METADATA_KEY = "content-codec-dictionary"
+
+
+class GzipCodec:
+    name = "gzip"
+    default_level = 9
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+    def open(self, fileobj):
+        """Returns a writable file that compresses into `fileobj`."""
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.level)
+
+    def reader(self, fileobj):
+        """Returns a readable file that decompresses `fileobj`."""
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+    @property
+    def metadata(self):
+        return {CODEC_METADATA_KEY: self.name}
+
+
+class ZstdCodec:
+    """Zstandard codec.
+
+    Frames are compressed by `threads` threads (all cores if -1, in the calling
+    thread if 0), optionally with a dictionary trained on previous results, see
+    `train_dictionary`. Clients need the same dictionary to decode them, its id
+    is recorded in the metadata.
+    """
+
+    name = "zstd"
+    default_level = 3
+
+    def __init__(self, level=None, threads=-1, dictionary=None):
+        self.level = self.default_level if level is None else level
+        self.threads = threads
+        self.dictionary = dictionary
+
+    def _compressor(self):
+        return zstandard.ZstdCompressor(
+            level=self.level,
+            threads=self.threads,
+            dict_data=self.dictionary,
+        )
+
+    def open(self, fileobj):
+        """Returns a writable file that compresses into `fileobj`."""
+        return self._compressor().stream_writer(fileobj, closefd=False)
+
+    def reader(self, fileobj):
+        """Returns a readable file that decompresses `fileobj`."""
+        decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+        return decompressor.stream_reader(
+            fileobj, read_across_frames=True, closefd=False
+        )
+
+    def decompress(self, data):
+        decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+        return decompressor.decompressobj().decompress(data)
+
+    @property
+    def metadata(self):
+        metadata = {CODEC_METADATA_KEY: self.name}
+
+        if self.dictionary is not None:
+            metadata[DICTIONARY_METADATA_KEY] = str(self.dictionary.dict_id())
+
+        return metadata
+
+
+def train_dictionary(samples, size=112640):
+    """Trains a zstd dictionary of up to `size` bytes on encoded results."""
+    return zstandard.train_dictionary(size, samples)
+
+
+def load_dictionary(path):
+    with open(path, "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+def _get_dictionary():
+    global _dictionary
+
+    if not config.ZSTD_DICTIONARY_PATH:
+        return None
+
+    with _dictionary_lock:
+        if _dictionary is None:
+            _dictionary = load_dictionary(config.ZSTD_DICTIONARY_PATH)
+
+        return _dictionary
+
+
+def parse_codec(spec):
+    """Returns the codec of a spec like "gzip", "gzip:6" or "zstd:3"."""
+    name, _, level = spec.strip().partition(":")
+    level = int(level) if level else None
+
+    if name == GzipCodec.name:
+        return GzipCodec(level)
+
+    if name == ZstdCodec.name:
+        return ZstdCodec(
+            level, threads=config.ZSTD_THREADS, dictionary=_get_dictionary()
+        )
+
+    raise ValueError(f"Unknown result codec {spec!r}")
+
+
+def get_result_codec(task_name):
+    """Returns the codec results of `task_name` are compressed with.
+
+    Tasks listed in `config.RESULT_CODECS` use their own codec, the rest use
+    `config.RESULT_CODEC`.
+    """
+    return parse_codec(config.RESULT_CODECS.get(task_name, config.RESULT_CODEC))
+
+
+def get_object_codec(metadata):
+    """Returns the codec a result object was compressed with, from its metadata.
+
+    Objects without the codec in their metadata were compressed with gzip.
+    """
+    codec = parse_codec(metadata.get(CODEC_METADATA_KEY, GzipCodec.name))
+
+    dictionary_id = metadata.get(DICTIONARY_METADATA_KEY)
+    if dictionary_id and codec.metadata.get(DICTIONARY_METADATA_KEY) != dictionary_id:
+        raise ValueError(f"zstd dictionary {dictionary_id} is not loaded")
+
+    return codec
+
+
+def clear_dictionary_cache():
+    global _dictionary
+
+    with _dictionary_lock:
+        _dictionary = None
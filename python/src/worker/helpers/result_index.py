@@ -0,0 +1,84 @@
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from ..config import config
+from . import metrics
+from .clients import clients
+
+# ETags of the results this worker uploaded or found in S3. Results are never
+# deleted while the worker runs, so they are known for its lifetime
+_results = set()
+
+# ETags of results that were not in S3, with the time they were checked
+_missing = {}
+
+_lock = threading.Lock()
+
+
+def _head_result(etag):
+    try:
+        clients.s3.head_object(Bucket=config.RESULTS_BUCKET, Key=etag)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+    return True
+
+
+def add_result(etag):
+    """Records that the result of `etag` is in S3."""
+    with _lock:
+        _results.add(etag)
+        _missing.pop(etag, None)
+
+
+def _add_missing(etag):
+    now = time.monotonic()
+
+    with _lock:
+        for missing_etag, checked_at in list(_missing.items()):
+            if now - checked_at >= config.RESULT_INDEX_MISSING_TTL:
+                del _missing[missing_etag]
+
+        if etag not in _results:
+            _missing[etag] = now
+
+
+def result_exists(etag):
+    """Returns whether the result of `etag` is already in S3.
+
+    Results this worker uploaded or found before are known without asking S3.
+    Others are looked up with a HEAD request. Results that were not in S3 are
+    not asked for again for `config.RESULT_INDEX_MISSING_TTL` seconds, as other
+    workers may upload them.
+    """
+    with _lock:
+        if etag in _results:
+            metrics.increment("result_index.hit")
+            return True
+
+        checked_at = _missing.get(etag)
+        if (
+            checked_at is not None
+            and time.monotonic() - checked_at < config.RESULT_INDEX_MISSING_TTL
+        ):
+            metrics.increment("result_index.hit")
+            return False
+
+    metrics.increment("result_index.miss")
+
+    if _head_result(etag):
+        add_result(etag)
+        return True
+
+    _add_missing(etag)
+    return False
+
+
+def clear_result_index():
+    with _lock:
+        _results.clear()
+        _missing.clear()
@@ -0,0 +1,177 @@
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging import info
+from urllib.parse import urlencode
+
+from ..config import config
+from . import metrics
+from .clients import clients
+from .tracing import in_current_entity
+
+
+class ResultUpload:
+    """Writable upload of a result to S3.
+
+    Written bytes are split into parts of `part_size` that are uploaded with a
+    multipart upload while more bytes are written, with up to `concurrency`
+    parts uploading at the same time. Writes block when all of them are busy,
+    so at most `concurrency + 1` parts are kept in memory. Results smaller than
+    a part are uploaded with a single request when the upload is closed.
+    Tags and metadata are set in the same request that creates the object.
+    """
+
+    def __init__(self, s3, bucket, key, tags, part_size, concurrency, metadata=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = 0
+
+        self._tagging = urlencode(tags)
+        self._metadata = metadata or {}
+        self._part_size = part_size
+        self._concurrency = concurrency
+
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._slots = None
+        self._parts = []
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+
+            self._submit_part(part)
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        """Returns the uploaded bytes, or None if they were split into parts."""
+        if self._upload_id is not None:
+            return None
+
+        return bytes(self._buffer)
+
+    def _submit_part(self, part):
+        if self._upload_id is None:
+            response = self.s3.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                Tagging=self._tagging,
+                Metadata=self._metadata,
+            )
+            self._upload_id = response["UploadId"]
+
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._concurrency, thread_name_prefix="result-upload"
+            )
+            self._slots = threading.BoundedSemaphore(self._concurrency)
+
+        part_number = len(self._parts) + 1
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(
+                in_current_entity(self._upload_part), part_number, part
+            )
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self._parts.append(future)
+
+    def _upload_part(self, part_number, part):
+        try:
+            response = self.s3.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=part,
+            )
+        finally:
+            self._slots.release()
+
+        metrics.observe("result_upload.part_bytes", len(part))
+
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def close(self):
+        if self._upload_id is None:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=bytes(self._buffer),
+                Tagging=self._tagging,
+                Metadata=self._metadata,
+            )
+            return
+
+        try:
+            if self._buffer:
+                self._submit_part(bytes(self._buffer))
+                self._buffer = bytearray()
+
+            parts = [future.result() for future in self._parts]
+        finally:
+            self._executor.shutdown(wait=True)
+
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+        info(f"Uploaded {self.size} bytes to {self.key} in {len(parts)} parts")
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+
+        for future in self._parts:
+            future.cancel()
+
+        self._executor.shutdown(wait=True)
+        self.s3.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            return
+
+        try:
+            self.close()
+        except BaseException:
+            self.abort()
+            raise
+
+
+def open_result_upload(key, tags, metadata=None):
+    """Returns a ResultUpload of `key` to the results bucket."""
+    return ResultUpload(
+        clients.s3,
+        config.RESULTS_BUCKET,
+        key,
+        tags,
+        part_size=config.RESULT_UPLOAD_PART_SIZE,
+        concurrency=config.RESULT_UPLOAD_CONCURRENCY,
+        metadata=metadata,
+    )
+
+
+def copy_to_upload(fileobj, upload):
+    shutil.copyfileobj(fileobj, upload, config.RESULT_UPLOAD_PART_SIZE)
@@ -1,82 +1,190 @@
-import gzip
 import json
 import os
+import shutil
+import tempfile
 from logging import info
 from pathlib import Path
 
-import aws_xray_sdk as xray
-import boto3
+import numpy as np
 
 from ..config import config
+from . import metrics
+from .cell_set_index import CellSetIndex
+from .clients import clients
+from .result_codecs import get_object_codec
+
+
+# Parsed cell sets by experiment id, along with the version
+# of the S3 object they were parsed from
+_cell_sets_cache = {}
+
+# Cell set indexes by experiment id, built from the cached cell sets
+_cell_set_index_cache = {}
+
+
+def _object_version(response):
+    return response.get("VersionId") or response.get("ETag")
+
+
+def get_cell_sets_with_version(experiment_id):
+    """Returns the version of the cell sets object in S3 and its parsed cell sets.
+
+    The parsed cell sets are cached in memory. Each call checks the version of
+    the object with a HEAD request and only downloads and parses it again if it
+    changed. The returned cell sets are shared between callers, so they must
+    not be modified.
+    """
+    s3 = clients.s3
+
+    head = s3.head_object(Bucket=config.CELL_SETS_BUCKET, Key=experiment_id)
+    version = _object_version(head)
+
+    cached = _cell_sets_cache.get(experiment_id)
+    if version and cached and cached[0] == version:
+        metrics.increment("cell_sets.cache.hit")
+        return cached
+
+    metrics.increment("cell_sets.cache.miss")
+    info(f"Downloading cellsets for experiment {experiment_id}")
+
+    response = s3.get_object(Bucket=config.CELL_SETS_BUCKET, Key=experiment_id)
+    cell_sets = json.loads(response["Body"].read())["cellSets"]
+
+    # The object may have changed between both requests,
+    # use the version of the one that was downloaded
+    version = _object_version(response)
+    if version:
+        _cell_sets_cache[experiment_id] = (version, cell_sets)
+
+    return version, cell_sets
 
 
 def get_cell_sets(experiment_id):
-    dir_path = os.path.join(config.LOCAL_DIR, f"{experiment_id}")
+    _, cell_sets = get_cell_sets_with_version(experiment_id)
+    return cell_sets
+
+
+def get_cell_set_index(experiment_id):
+    """Returns the CellSetIndex of the current cell sets of the experiment.
+
+    The index is only built again when the version of the cell sets changes.
+    """
+    version, cell_sets = get_cell_sets_with_version(experiment_id)
 
-    Path(dir_path).mkdir(parents=True, exist_ok=True)
+    cached = _cell_set_index_cache.get(experiment_id)
+    if version and cached and cached.version == version:
+        return cached
 
-    with open(f"{dir_path}/cell_sets.json", "wb+") as f:
-        s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
+    cell_set_index = CellSetIndex(cell_sets, version=version)
+    if version:
+        _cell_set_index_cache[experiment_id] = cell_set_index
 
-        info(f"Downloading cellsets for experiment {experiment_id}")
+    return cell_set_index
 
-        # Disabled X-Ray to fix a botocore bug where the context
-        # does not propagate to S3 requests. see:
-        # https://github.com/open-telemetry/opentelemetry-python-contrib/issues/298
-        was_enabled = xray.global_sdk_config.sdk_enabled()
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(False)
 
-        s3.download_fileobj(
-            Bucket=config.CELL_SETS_BUCKET,
-            Key=experiment_id,
-            Fileobj=f,
-        )
+def clear_cell_sets_cache():
+    _cell_sets_cache.clear()
+    _cell_set_index_cache.clear()
 
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(True)
 
+def _embedding_path(etag):
+    return os.path.join(config.EMBEDDING_CACHE_DIR, f"{etag}.npy")
+
+
+def _download_embedding(etag):
+    s3 = clients.s3
+
+    info(f"Downloading embedding with ETag {etag}")
+
+    # Streamed on this thread, so the request is traced in its segment
+    response = s3.get_object(Bucket=config.RESULTS_BUCKET, Key=etag)
+
+    # Embeddings are compressed with the codec of GetEmbedding when they're stored
+    codec = get_object_codec(response.get("Metadata", {}))
+
+    with tempfile.TemporaryFile() as f:
+        shutil.copyfileobj(response["Body"], f)
         f.seek(0)
 
-        cell_sets_string = f.read()
-        cell_sets = json.loads(cell_sets_string)
+        with codec.reader(f) as embedding_file:
+            embedding = json.load(embedding_file)
 
-        return cell_sets["cellSets"]
+    # Cells filtered out of the embedding are null, they are stored as NaN. Kept
+    # as float64, the coordinates are the same as the ones parsed from JSON
+    embedding_array = np.full((len(embedding), 2), np.nan, dtype=np.float64)
 
+    present = [
+        i for i, coordinates in enumerate(embedding) if coordinates is not None
+    ]
+    if present:
+        embedding_array[present] = [embedding[i] for i in present]
 
-def get_embedding(etag, format_for_r):
-    dir_path = os.path.join(config.LOCAL_DIR, f"{etag}")
+    return embedding_array
 
-    Path(dir_path).mkdir(parents=True, exist_ok=True)
 
-    with open(f"{dir_path}/embedding.json", "wb+") as f:
-        s3 = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
+def _evict_embeddings(keep_path):
+    entries = []
+    for entry in os.scandir(config.EMBEDDING_CACHE_DIR):
+        if entry.name.endswith(".npy") and entry.path != keep_path:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
 
-        info(f"Downloading embedding with ETag {etag}")
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
 
-        # Disabled X-Ray to fix a botocore bug where the context
-        # does not propagate to S3 requests. see:
-        # https://github.com/open-telemetry/opentelemetry-python-contrib/issues/298
-        was_enabled = xray.global_sdk_config.sdk_enabled()
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(False)
+    total_size = sum(size for _, size, _ in entries) + os.path.getsize(keep_path)
 
-        s3.download_fileobj(
-            Bucket=config.RESULTS_BUCKET,
-            Key=etag,
-            Fileobj=f,
-        )
+    # Least recently used first, see the utime on cache hits
+    for _, size, path in sorted(entries):
+        if total_size <= config.EMBEDDING_CACHE_BYTES:
+            break
 
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(True)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total_size -= size
+        metrics.increment("embedding.cache.evicted")
 
-        f.seek(0)
 
-        embedding_string = gzip.decompress(f.read())
-        embedding = json.loads(embedding_string)
+def get_embedding_array(etag):
+    """Returns the embedding with the ETag as a read-only `(n_cells, 2)` array.
 
-        if(format_for_r):
-          # NULL values are deleted in R objects whereas NAs are an indicator of a missing value
-          embedding = [ e if e is not None else ["NA", "NA"] for e in embedding ]
+    Coordinates are float64, rows of cells that are not in the embedding are NaN.
+    Embeddings are cached on disk and memory-mapped when they are used again, the
+    least recently used ones are deleted when the cache grows over
+    `EMBEDDING_CACHE_BYTES`.
+    """
+    path = _embedding_path(etag)
 
+    try:
+        embedding = np.load(path, mmap_mode="r")
+    except FileNotFoundError:
+        pass
+    else:
+        # Mark the embedding as recently used for the eviction
+        os.utime(path)
+
+        metrics.increment("embedding.cache.hit")
         return embedding
+
+    metrics.increment("embedding.cache.miss")
+
+    embedding = _download_embedding(etag)
+
+    Path(config.EMBEDDING_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+    # Written to a temporary file first, so concurrent
+    # tasks never load a partially written embedding
+    with tempfile.NamedTemporaryFile(
+        dir=config.EMBEDDING_CACHE_DIR, suffix=".tmp", delete=False
+    ) as f:
+        np.save(f, embedding)
+
+    os.replace(f.name, path)
+
+    _evict_embeddings(keep_path=path)
+
+    return np.load(path, mmap_mode="r")
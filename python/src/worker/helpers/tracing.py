@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+
+from aws_xray_sdk import global_sdk_config
+from aws_xray_sdk.core import xray_recorder
+
+
+def begin_request_segment(name, trace_header=None):
+    """Begins the segment of a request on this thread and returns it.
+
+    The sampling decision comes from the trace header of the request, requests
+    without one are not sampled. Segments that are not sampled are not sent,
+    but AWS calls made in them don't look for a missing segment either.
+    """
+    if trace_header is None:
+        return xray_recorder.begin_segment(name, sampling=0)
+
+    return xray_recorder.begin_segment(
+        name,
+        traceid=trace_header.root,
+        sampling=trace_header.sampled,
+        parent_id=trace_header.parent,
+    )
+
+
+def take_segment():
+    """Removes the segment from this thread, to end it on another one."""
+    if not global_sdk_config.sdk_enabled():
+        return None
+
+    segment = xray_recorder.current_segment()
+    xray_recorder.clear_trace_entities()
+
+    return segment
+
+
+def end_segment(segment):
+    """Ends a segment taken from another thread, sending it if sampled."""
+    if segment is None:
+        return
+
+    segment.close()
+    if segment.sampled:
+        xray_recorder.emitter.send_entity(segment)
+
+
+@contextmanager
+def in_segment(segment):
+    """Runs the block in `segment`, e.g. on a thread it was handed over to."""
+    if segment is None:
+        yield
+        return
+
+    xray_recorder.context.set_trace_entity(segment)
+    try:
+        yield
+    finally:
+        xray_recorder.clear_trace_entities()
+
+
+@contextmanager
+def background_segment(name):
+    """Runs the block in a segment that is not sampled.
+
+    Used by threads that make AWS calls outside of requests (e.g. receiving
+    messages), so they are not traced.
+    """
+    segment = xray_recorder.begin_segment(name, sampling=0)
+    try:
+        yield segment
+    finally:
+        xray_recorder.end_segment()
+
+
+def in_current_entity(fn):
+    """Returns `fn` wrapped to run in the trace entity of this thread.
+
+    Used to submit work to a thread pool, so the AWS calls it makes are traced
+    in the segment of the request that submitted it.
+    """
+    if not global_sdk_config.sdk_enabled():
+        return fn
+
+    entity = xray_recorder.get_trace_entity()
+    if entity is None:
+        return fn
+
+    def run(*args, **kwargs):
+        xray_recorder.context.set_trace_entity(entity)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            xray_recorder.clear_trace_entities()
+
+    return run
@@ -0,0 +1,75 @@
+import queue
+import threading
+import traceback
+from logging import error, info
+
+from .config import config
+from .helpers.in_flight import finish_request
+from .helpers.tracing import end_segment, in_segment
+
+
+class Publisher:
+    """Publishes responses on a background thread.
+
+    Uploading and notifying about a result is left to run while the next task
+    is consumed and computed. At most `max_pending` responses wait to be
+    published; when the queue is full `publish` blocks until there is room,
+    so a slow upload holds back new work instead of piling up results in memory.
+    The messages of requests are deleted from the queue by `receiver` once their
+    responses are published. Responses are published in the X-Ray segment of
+    their request, which is ended once they are.
+    """
+
+    def __init__(self, max_pending=None, receiver=None):
+        self.receiver = receiver
+        self._queue = queue.Queue(maxsize=max_pending or config.PUBLISH_QUEUE_SIZE)
+        self._thread = threading.Thread(
+            target=self._work, name="publisher", daemon=True
+        )
+        self._thread.start()
+
+    def publish(self, response, segment=None):
+        response.stage()
+        self._queue.put((response, segment))
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def shutdown(self):
+        info("Waiting for pending responses to be published...")
+        self._queue.put(None)
+        self._thread.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                self._queue.task_done()
+                return
+
+            response, segment = item
+
+            with in_segment(segment):
+                self._publish(response)
+
+            end_segment(segment)
+            self._queue.task_done()
+
+    def _publish(self, response):
+        try:
+            response.publish()
+
+            if self.receiver:
+                self.receiver.delete(response.request)
+        except Exception:
+            error(
+                "Exception while publishing response "
+                f"{response.request.get('ETag')}:\n{traceback.format_exc()}"
+            )
+
+            # The request is received again after its visibility timeout
+            if self.receiver:
+                self.receiver.release(response.request)
+        finally:
+            finish_request(response.request.get("ETag"))
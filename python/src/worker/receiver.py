@@ -0,0 +1,290 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+from logging import error, info, warning
+
+from botocore.exceptions import ClientError
+
+from .config import config
+from .helpers import metrics
+from .helpers.clients import clients
+from .helpers.tracing import background_segment
+from .scheduler import request_deadline
+
+
+class Receiver:
+    """Receives messages from the work queue on a background thread.
+
+    Received requests are added to the scheduler, keeping up to
+    `config.PREFETCH_MESSAGES` of them waiting, so the next request is ready as
+    soon as a task finishes. With `config.MULTI_REPLICA`, no more are received
+    than `capacity()` (e.g. the free slots of the executor), so requests this
+    worker can't start yet are left to the other replicas.
+
+    The queue is a FIFO queue, which returns no other message of a group while
+    one of its messages is in flight. Messages are deleted when received, and
+    those of requests that did not run are sent again when the receiver stops.
+    With `config.UNIQUE_MESSAGE_GROUPS`, each request has a group of its own, so
+    messages stay in the queue until `delete` is called for their request, after
+    its response is published. Until then their visibility timeout is extended,
+    so that other workers of the same queue don't receive them. Messages that are
+    `release`d stop being extended and are received again once their visibility
+    timeout passes.
+    """
+
+    def __init__(self, scheduler, capacity=None):
+        self.scheduler = scheduler
+        self.capacity = capacity
+
+        # Requests received and not deleted or released yet, with the receipt
+        # handle of their message if it is held and its group
+        self._messages = {}
+        self._lock = threading.Lock()
+
+        self._thread = None
+        self._stopped = threading.Event()
+        self._last_extended = time.monotonic()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._work, name="receiver", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stops receiving and returns the requests not run yet to the queue."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+
+        if thread is None:
+            return
+
+        self._stopped.set()
+        thread.join()
+
+        with self._lock:
+            messages = list(self._messages.values())
+            self._messages = {}
+
+        self._change_visibility(
+            [handle for _, handle, _ in messages if handle is not None], 0
+        )
+        self._send_again(
+            [(body, group) for body, handle, group in messages if handle is None]
+        )
+
+    def _work(self):
+        # Messages are received outside of requests, they are not traced
+        with background_segment("worker-receiver"):
+            self._receive_until_stopped()
+
+    def _receive_until_stopped(self):
+        while not self._stopped.is_set():
+            try:
+                room = self._room()
+
+                if room > 0:
+                    self.receive(20, room)
+                else:
+                    self._stopped.wait(1)
+
+                if (
+                    time.monotonic() - self._last_extended
+                    >= config.VISIBILITY_TIMEOUT / 3
+                ):
+                    self.extend_visibility()
+            except Exception:
+                error(
+                    f"Exception while receiving messages:\n{traceback.format_exc()}"
+                )
+                self._stopped.wait(5)
+
+    def _room(self):
+        room = config.PREFETCH_MESSAGES - len(self.scheduler)
+
+        if config.MULTI_REPLICA and self.capacity is not None:
+            room = min(room, self.capacity() - len(self.scheduler))
+
+        return room
+
+    def _queue_url(self):
+        """
+        It is possible that the queue was not created by the time
+        the worker launches, because the work queue creation (if needed)
+        and the Job spawn are on separate promises and work asyncrhonously.
+        This is a performance improvement but it causes the race condition above.
+
+        If this is the case, we just return None
+        as if we didn't receive a message in this time frame.
+        """
+        try:
+            return clients.queue_url(config.QUEUE_NAME)
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "AWS.SimpleQueueService.NonExistentQueue":
+                return None
+            else:
+                raise e
+
+    def receive(self, wait_time, max_messages):
+        """Receives up to `max_messages` messages into the scheduler.
+
+        Returns the number of requests added.
+        """
+        queue_url = self._queue_url()
+        if queue_url is None:
+            # Wait as if the queue was empty
+            self._stopped.wait(wait_time)
+            return 0
+
+        response = clients.sqs.receive_message(
+            QueueUrl=queue_url,
+            WaitTimeSeconds=wait_time,
+            MaxNumberOfMessages=min(max_messages, 10),
+            VisibilityTimeout=config.VISIBILITY_TIMEOUT,
+            AttributeNames=["AWSTraceHeader", "MessageGroupId"],
+        )
+        messages = response.get("Messages") or []
+
+        received = 0
+        for message in messages:
+            # Try to parse it as a request, with a timeout to schedule it by
+            try:
+                body = json.loads(message["Body"])
+                request_deadline(body)
+            except Exception as e:
+                info(f"Exception when loading message {message['Body']}")
+                info(f"Exception: {e}")
+
+                clients.sqs.delete_message(
+                    QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"]
+                )
+                continue
+
+            info("Consumed a message from SQS.")
+            attributes = message.get("Attributes", {})
+            trace_header = attributes.get("AWSTraceHeader", None)
+
+            receipt_handle = message["ReceiptHandle"]
+            if not config.UNIQUE_MESSAGE_GROUPS:
+                # Holding the message would hold back the rest of its group
+                self._delete_message(queue_url, receipt_handle, body)
+                receipt_handle = None
+
+            with self._lock:
+                self._messages[id(body)] = (
+                    body,
+                    receipt_handle,
+                    attributes.get("MessageGroupId"),
+                )
+
+            self.scheduler.add(body, trace_header)
+            received += 1
+
+        metrics.increment("receiver.messages", received)
+
+        return received
+
+    def _pop(self, request):
+        with self._lock:
+            _, receipt_handle, _ = self._messages.pop(id(request), (None, None, None))
+
+        return receipt_handle
+
+    def _delete_message(self, queue_url, receipt_handle, request):
+        try:
+            clients.sqs.delete_message(
+                QueueUrl=queue_url, ReceiptHandle=receipt_handle
+            )
+        except ClientError as e:
+            # The request will be received again and found to be done
+            warning(f"Could not delete message of {request.get('ETag')}: {e}")
+
+    def delete(self, request):
+        """Deletes the message of a request once it does not need to run again."""
+        receipt_handle = self._pop(request)
+        if receipt_handle is None:
+            return
+
+        self._delete_message(self._queue_url(), receipt_handle, request)
+
+    def release(self, request):
+        """Stops extending the visibility of the message of a request that failed,
+        so it is received again after its visibility timeout.
+
+        Messages deleted when received are not sent again, as before they were
+        held: clients request results that never arrive again.
+        """
+        self._pop(request)
+
+    def _send_again(self, messages):
+        for body, group_id in messages:
+            params = {}
+            if group_id is not None:
+                # Same group as before, a new deduplication id so that the
+                # message is not taken for the one received
+                params = {
+                    "MessageGroupId": group_id,
+                    "MessageDeduplicationId": uuid.uuid4().hex,
+                }
+
+            try:
+                clients.sqs.send_message(
+                    QueueUrl=self._queue_url(), MessageBody=json.dumps(body), **params
+                )
+            except ClientError as e:
+                warning(f"Could not send again message of {body.get('ETag')}: {e}")
+
+    def _change_visibility(self, receipt_handles, timeout):
+        if not receipt_handles:
+            return
+
+        queue_url = self._queue_url()
+
+        for start in range(0, len(receipt_handles), 10):
+            batch = receipt_handles[start:start + 10]
+
+            response = clients.sqs.change_message_visibility_batch(
+                QueueUrl=queue_url,
+                Entries=[
+                    {
+                        "Id": str(i),
+                        "ReceiptHandle": receipt_handle,
+                        "VisibilityTimeout": timeout,
+                    }
+                    for i, receipt_handle in enumerate(batch)
+                ],
+            )
+
+            for failed in response.get("Failed", []):
+                warning(f"Could not change visibility of a message: {failed}")
+
+    def extend_visibility(self):
+        """Extends the visibility timeout of the messages received and not done.
+
+        Requests that expired while they wait are dropped first, so their
+        messages are deleted instead of extended.
+        """
+        self.scheduler.drop_expired()
+
+        with self._lock:
+            receipt_handles = [
+                handle
+                for _, handle, _ in self._messages.values()
+                if handle is not None
+            ]
+
+        self._last_extended = time.monotonic()
+        self._change_visibility(receipt_handles, config.VISIBILITY_TIMEOUT)
+
+    def clear(self):
+        with self._lock:
+            self._messages = {}
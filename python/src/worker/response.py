@@ -1,17 +1,20 @@
-import gzip
 import ujson
 from logging import info
 import base64
-import sys
 import os
 
-import aws_xray_sdk as xray
-import boto3
 from aws_xray_sdk.core import xray_recorder
-from socket_io_emitter import Emitter
-from io import BytesIO
 
 from .config import config
+from .helpers.clients import clients
+from .helpers.result_cache import cache_result
+from .helpers.result_codecs import (
+    CODEC_METADATA_KEY,
+    GzipCodec,
+    get_result_codec,
+)
+from .helpers.result_index import add_result
+from .helpers.result_uploader import copy_to_upload, open_result_upload
 from worker_status_codes import (
     COMPRESSING_TASK_DATA,
     UPLOADING_TASK_DATA,
@@ -30,45 +33,73 @@ class Response:
         self.cacheable = (not result.error) and result.cacheable
 
         self.s3_bucket = config.RESULTS_BUCKET
-
-    #' Returns the compressed work result to be sent
-    #'
-    #' @return gzipped_body to upload to s3 and the compressed bytes 
-    #' object to send over redis if the work result is small enough
-    def _construct_data_for_upload(self):
-        info("Starting compression before upload to s3")
-        io = Emitter({"client": config.REDIS_CLIENT})
-        send_status_update(
-            io, self.request["experimentId"], COMPRESSING_TASK_DATA, self.request
-        )
-
-        gzipped_body = BytesIO()
-        with gzip.open(gzipped_body, "wt", encoding="utf-8") as zipfile:
-            if isinstance(self.result.data, str):
+        self.codec = get_result_codec(request["body"]["name"])
+
+        # Some tasks return a path to a file written by the R worker
+        # instead of the data itself
+        self.file_path = None
+        if result.data in (config.RDS_PATH, config.TMP_RESULTS_PATH_GZ):
+            self.file_path = result.data
+
+    def stage(self):
+        """Move the result file out of the way of the next task.
+
+        The R worker always writes file results to the same path, so they are
+        renamed to a path unique to this request before the upload is left to
+        run in the background.
+        """
+        if not self.file_path:
+            return
+
+        staged_path = f"{self.file_path}.{self.request['ETag']}"
+        os.replace(self.file_path, staged_path)
+        self.file_path = staged_path
+
+    def _write_data(self, data, fileobj):
+        """Compresses the work result into `fileobj` with the codec of the task."""
+        with self.codec.open(fileobj) as zipfile:
+            if isinstance(data, bytes):
+                # Already encoded, e.g. passed through from the R worker
+                info("Compressing encoded json work result")
+                zipfile.write(data)
+            elif isinstance(data, str):
                 info("Compressing string work result")
-                zipfile.write(self.result.data)
+                zipfile.write(data.encode("utf-8"))
             else:
                 info('Encoding and compressing json work result')
-                ujson.dump(self.result.data, zipfile)
-
-        gz_body_bytes = None
-        # If size is less than 250 kb, then send it over notification too
-        # Needs to be done here because upload_fileobj closes the file:
-        # https://github.com/boto/boto3/issues/929
-        kb = 1000
-        body_size = sys.getsizeof(gzipped_body)
-        info(f"Body size is {body_size}")
-        if (body_size <= 250 * kb):
-            info("Data is smaller than 250 kb, sending over socket")
-            gzipped_body.seek(0)
-            gz_body_bytes = gzipped_body.read()
-
-        gzipped_body.seek(0)
-
-        info("Compression finished")
-        return gzipped_body, gz_body_bytes
-
-    def _construct_response_msg(self, socket_data = None):
+                zipfile.write(ujson.dumps(data).encode("utf-8"))
+
+    def _get_inline_limit(self):
+        """Largest compressed result of the task sent in a single socket message."""
+        return config.SOCKET_INLINE_BYTES_BY_TASK.get(
+            self.request["body"]["name"], config.SOCKET_INLINE_BYTES
+        )
+
+    #' Returns the compressed work result to send over the socket,
+    #' if the work result is small enough
+    def _get_socket_data(self, upload):
+        # Clients can only decode gzip results sent over the socket
+        if self.codec.name != GzipCodec.name:
+            return None
+
+        info(f"Body size is {upload.size}")
+        if self._fits_socket(upload.size):
+            return upload.getvalue()
+
+        return None
+
+    def _fits_socket(self, size):
+        # Results up to the inline limit are sent in one message, larger ones in
+        # chunks up to SOCKET_CHUNKED_BYTES, if set. Sizes are of the compressed
+        # result
+        max_size = max(self._get_inline_limit(), config.SOCKET_CHUNKED_BYTES)
+        if size <= max_size:
+            info(f"Data is smaller than {max_size} bytes, sending over socket")
+            return True
+
+        return False
+
+    def _construct_response_msg(self, socket_data=None, chunks=None):
         if socket_data:
             return base64.b64encode(socket_data)
 
@@ -78,62 +109,99 @@ class Response:
             "type": "WorkResponse",
         }
 
+        # The result was sent in this many messages before this one
+        if chunks:
+            message["response"]["chunks"] = chunks
+
         if self.error:
             message["response"]["errorCode"] = self.result.data["error_code"]
             message["response"]["userMessage"] = self.result.data["user_message"]
 
         return message
 
+    def _send_chunks(self, socket_data):
+        """Sends the compressed result in base64 encoded chunks.
+
+        Chunks are sent to `WorkResponseChunk-<ETag>` before the work response,
+        each with its index and the number of chunks. Decoding and joining them
+        in order gives the compressed result. Returns the number of chunks.
+        """
+        io = clients.emitter
+        size = config.SOCKET_CHUNK_SIZE
+        count = -(-len(socket_data) // size)
+
+        for index in range(count):
+            chunk = socket_data[index * size:(index + 1) * size]
+            io.Emit(
+                f'WorkResponseChunk-{self.request["ETag"]}',
+                {
+                    "index": index,
+                    "count": count,
+                    "data": base64.b64encode(chunk).decode("ascii"),
+                },
+            )
+
+        info(f"Sent result of {len(socket_data)} bytes in {count} chunks")
+
+        return count
+
     @xray_recorder.capture("Response._upload")
     def _upload(self, response_data, type):
-        io = Emitter({"client": config.REDIS_CLIENT})
+        """Uploads the work result to S3, tagged with its experiment and request type.
+
+        `type` is "path" to upload the file written by the R worker at
+        `response_data`, or "data" to compress `response_data` into the upload,
+        so parts are uploaded while the rest is being compressed. The codec of
+        compressed data is recorded in the metadata of the object.
+        Returns the finished ResultUpload.
+        """
+        io = clients.emitter
+
+        if type == "data":
+            info("Starting compression before upload to s3")
+            send_status_update(
+                io, self.request["experimentId"], COMPRESSING_TASK_DATA, self.request
+            )
 
         send_status_update(
             io, self.request["experimentId"], UPLOADING_TASK_DATA, self.request
         )
 
-        client = boto3.client("s3", **config.BOTO_RESOURCE_KWARGS)
         ETag = self.request["ETag"]
+        tags = {
+            "experimentId": self.request["experimentId"],
+            "requestType": self.request["body"]["name"],
+        }
+        metadata = self.codec.metadata if type == "data" else None
 
-        # Disabled X-Ray to fix a botocore bug where the context
-        # does not propagate to S3 requests. see:
-        # https://github.com/open-telemetry/opentelemetry-python-contrib/issues/298
-        was_enabled = xray.global_sdk_config.sdk_enabled()
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(False)
-
-        if type == "path":
-            with open(response_data, "rb") as file:
-                client.upload_fileobj(file, self.s3_bucket, ETag)
-        else:
-            client.upload_fileobj(response_data, self.s3_bucket, ETag)
-
-        client.put_object_tagging(
-            Key=ETag,
-            Bucket=self.s3_bucket,
-            Tagging={
-                "TagSet": [
-                    {"Key": "experimentId", "Value": self.request["experimentId"]},
-                    {"Key": "requestType", "Value": self.request["body"]["name"]},
-                ]
-            },
-        )
+        with open_result_upload(ETag, tags, metadata) as upload:
+            if type == "path":
+                with open(response_data, "rb") as file:
+                    copy_to_upload(file, upload)
+            else:
+                self._write_data(response_data, upload)
 
         info(f"Response was uploaded in bucket {self.s3_bucket} at key {ETag}.")
+        add_result(ETag)
 
-        if was_enabled:
-            xray.global_sdk_config.set_sdk_enabled(True)
+        return upload
 
-        return ETag
+    def _cache(self, upload):
+        """Keeps small results in Redis too, see `cache_result`."""
+        data = upload.getvalue()
+
+        if data is not None:
+            cache_result(self.request["ETag"], data, self.codec.metadata)
 
     #' Send a notification that a work response finished
     #'
     #' @param socket_data Optional. The work result, if not None, it is sent instead
-    #'  of the default json response msg so it reaches the client faster
+    #'  of the default json response msg so it reaches the client faster. Results
+    #'  larger than the inline limit of the task are sent in chunks before it
     #'
     #' @export
     def _send_notification(self, socket_data=None):
-        io = Emitter({"client": config.REDIS_CLIENT})
+        io = clients.emitter
         if self.request["requestProps"].get("broadcast"):
             io.Emit(
                 f'ExperimentUpdates-{self.request["experimentId"]}',
@@ -146,7 +214,13 @@ class Response:
             io, self.request["experimentId"], FINISHED_TASK, self.request
         )
 
-        io.Emit(f'WorkResponse-{self.request["ETag"]}', self._construct_response_msg(socket_data))
+        if socket_data and len(socket_data) > self._get_inline_limit():
+            chunks = self._send_chunks(socket_data)
+            message = self._construct_response_msg(chunks=chunks)
+        else:
+            message = self._construct_response_msg(socket_data)
+
+        io.Emit(f'WorkResponse-{self.request["ETag"]}', message)
 
         info(f"Notified users waiting for request with ETag {self.request['ETag']}.")
 
@@ -158,17 +232,34 @@ class Response:
 
         if not self.error and self.cacheable:
             info("Uploading response to S3")
-            if self.result.data == config.RDS_PATH or self.result.data == config.TMP_RESULTS_PATH_GZ:
-                self._upload(self.result.data, "path")
+            if self.file_path:
+                self._upload(self.file_path, "path")
             else:
-                s3_data, socket_data = self._construct_data_for_upload()
-                self._upload(s3_data, "obj")
+                upload = self._upload(self.result.data, "data")
+                socket_data = self._get_socket_data(upload)
+                self._cache(upload)
 
         info("Sending socket.io message to clients subscribed to work response")
         self._send_notification(socket_data)
 
         # Remove the temporary file to transfer data between R and python
-        # to free up memory
-        if self.result.data == config.TMP_RESULTS_PATH_GZ:
+        # to free up memory. Staged copies of the R object are removed too.
+        if self.file_path and self.file_path != config.RDS_PATH:
             info("Cleaning up temp files generated by work result")
-            os.remove(config.TMP_RESULTS_PATH_GZ)
+            os.remove(self.file_path)
+
+    @xray_recorder.capture("Response.publish_cached")
+    def publish_cached(self, data, metadata):
+        """Notifies the clients of a compressed result found in the Redis cache.
+
+        The result is already in S3, so it is not uploaded again. It is sent over
+        the socket like a published one if clients can decode its codec.
+        """
+        info(f"Request {self.request['ETag']} found in Redis, sending it")
+
+        socket_data = None
+        if metadata.get(CODEC_METADATA_KEY) == GzipCodec.name:
+            if self._fits_socket(len(data)):
+                socket_data = data
+
+        self._send_notification(socket_data)
@@ -0,0 +1,117 @@
+import datetime
+import heapq
+import itertools
+import threading
+from logging import info
+
+import dateutil.parser
+import pytz
+
+from .helpers import metrics
+from .tasks import INTERACTIVE
+
+
+def request_deadline(request):
+    """Returns the timeout of a request in UTC, raises if it has none."""
+    return (
+        dateutil.parser.parse(request["timeout"])
+        .astimezone(pytz.utc)
+        .replace(tzinfo=None)
+    )
+
+
+class Scheduler:
+    """Orders requests received from the queue before they are run.
+
+    Requests of tasks with a lower `priority` run first (interactive tasks
+    before bulk exports), then the ones with the earliest timeout. Requests are
+    dropped if their timeout passes while they wait, `on_expired` is called
+    with each of them.
+    """
+
+    def __init__(self, tasks, on_expired=None):
+        self.tasks = tasks
+        self.on_expired = on_expired
+
+        self._heap = []
+        # Requests with the same priority and timeout run in the order received
+        self._order = itertools.count()
+        self._added = threading.Condition()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _priority(self, request):
+        task_class = self.tasks.get(request.get("body", {}).get("name"))
+
+        return INTERACTIVE if task_class is None else task_class.priority
+
+    def add(self, request, trace_header=None):
+        deadline = request_deadline(request)
+
+        with self._added:
+            heapq.heappush(
+                self._heap,
+                (
+                    self._priority(request),
+                    deadline,
+                    next(self._order),
+                    request,
+                    trace_header,
+                ),
+            )
+            self._added.notify()
+
+    def _remove_expired(self):
+        now = datetime.datetime.utcnow()
+        expired = [entry for entry in self._heap if entry[1] <= now]
+
+        if expired:
+            self._heap = [entry for entry in self._heap if entry[1] > now]
+            heapq.heapify(self._heap)
+
+        for _, deadline, _, request, _ in expired:
+            info(
+                f"Skipping processing task with ETag {request['ETag']} "
+                f"as its timeout of {deadline} has expired..."
+            )
+            metrics.increment("scheduler.expired")
+
+        return [request for _, _, _, request, _ in expired]
+
+    def _notify_expired(self, expired):
+        if self.on_expired:
+            for request in expired:
+                self.on_expired(request)
+
+    def drop_expired(self):
+        """Drops the requests whose timeout passed while they wait."""
+        with self._added:
+            expired = self._remove_expired()
+
+        self._notify_expired(expired)
+
+    def pop(self, timeout=0):
+        """Returns the next request and its trace header, or None if there are none.
+
+        Waits up to `timeout` seconds for a request to be added if there are
+        none. All requests whose timeout passed are dropped, not only the ones
+        that would run first.
+        """
+        with self._added:
+            self._added.wait_for(lambda: self._heap, timeout)
+
+            expired = self._remove_expired()
+            scheduled = None
+
+            if self._heap:
+                _, _, _, request, trace_header = heapq.heappop(self._heap)
+                scheduled = request, trace_header
+
+        self._notify_expired(expired)
+
+        return scheduled
+
+    def clear(self):
+        with self._added:
+            self._heap = []
@@ -1,9 +1,29 @@
 from abc import ABC, abstractmethod
 
+# Queued requests of interactive tasks (e.g. plots) run before bulk ones
+INTERACTIVE = 0
+BULK = 1
+
 
 class Task(ABC):
     """A task submitted to the worker."""
 
+    # Tasks that write to a shared file or modify the experiment's cell sets
+    # must not run at the same time as another exclusive task.
+    exclusive = False
+
+    # Tasks that modify the experiment (e.g. its cell sets). When several
+    # workers share the queue of the experiment they run one at a time across
+    # all of them. Mutating tasks must be exclusive too.
+    mutating = False
+
+    # Results of tasks that are not cacheable are not uploaded, so requests
+    # for them are run without looking for an existing result.
+    cacheable = True
+
+    # Queued requests run by priority, then by their timeout
+    priority = INTERACTIVE
+
     def __init__(self, msg):
         self.task_def = msg["body"]
 
@@ -1,18 +1,16 @@
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 import array
-from ..tasks import Task
+from ..tasks import BULK, Task
 from ..result import Result
 from ..config import config
+from ..helpers.clients import clients
 from ..helpers.get_diff_expr_cellsets import get_diff_expr_cellsets
-from ..helpers.s3 import get_cell_sets
-import json
+from ..helpers.s3 import get_cell_set_index
 from exceptions import PythonWorkerException
 
 class BatchDifferentialExpression(Task):
+    priority = BULK
+
     def __init__(self, msg):
             super().__init__(msg)
             self.experiment_id = config.EXPERIMENT_ID
@@ -31,21 +29,18 @@ class BatchDifferentialExpression(Task):
             str(base_cs), str(first_cs), second_cell_set_name, cell_sets
         )
         request = {
-            "baseCells": [int(x) for x in base_cells],
-            "backgroundCells": [int(x) for x in background_cells],
+            "baseCells": base_cells,
+            "backgroundCells": background_cells,
             "genesOnly": self.task_def.get("genesOnly", False),
             "comparisonType": self.task_def.get("comparisonType", "within"),
         }
         return request
 
     @xray_recorder.capture("DifferentialExpression.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
 
     def compute(self):
         # get cell sets from database
-        cell_sets = get_cell_sets(self.experiment_id)
+        cell_sets = get_cell_set_index(self.experiment_id)
         first_cell_set_name = self.task_def["cellSet"]
         second_cell_set_name = self.task_def["compareWith"]
         basis = self.task_def["basis"]
@@ -62,16 +57,7 @@ class BatchDifferentialExpression(Task):
             try:
                 request = self._format_request(base_cs, first_cs, second_cell_set_name, cell_sets)
                  # send request to r worker
-                response = requests.post(
-                    f"{config.R_WORKER_URL}/v0/DifferentialExpression",
-                    headers={"content-type": "application/json"},
-                    data=json.dumps(request),
-                )
-                response.raise_for_status()
-                result = response.json()
-                raise_if_error(result)
-
-                data = result.get("data")
+                data = clients.r_worker.post("DifferentialExpression", request)
             except Exception as e:
                 print(f"Couldnt run Differential Expression for the current comparison, skipping...", e)
                 data = {'full_count': 0, 'gene_results': 'No data available for this comparison'}
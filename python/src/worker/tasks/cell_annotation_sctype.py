@@ -1,17 +1,17 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
 from ..config import config
+from ..helpers.clients import clients
 from ..helpers.s3 import get_cell_sets
 from ..helpers.cell_sets_dict import get_cell_sets_dict_for_r
 from ..result import Result
 from ..tasks import Task
 
 class ScTypeAnnotate(Task):
+    exclusive = True
+    cacheable = False
+    mutating = True
+
     def __init__(self, msg):
         super().__init__(msg)
         self.experiment_id = config.EXPERIMENT_ID
@@ -39,23 +39,10 @@ class ScTypeAnnotate(Task):
 
 
     @xray_recorder.capture("ScTypeAnnotate.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
         request = self._format_request()
 
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/ScTypeAnnotate",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post("ScTypeAnnotate", request)
 
         return self._format_result(data)
 
@@ -1,17 +1,17 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
 from ..config import config
+from ..helpers.clients import clients
 from ..helpers.color_pool import COLOR_POOL
 from ..result import Result
 from ..tasks import Task
 
 
 class ClusterCells(Task):
+    exclusive = True
+    cacheable = False
+    mutating = True
+
     def __init__(self, msg):
         super().__init__(msg)
         self.colors = COLOR_POOL.copy()
@@ -35,23 +35,10 @@ class ClusterCells(Task):
         return request
 
     @xray_recorder.capture("ClusterCells.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
 
         request = self._format_request()
 
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/getClusters",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post("getClusters", request)
 
         return self._format_result(data)
@@ -1,14 +1,10 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
 from ..config import config
+from ..helpers.clients import clients
 from ..helpers.get_diff_expr_cellsets import get_diff_expr_cellsets
 from ..helpers.remove_regex import remove_regex
-from ..helpers.s3 import get_cell_sets
+from ..helpers.s3 import get_cell_set_index
 from ..result import Result
 from ..tasks import Task
 
@@ -30,7 +26,7 @@ class DifferentialExpression(Task):
 
     def _format_request(self):
         # get cell sets from database
-        cell_sets = get_cell_sets(self.experiment_id)
+        cell_sets = get_cell_set_index(self.experiment_id)
         first_cell_set_name = self.task_def["cellSet"]
         second_cell_set_name = self.task_def["compareWith"]
         basis_name = self.task_def["basis"]
@@ -40,8 +36,8 @@ class DifferentialExpression(Task):
         )
 
         request = {
-            "baseCells": [int(x) for x in baseCells],
-            "backgroundCells": [int(x) for x in backgroundCells],
+            "baseCells": baseCells,
+            "backgroundCells": backgroundCells,
             "genesOnly": self.task_def.get("genesOnly", False),
             "comparisonType": self.task_def.get("comparisonType", "within"),
         }
@@ -59,24 +55,11 @@ class DifferentialExpression(Task):
         return request
 
     @xray_recorder.capture("DifferentialExpression.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
 
         request = self._format_request()
 
         # send request to r worker
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/DifferentialExpression",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post("DifferentialExpression", request)
 
         return self._format_result(data)
@@ -1,11 +1,6 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
-from ..config import config
+from ..helpers.clients import clients
 from ..result import Result
 from ..tasks import Task
 
@@ -16,9 +11,6 @@ class GetDoubletScore(Task):
         return Result(result)
 
     @xray_recorder.capture("DoubletScore.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def _format_request(self):
         return {}
 
@@ -26,16 +18,6 @@ class GetDoubletScore(Task):
 
         # Retrieve the Doublet Score of all the cells
         request = self._format_request()
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/getDoubletScore",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post_raw("getDoubletScore", request)
 
         return self._format_result(data)
@@ -1,20 +1,19 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
 from ..config import config
+from ..helpers.clients import clients
 from ..result import Result
-from ..tasks import Task
-from ..helpers.s3 import get_embedding, get_cell_sets
+from ..tasks import BULK, Task
+from ..helpers.s3 import get_embedding_array, get_cell_sets
 from ..helpers.cell_sets_dict import get_cell_sets_dict_for_r
 
 import os
 
 
 class DownloadAnnotSeuratObject(Task):
+    exclusive = True
+    priority = BULK
+
     def __init__(self, msg):
         super().__init__(msg)
         self.experiment_id = config.EXPERIMENT_ID
@@ -35,7 +34,7 @@ class DownloadAnnotSeuratObject(Task):
             embedding = None
         else:
             embedding_etag = self.task_def["embeddingETag"]
-            embedding = get_embedding(embedding_etag, format_for_r=True)
+            embedding = get_embedding_array(embedding_etag)
 
         request = {
             "embedding": embedding,
@@ -47,21 +46,10 @@ class DownloadAnnotSeuratObject(Task):
         return request
 
     @xray_recorder.capture("DownloadAnnotSeuratObject.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
         request = self._format_request()
 
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/DownloadAnnotSeuratObject",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
+        clients.r_worker.post("DownloadAnnotSeuratObject", request)
 
         return self._format_result(config.RDS_PATH)
     
\ No newline at end of file
@@ -1,11 +1,6 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
-from ..config import config
+from ..helpers.clients import clients
 from ..result import Result
 from ..tasks import Task
 
@@ -24,22 +19,9 @@ class GetEmbedding(Task):
         return request
 
     @xray_recorder.capture("ComputeEmbedding.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
         request = self._format_request()
 
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/getEmbedding",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post_raw("getEmbedding", request)
 
         return self._format_result(data)
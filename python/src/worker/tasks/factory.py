@@ -58,6 +58,7 @@ class TaskFactory:
     def __init__(self):
         self.count_matrix = CountMatrix()
         self.count_matrix.sync()
+        self.count_matrix.watch()
 
     def submit(self, msg):
         task = self._factory(msg)
@@ -88,7 +89,7 @@ class TaskFactory:
             )
 
     def _factory(self, msg) -> Task:
-        self.count_matrix.sync()
+        self.count_matrix.ensure_synced()
         task_def = msg.get("body", {})
         task_name = task_def.get("name")
 
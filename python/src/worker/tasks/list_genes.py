@@ -1,11 +1,6 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
-from ..config import config
+from ..helpers.clients import clients
 from ..helpers.remove_regex import remove_regex
 from ..result import Result
 from ..tasks import Task
@@ -34,23 +29,10 @@ class ListGenes(Task):
         return request
 
     @xray_recorder.capture("ListGenes.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
         request = self._format_request()
 
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/listGenes",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post("listGenes", request)
 
         total = data["full_count"]
         result = data["gene_results"]
@@ -1,11 +1,6 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
-from ..config import config
+from ..helpers.clients import clients
 from ..result import Result
 from . import Task
 
@@ -16,9 +11,6 @@ class GetNGenes(Task):
         return Result(result)
 
     @xray_recorder.capture("GetNGenes.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def _format_request(self):
         return {}
 
@@ -26,16 +18,6 @@ class GetNGenes(Task):
 
         # Retrieve the number of genes of all the cells
         request = self._format_request()
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/getNGenes",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post_raw("getNGenes", request)
 
         return self._format_result(data)
@@ -1,17 +1,17 @@
-import json
-
-import backoff
-import requests
 from aws_xray_sdk.core import xray_recorder
-from exceptions import raise_if_error
 
 from ..config import config
-from ..helpers.s3 import get_cell_sets
-from ..helpers.cell_sets_dict import get_cell_sets_dict, subset_cell_sets_dict
+from ..helpers.clients import clients
+from ..helpers.s3 import get_cell_set_index
+from ..helpers.cell_set_index import intersection
+from ..helpers.cell_sets_dict import subset_cell_sets_dict
 from ..result import Result
-from ..tasks import Task
+from ..tasks import BULK, Task
 
 class GetNormalizedExpression(Task):
+    exclusive = True
+    priority = BULK
+
     def __init__(self, msg):
         super().__init__(msg)
         self.experiment_id = config.EXPERIMENT_ID
@@ -22,7 +22,7 @@ class GetNormalizedExpression(Task):
     def _format_request(self):
         subset_by = self.task_def["subsetBy"]
 
-        cell_sets = get_cell_sets(self.experiment_id)
+        cell_set_index = get_cell_set_index(self.experiment_id)
 
         # categories should be ["sample", "louvain", "metadata", "scratchpad"] (in no particular order)
         categories = list(subset_by.keys())
@@ -33,39 +33,24 @@ class GetNormalizedExpression(Task):
         if (all(len(subset_by[category]) == 0 for category in categories)):
             return { "subsetBy": None, "applySubset": False }
 
-        cell_sets_dict = get_cell_sets_dict(cell_sets)
-
         # Get the sets of cell ids to subset by for each category
         for category in categories:
             if (len(subset_by[category]) == 0):
                 continue
 
-            cell_ids = subset_cell_sets_dict(subset_by[category], cell_sets_dict)
+            cell_ids = subset_cell_sets_dict(subset_by[category], cell_set_index)
             cell_ids_to_intersect.append(cell_ids)
 
         # Intersect all sets of cell ids from different categories
-        cell_ids = cell_ids_to_intersect[0].intersection(*cell_ids_to_intersect[1:])
+        cell_ids = intersection(*cell_ids_to_intersect)
 
-        return { "subsetBy": list(cell_ids), "applySubset": True }
+        return { "subsetBy": cell_ids, "applySubset": True }
 
     @xray_recorder.capture("GetNormalizedExpression.compute")
-    @backoff.on_exception(
-        backoff.expo, requests.exceptions.RequestException, max_time=30
-    )
     def compute(self):
         request = self._format_request()
 
-        response = requests.post(
-            f"{config.R_WORKER_URL}/v0/GetNormalizedExpression",
-            headers={"content-type": "application/json"},
-            data=json.dumps(request),
-        )
-
-        response.raise_for_status()
-        result = response.json()
-        raise_if_error(result)
-
-        data = result.get("data")
+        data = clients.r_worker.post("GetNormalizedExpression", request)
 
         return self._format_result(data)
 